@@ -3,6 +3,10 @@
  * EPIC Robotz, dlb, Feb 2021
  * 
  * Version 1.0 -- Fully Working version with reset feature
+ * Version 1.1 -- Block reads: a read returns all registers from the requested
+ *                address up to REG_LAST in one transaction.  Signature is 'g'.
+ * Version 1.2 -- Block writes: a write of several data bytes fills consecutive
+ *                registers starting at the given address.  Signature is 'h'.
  * 
  * The configuration is assumed to be:  PC -> (wifi) -> Raspberry pi -> Ardunio -> Hardware.
  * The Raspberry Pi (pi) and the Ardunio communicate over a SPI connection.
@@ -39,11 +43,25 @@
  * can be read or writen to by a master.  The arduino is the slave.  The set of registors
  * are defined in a table below.  Each address has a name according to its function.
  *
+ * Block Reads
+ * -----------
+ * Starting with signature 'g', a read request returns the requested register
+ * followed by all the registers after it (auto-increment), up to REG_LAST.  A
+ * master that only wants one byte simply stops after the first one, so the
+ * older single register protocol still works.  Block reads that include the
+ * first timestamp byte latch the timestamp, so all four bytes are consistent.
+ *
+ * Block Writes
+ * ------------
+ * Starting with signature 'h', a write may carry more than one data byte.  The
+ * bytes are written to consecutive registers, starting at the given address.
+ * This allows all three PWM outputs to be set in one transaction.
+ *
  * Table of I2C Registers  
  * ----------------------
  *      Name      Addr      R/W?  Purpose/Usage
  *      --------  ----      ----  -------------   */
-#define REG_SIGV     0   // RO  Device Signature/Version.  Currently: 'e'
+#define REG_SIGV     0   // RO  Device Signature/Version.  Currently: 'h'
 #define REG_BAT_M    1   // RO  Battery Voltage of Motor battery (in units of 10ths of volts)
 #define REG_DTME1    2   // RO  Device Time, Milliseconds, Byte 0, MSB
 #define REG_DTME2    3   // RO  Device Time, Milliseconds, Byte 1
@@ -71,7 +89,7 @@
 
 void (* resetFunc) (void) = 0;
 
-char version = 'f';
+char version = 'h';
 
 int ardunio_ic2_addr = 0x8;  // Sets the address of this arduino for the RPi to access
 int bat_motor_input_pin = A0;
@@ -147,45 +165,54 @@ void loop() {
 // --------------------------------------------------------------------
 // receivePiCmd() 
 // This is a callback from the I2C lib when the arduino receives data from the RPi.
+// A one byte message sets the register address for the next read.  Longer
+// messages write the data bytes into consecutive registers.
 void receivePiCmd(int msglen) {
   timelastcomm = millis();
   reccnt++;
-  if (msglen == 1) {
-    regaddr = Wire.read();
-    if (regaddr < 0 || regaddr > REG_LAST) {
-      badmsgcount++;
-      regaddr = 0;
-    }
-    return;
-  }
-  if (msglen != 2) {
+  if (msglen < 1) {
     badmsgcount++;
     return;
   }
   regaddr = Wire.read();
-  int dat = Wire.read();
   if (regaddr < 0 || regaddr > REG_LAST) {
     badmsgcount++;
+    regaddr = 0;
     return;
   }
-  if (regaddr < REG_RW0 || regaddr == REG_BAT_L) {
+  for (int i = 1; i < msglen; i++) {
+    int dat = Wire.read();
+    int addr = regaddr + i - 1;
+    if (addr > REG_LAST) {
+      badmsgcount++;
+      continue;
+    }
+    write_reg(addr, dat);
+  }
+}
+
+// --------------------------------------------------------------------
+// write_reg() 
+// Writes one byte, received from the RPi, into a register.
+void write_reg(int addr, int dat) {
+  if (addr < REG_RW0 || addr == REG_BAT_L) {
     // Trying to write into a read only reg.  Ignore this.
     return;
   }
-  if (regaddr == REG_SCC) {
+  if (addr == REG_SCC) {
     // Special processing for clearing the change registor.
     regs[REG_SC] = regs[REG_SC] & dat;
   }
-  if (regaddr == REG_PWM9) {
+  if (addr == REG_PWM9) {
     analogWrite(9, dat);
   }
-  if (regaddr == REG_PWM10) {
+  if (addr == REG_PWM10) {
     analogWrite(10, dat);
   }
-  if (regaddr == REG_PWM11) {
+  if (addr == REG_PWM11) {
     analogWrite(11, dat);
   }
-  regs[regaddr] = dat;
+  regs[addr] = dat;
 }
 
 // --------------------------------------------------------------------
@@ -205,38 +232,40 @@ void pi_restart() {
     }
 }
 
+// --------------------------------------------------------------------
+// reg_value()
+// Returns the byte that is sent to the RPi for the given register.  Most
+// registers come straight from regs[], but a few are computed on the fly.
+// The timestamp bytes come from timesend[], which must be latched first.
+volatile byte timesend[4];
+byte reg_value(int addr) {
+  if (addr == REG_SIGV) return version;
+  if (addr == REG_BAT_M) return (byte) (batvolts_motor * 10);
+  if (addr == REG_BAT_L) return (byte) (batvolts_logic * 10);
+  if (addr >= REG_DTME1 && addr <= REG_DTME4) return timesend[addr - REG_DTME1];
+  return regs[addr];
+}
+
 // --------------------------------------------------------------------
 // sendPiData()  
 // This is a callback from the I2C lib when the arduino has been commanded
 // by the RPi to send data back.  The register number of the data to send was
 // previously communicated on a receive command, and is stored in regaddr.
-volatile byte timesend[4];
+// All registers from regaddr to REG_LAST are sent, so that the RPi can
+// read as many of them as it wants in one transaction.
 void sendPiData() {
+  byte buf[REG_LAST + 1];
   sendcnt++;
-  if (regaddr == REG_SIGV) {Wire.write(version); return; }
-  if (regaddr == REG_BAT_M) {
-    int i = batvolts_motor * 10;
-    Wire.write(i); 
-    return;
-  }
-  if (regaddr == REG_BAT_L) {
-    int i = batvolts_logic * 10;
-    Wire.write(i); 
-    return;
-  }
-  if (regaddr == REG_DTME1) {
+  if (regaddr <= REG_DTME1) {
     long ttfix = millis();
     timesend[0] = ((byte *)&ttfix)[0];
     timesend[1] = ((byte *)&ttfix)[1];
     timesend[2] = ((byte *)&ttfix)[2];
     timesend[3] = ((byte *)&ttfix)[3];
   }
-  if (regaddr >= REG_DTME1 && regaddr <= REG_DTME4) {
-    Wire.write(timesend[regaddr - REG_DTME1]);
-    delayMicroseconds(10);  // For some reason, this makes it work reliably.
-    return;
-  }
-  Wire.write(regs[regaddr]);
+  int n = 0;
+  for (int i = regaddr; i <= REG_LAST; i++) buf[n++] = reg_value(i);
+  Wire.write(buf, n);
   delayMicroseconds(10); // For some reason, this makes it work reliably.
 }
 
@@ -4,6 +4,11 @@
 # Version 1.0: Fully working with one or two joystick/gamepad inputs.
 # Version 1.1: Revamped joystick driver code
 # Version 1.2: Added outside user class
+# Version 1.3: Added loop timing panel
+# Version 1.4: Added reload of the user code
+# Version 1.5: Joystick topics sent as binary frames (ControlFormat = text for older robots)
+# Version 1.6: Mode and joysticks sent together in one control frame per tick
+# Version 1.7: Control frames carry the time they were sent
 #
 # NOTE: This version supports ONE or TWO joysticks/gamepad inputs.
 # The widget layout changes accordingly.  With one joystick, the layout
@@ -17,6 +22,7 @@ import tkinter as tk
 import tkinter.font as tkFont
 import threading
 import time
+import random
 
 # -- Our imports...
 import joystick
@@ -28,14 +34,16 @@ import hardwarestatuswidget
 import commstatuswidget
 import botstatuswidget
 import arduinostatuswidget
+import perfstatuswidget
+import perfstats
 import arduino_decode as adec
 import dscolors
 from utils import *
 
 LOGITECH = "Logitech 3D Pro"
 XBOX = "XBox Gamepad"
-winsize_1_joystick = (270, 860)
-winsize_2_joystick = (530, 610)
+winsize_1_joystick = (270, 1076)
+winsize_2_joystick = (530, 826)
 winsize = winsize_1_joystick  # Default
 
 class DSConfiguration():
@@ -54,6 +62,7 @@ class DSConfiguration():
       self.number_of_joysticks = parser["Robot"].getint("NumberOfJoysticks", 1)
       self.joystick_port_1 = parser["Robot"].get("JoystickPort1", "Logitech")
       self.joystick_port_2 = parser["Robot"].get("JoystickPort2", "XBox")
+      self.control_format = parser["Robot"].get("ControlFormat", "frame")
     except Exception as e:
       print("Error in configuration file.")
       print(e)
@@ -73,6 +82,15 @@ class DriveStation(tk.Frame):
           print("Invalid number of joysticks (%d). Only 1 or 2 allowed." % self.config.number_of_joysticks)
           print("Please fix configuration file.")
           sys.exit()
+        if self.config.control_format not in ("frame", "binary", "text"):
+          print("Invalid control format (%s). Valid formats are: frame, binary or text." % self.config.control_format)
+          print("Please fix configuration file.")
+          sys.exit()
+        self.binary_controls = self.config.control_format == "binary"
+        self.control_frame = None
+        if self.config.control_format == "frame":
+          self.control_frame = mqttrobot.ControlFrame()
+          self.control_frame.session = random.randint(0, 0xFFFF)
         if self.config.joystick_port_1 == "Logitech":
           self.joysticks.append(joystick.Joystick(LOGITECH, 0))
         elif self.config.joystick_port_1 == "XBox":
@@ -102,8 +120,12 @@ class DriveStation(tk.Frame):
         self.last_cmd_send_time = time.monotonic() - 100.0
         self.last_arduino_status = time.monotonic() - 100.0
         self.last_arduino_ui_update = time.monotonic() - 100.0
+        self.last_perf_status = time.monotonic() - 100.0
+        self.last_perf_ui_update = time.monotonic() - 100.0
+        self.perf_data = None
         self.arduino_data = None
         self.arduino_reset_flag = False
+        self.user_reload_flag = False
         self.run_loop_cnt = 0
         self.quitbackgroundtasks = False
         self.bg_count = 0
@@ -119,8 +141,10 @@ class DriveStation(tk.Frame):
         self.hwstatus = hardwarestatuswidget.HardwareStatusWidget(self)
         self.gameclock = gameclockwidget.GameClockWidget(self)
         self.commstatus = commstatuswidget.CommStatusWidget(self)
-        self.botstatus = botstatuswidget.BotStatusWidget(self, reset_callback=self.do_arduino_reset)
+        self.botstatus = botstatuswidget.BotStatusWidget(self, reset_callback=self.do_arduino_reset,
+            reload_callback=self.do_user_reload)
         self.arduinostatus = arduinostatuswidget.ArduinoStatusWidget(self)
+        self.perfstatus = perfstatuswidget.PerfStatusWidget(self)
         self.joystick_widgets = []
         for joy in self.joysticks:
           if joy.get_name() == LOGITECH:
@@ -171,6 +195,9 @@ class DriveStation(tk.Frame):
         else: y += h + 10
         w, h = self.arduinostatus.get_size()
         self.arduinostatus.place(x=x, y=y, width=w, height=h)
+        y += h + 10
+        w, h = self.perfstatus.get_size()
+        self.perfstatus.place(x=x, y=y, width=w, height=h)
   
     def layout_for_two_joysticks(self):
         ''' Do the layout for two joysticks '''
@@ -204,8 +231,11 @@ class DriveStation(tk.Frame):
         w2, h2 = self.botstatus.get_size()
         self.botstatus.place(x=x2, y=y, width=w2, height=h2)
         x3 = x2 + w2 + xpad
-        w, h = self.arduinostatus.get_size()
-        self.arduinostatus.place(x=x3, y=y, width=w, height=h)
+        w3, h3 = self.arduinostatus.get_size()
+        self.arduinostatus.place(x=x3, y=y, width=w3, height=h3)
+        y += max(h, h2, h3) + 10
+        w, h = self.perfstatus.get_size()
+        self.perfstatus.place(x=x, y=y, width=w, height=h)
 
     def set_mqtt_fields_off(self):
         # Do this once here to avoid stupid updates in the background loop
@@ -222,6 +252,7 @@ class DriveStation(tk.Frame):
             self.botstatus.set_field("I2CErrs", "---")
             self.botstatus.set_field("Recovers", "---")
             self.botstatus.set_field("CodeVer", "---")
+            self.botstatus.set_field("Reload", "---")
 
     def setup_mqtt(self, enable):
       ''' Do the setup for MQTT. '''
@@ -231,6 +262,16 @@ class DriveStation(tk.Frame):
       self.mqtt = mqttrobot.MqttRobot()
       self.mqtt.register_topic("wbot/status", self.on_bot_status)
       self.mqtt.register_topic("wbot/arduino", self.on_arduino_data)
+      self.mqtt.register_topic("wbot/perf", self.on_perf_data)
+      self.mqtt.register_publish("wbot/control", mqttrobot.profile_stream)
+      self.mqtt.register_publish("wbot/mode", mqttrobot.profile_command)
+      self.mqtt.register_publish("wbot/pingbot", mqttrobot.profile_command)
+      for i in range(2):
+        # Axes are sent whenever they move, so only the newest matters.  Buttons
+        # and pov are only sent when they change, so none can be lost.
+        self.mqtt.register_publish("wbot/joystick%d/axes" % i, mqttrobot.profile_stream)
+        self.mqtt.register_publish("wbot/joystick%d/buttons" % i, mqttrobot.profile_command)
+        self.mqtt.register_publish("wbot/joystick%d/pov" % i, mqttrobot.profile_command)
 
     def ping_setup(self):
         ''' Sets up the variables for the ping test. '''
@@ -286,8 +327,15 @@ class DriveStation(tk.Frame):
       self.last_arduino_status = time.monotonic() 
       self.arduino_data = data
     
+    def on_perf_data(self, topic, data):
+      self.last_perf_status = time.monotonic()
+      self.perf_data = data
+
     def do_arduino_reset(self):
       self.arduino_reset_flag = True
+
+    def do_user_reload(self):
+      self.user_reload_flag = True
       
     def monitor_mqtt(self):
         ''' Monitors activity of mqtt, and reports it to the ui. '''
@@ -334,6 +382,7 @@ class DriveStation(tk.Frame):
         self.botstatus.set_field("I2CErrs", "---")
         self.botstatus.set_field("Recovers", "---")
         self.botstatus.set_field("CodeVer",  "---")
+        self.botstatus.set_field("Reload", "---")
         return
       timenow = time.monotonic()
       if timenow - t0 > 10.0 or timenow - t1 > 9.0:
@@ -346,6 +395,7 @@ class DriveStation(tk.Frame):
         self.botstatus.set_field("I2CErrs", "---")
         self.botstatus.set_field("Recovers", "---")
         self.botstatus.set_field("CodeVer",  "---")
+        self.botstatus.set_field("Reload", "---")
         return
       elif timenow - t0 > 4.0 or timenow - t1 > 3.0:
         self.hwstatus.set_status("Code", dscolors.status_warn)
@@ -364,6 +414,7 @@ class DriveStation(tk.Frame):
         self.botstatus.set_field("I2CErrs", "---")
         self.botstatus.set_field("Recovers", "---")
         self.botstatus.set_field("CodeVer",  "---")
+        self.botstatus.set_field("Reload", "---")
         return
       bat_m = bat_l = 0.0
       try:
@@ -410,6 +461,13 @@ class DriveStation(tk.Frame):
         self.botstatus.set_field("CodeVer", words[7])
       else:
         self.botstatus.set_field("CodeVer", "---")
+      reload_text = "---"
+      if len(words) >= 10:
+        try:
+          if int(words[8]) > 0: reload_text = "%.0f ms" % float(words[9])
+        except ValueError:
+          reload_text = "---"
+      self.botstatus.set_field("Reload", reload_text)
 
     def monitor_arduino(self):
       timenow = time.monotonic()
@@ -463,20 +521,58 @@ class DriveStation(tk.Frame):
       else:
         self.arduinostatus.set_field("XXX", "---")
 
+    def monitor_perf(self):
+      timenow = time.monotonic()
+      if timenow - self.last_perf_ui_update < 1.0: return
+      self.last_perf_ui_update = timenow
+      if timenow - self.last_perf_status > 4.0 or self.perf_data == None:
+        self.perfstatus.set_all_fields("---")
+        return
+      self.perfstatus.set_phases(perfstats.parse_perf(self.perf_data))
+
     def send_loop_cmd(self):
       ''' Sends loop command to bot if we have mqtt.  Send the
       loop command once every 0.5 seconds. '''
       if not self.mqtt: return
       timenow = time.monotonic()
-      if timenow - self.last_cmd_send_time < 0.50 and not self.arduino_reset_flag: return
+      urgent = self.arduino_reset_flag or self.user_reload_flag
+      if timenow - self.last_cmd_send_time < 0.50 and not urgent: return
       self.last_cmd_send_time = timenow 
       cmdstr, tme_to_go = self.gameclock.get_botcmd()
       auxcmd = "NoOp"
       if self.arduino_reset_flag: auxcmd = "RestartArduino"
+      elif self.user_reload_flag: auxcmd = "ReloadUser"
       self.arduino_reset_flag = False
+      self.user_reload_flag = False
       s = ("%s %d %7.2f %s" % (cmdstr, self.run_loop_cnt, tme_to_go, auxcmd))
       self.mqtt.publish("wbot/mode", s)
   
+    def send_control_frame(self, btns_list, axes_list, pov_list):
+      ''' Sends the mode and both joysticks to the bot in one frame on
+      wbot/control.  Called on every pass of the background loop.  The frame
+      is stamped with the time it is sent, so the bot can tell how old it is.
+      Nothing retries a frame, and the next one replaces it, so a one-shot
+      aux command is sent right away with the loop command on wbot/mode
+      instead, which is delivered reliably.  The aux in the frames is always
+      NoOp.  The frames are sent as a stream, except that a frame with a new
+      mode is sent as a command, so the mode change can not be lost or
+      replaced by a newer frame before it is sent. '''
+      if self.arduino_reset_flag or self.user_reload_flag: self.send_loop_cmd()
+      f = self.control_frame
+      f.seq += 1
+      last_mode = f.mode
+      f.mode, f.time_to_go = self.gameclock.get_botcmd()
+      f.ds_loop = self.run_loop_cnt
+      f.aux = "NoOp"
+      for i in range(2):
+        f.axes[i] = axes_list[i]
+        f.buttons[i] = btns_list[i]
+        f.povs[i] = pov_list[i]
+      f.t_sent = time.monotonic()
+      profile = None
+      if f.mode != last_mode: profile = mqttrobot.profile_command
+      self.mqtt.publish("wbot/control", f.encode(), profile)
+
     def background_run(self):
         ''' Runs in the background, doing the main activity: sending
         joystick inputs to the pi, and keeping the ui up to date. '''
@@ -485,6 +581,7 @@ class DriveStation(tk.Frame):
             self.monitor_mqtt()
             self.monitor_botstatus()
             self.monitor_arduino()
+            self.monitor_perf()
             joysticks_okay = True
             btns_list = []
             axes_list = []
@@ -518,7 +615,9 @@ class DriveStation(tk.Frame):
                 self.hwstatus.set_status("Joystick", dscolors.status_okay)
             else:
                 self.hwstatus.set_status("Joystick", dscolors.status_error)
-            if self.mqtt:
+            if self.mqtt and self.control_frame:
+                self.send_control_frame(btns_list, axes_list, pov_list)
+            elif self.mqtt:
                 self.send_loop_cmd()
                 # send out joystick values to robot here...
                 for i in range(2):
@@ -527,18 +626,15 @@ class DriveStation(tk.Frame):
                   pov = pov_list[i]
                   if btns != self.last_btns[i]:
                     self.last_btns[i] = btns
-                    s = ""
-                    for ib in btns:
-                        if ib: s += "T " 
-                        else: s += "F "
+                    s = mqttrobot.encode_buttons(btns, self.binary_controls)
                     self.mqtt.publish("wbot/joystick%d/buttons" % i, s)
                   if not same_in_tolerance(axes, self.last_axes[i]):
                     self.last_axes[i] = axes
-                    s = "%7.4f %7.4f %7.4f %7.4f %7.4f %7.4f" % tuple(axes)
+                    s = mqttrobot.encode_axes(axes, self.binary_controls)
                     self.mqtt.publish("wbot/joystick%d/axes" % i, s)
                   if pov != self.last_pov[i]:
                     self.last_pov[i] = pov
-                    s = "%d %d" % pov
+                    s = mqttrobot.encode_pov(pov, self.binary_controls)
                     self.mqtt.publish("wbot/joystick%d/pov" % i, s)
             self.bg_count += 1
             # if self.bg_count % 100 == 0: print("Background Loop: %d." % self.bg_count)
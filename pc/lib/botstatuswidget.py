@@ -6,16 +6,17 @@ import tkinter.font as tkFont
 import dscolors
 
 # Constants to control the layout of the diagram:
-desiredsize = (120, 150) # desired size of widget for placing
-horz_px, vert_px = 120, 150 # size of canvas
+desiredsize = (120, 170) # desired size of widget for placing
+horz_px, vert_px = 120, 170 # size of canvas
 lineheight = 18 # height between fields
 namewidth = 105  # size of the field name
 xmargin = 2 # x margin for start of field name
-loc_rstbtn = (55, 123)
-fields = ("Bat M", "Bat L", "I2CErrs", "Recovers", "CodeVer")
+loc_rstbtn = (58, 141)
+loc_rldbtn = (2, 141)
+fields = ("Bat M", "Bat L", "I2CErrs", "Recovers", "CodeVer", "Reload")
 
 class BotStatusWidget(tk.Frame):
-    def __init__(self, parent, reset_callback=None):
+    def __init__(self, parent, reset_callback=None, reload_callback=None):
         tk.Frame.__init__(self, parent, borderwidth=2, relief="groove", bg=dscolors.widget_bg)
         self._resetcb = None
         self._canvas = tk.Canvas(self, width=horz_px, height=vert_px, borderwidth=0,
@@ -28,6 +29,11 @@ class BotStatusWidget(tk.Frame):
         x, y = loc_rstbtn
         self._rstbtn.place(x=x, y=y)
         self._resetcb = reset_callback
+        self._rldbtn = tk.Button(self, text="Reload Code", 
+            font=self._smfont, width=8, bg=dscolors.button_bg, command=self._on_reload)
+        x, y = loc_rldbtn
+        self._rldbtn.place(x=x, y=y)
+        self._reloadcb = reload_callback
         self._font1 = tkFont.Font(family="Lucida Grande", weight="bold", size=10)
         self._font2 = tkFont.Font(family="Lucida Grande", size=8)
         self._font3 = tkFont.Font(family="Lucida Grande", weight="bold", size=10)
@@ -47,6 +53,10 @@ class BotStatusWidget(tk.Frame):
         ''' Reset the arduino.'''
         if self._resetcb: self._resetcb()
 
+    def _on_reload(self):
+        ''' Reload the user code on the robot.'''
+        if self._reloadcb: self._reloadcb()
+
     def get_size(self):
         ''' Returns the desired size for this widget. '''
         return desiredsize
@@ -0,0 +1,59 @@
+# perfstatuswidget.py -- Widget to display the robot's loop timing
+# EPIC Robotz, dlb, Apr 2021
+
+import tkinter as tk
+import tkinter.font as tkFont
+import dscolors
+
+# Constants to control the layout of the diagram:
+desiredsize = (250, 186) # desired size of widget for placing
+horz_px, vert_px = 240, 186 # size of canvas
+lineheight = 18 # height between fields
+namewidth = 235  # size of the field name
+xmargin = 2 # x margin for start of field name
+# Each field is (label, phase name on the wbot/perf topic)
+fields = (("I2C Check", "check_i2cbus"), ("Inputs", "update_inputs"),
+    ("Joystick", "control_inputs"), ("User Code", "user"), ("Outputs", "flush_outputs"),
+    ("Telemetry", "telemetry"), ("Reports", "report_to_ds"), ("Tick", "tick"))
+
+class PerfStatusWidget(tk.Frame):
+    def __init__(self, parent):
+        tk.Frame.__init__(self, parent, borderwidth=2, relief="groove", bg=dscolors.widget_bg)
+        self._canvas = tk.Canvas(self, width=horz_px, height=vert_px, borderwidth=0,
+            highlightthickness=0, background=dscolors.widget_bg)
+        self._canvas.pack(padx=2, pady=5)
+        self._font1 = tkFont.Font(family="Lucida Grande", weight="bold", size=10)
+        self._font2 = tkFont.Font(family="Lucida Grande", size=8)
+        self._font3 = tkFont.Font(family="Lucida Grande", weight="bold", size=10)
+        self._title = self._canvas.create_text(2, 7, anchor=tk.W, text="Loop Timing",
+                font=self._font1, fill="black")
+        self._heading = self._canvas.create_text(namewidth, 7, anchor=tk.E,
+                text="p50 / p99 / max ms", font=self._font2, fill=dscolors.label_black)
+        self._fields = []
+        x, y = xmargin, int(1.7*lineheight)
+        for name, phase in fields:
+            fname = self._canvas.create_text(x, y, anchor=tk.W, text=name+":", font=self._font2,
+                fill=dscolors.label_black)
+            fvalue = self._canvas.create_text(x + namewidth, y, anchor=tk.E, text="---",
+                font=self._font3, fill="black")
+            self._fields.append( (phase, fname, fvalue) )
+            y += lineheight
+
+    def get_size(self):
+        ''' Returns the desired size for this widget. '''
+        return desiredsize
+
+    def set_phases(self, phases):
+        ''' Sets the fields from a dict, where the keyword is the phase name,
+        and the value is (p50, p99, max) in milliseconds.  Phases that are
+        missing are shown as "---". '''
+        for phase, _, fvalue in self._fields:
+            if phase in phases:
+                self._canvas.itemconfig(fvalue, text="%.2f / %.2f / %.2f" % phases[phase])
+            else:
+                self._canvas.itemconfig(fvalue, text="---")
+
+    def set_all_fields(self, value):
+        ''' Sets all the fields to the same value.'''
+        for _, _, fvalue in self._fields:
+            self._canvas.itemconfig(fvalue, text=value)
@@ -0,0 +1,141 @@
+# bench_alloc.py -- measure the memory allocated by each task of the main loop, per tick
+# EPIC Robotz, dlb, Apr 2021
+#
+# Builds the robot from runbot.py (without user code), feeds it joystick and
+# mode messages as if from the driver station, and runs its ticks.  Each task
+# is wrapped so that the memory it allocates is measured with tracemalloc:
+# the peak bytes allocated during the call (garbage that was made and freed
+# counts too), and the number of new objects left behind for the garbage
+# collector.  Then the loop is run again with automatic and managed garbage
+# collection, and the number of collections that happened inside a tick is
+# counted for each.
+#
+# Run on the Pi, with the hardware connected.
+#
+# usage: python3 bench_alloc.py [ticks] [msg_every]
+
+import os
+import sys
+import gc
+import time
+import tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import runbot
+import gcmanager
+
+ticks = 2000
+msg_every = 5   # ticks between joystick messages
+if len(sys.argv) > 1:
+  ticks = int(sys.argv[1])
+if len(sys.argv) > 2:
+  msg_every = int(sys.argv[2])
+
+class FakeMessage():
+  ''' Looks enough like a paho message for MqttRobot._on_message. '''
+  def __init__(self, topic, text):
+    self.topic = topic
+    self.payload = text.encode("ascii")
+
+def send_ds_messages(bot, n):
+  ''' Delivers a mode message and a new set of joystick messages to the bot,
+  as the driver station would.  The axes move a little each time. '''
+  x = (n % 100) / 100.0
+  msgs = (("wbot/mode", "TELEOP %d 100.0" % n),
+    ("wbot/joystick0/buttons", "T F F F F F F F F F F F"), ("wbot/joystick1/buttons", "F F F F F F F F F F F T"),
+    ("wbot/joystick0/axes", "%.3f 0.000 0.000 0.000 0.000 0.000" % x),
+    ("wbot/joystick1/axes", "0.000 %.3f 0.000 0.000 0.000 0.000" % x),
+    ("wbot/joystick0/pov", "0 0"), ("wbot/joystick1/pov", "0 1"))
+  for topic, text in msgs:
+    bot.mqtt._on_message(None, None, FakeMessage(topic, text))
+
+class AllocStats():
+  def __init__(self):
+    self.runs = 0
+    self.peak_sum = 0
+    self.peak_max = 0
+    self.left_sum = 0
+
+  def add(self, peak, left):
+    self.runs += 1
+    self.peak_sum += peak
+    self.left_sum += left
+    if peak > self.peak_max: self.peak_max = peak
+
+def measured(func, stats):
+  ''' Returns a wrapper for a task function that measures its allocations. '''
+  def wrapper():
+    tracemalloc.clear_traces()
+    n0 = gc.get_count()[0]
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    stats.add(peak, gc.get_count()[0] - n0)
+  return wrapper
+
+bot = runbot.WaterBotBase(None)
+if not bot.hw_okay:
+  print("Hardware not okay.  The hardware tasks will not be measured!")
+
+# Part 1: allocations per task.
+stats = {}
+originals = {}
+for task in bot.tasks._tasks:
+  stats[task.name] = AllocStats()
+  originals[task.name] = task.func
+  task.func = measured(task.func, stats[task.name])
+gc.disable()
+tracemalloc.start()
+for n in range(ticks):
+  if n % msg_every == 0: send_ds_messages(bot, n)
+  bot.arduino.begin_tick()
+  bot.tasks.run_tick()
+  bot.loop_timer.wait()
+tracemalloc.stop()
+gc.enable()
+
+print("")
+print("Allocations over %d ticks, joystick messages every %d ticks:" % (ticks, msg_every))
+print("Task                 Runs   Avg bytes   Max bytes   Objects left/run")
+for name, s in stats.items():
+  if s.runs == 0: continue
+  print("%-18s  %6d  %10.0f  %10d  %10.2f" % (name, s.runs, s.peak_sum / s.runs, s.peak_max, s.left_sum / s.runs))
+
+# Part 2: collections inside a tick, with automatic and with managed gc.
+for task in bot.tasks._tasks:
+  task.func = originals[task.name]
+collections = [0]
+in_tick = [False]
+def on_gc(phase, info):
+  if phase == "start" and in_tick[0]: collections[0] += 1
+gc.callbacks.append(on_gc)
+
+def run_loop(manager):
+  ''' Runs the loop, and returns (collections in ticks, max tick secs). '''
+  collections[0] = 0
+  tmax = 0.0
+  for n in range(ticks):
+    if n % msg_every == 0: send_ds_messages(bot, n)
+    t0 = time.monotonic()
+    in_tick[0] = True
+    bot.arduino.begin_tick()
+    bot.tasks.run_tick()
+    in_tick[0] = False
+    dt = time.monotonic() - t0
+    if dt > tmax: tmax = dt
+    if manager:
+      manager.set_match(True)
+      manager.collect_in_slack(bot.loop_timer.get_slack())
+    bot.loop_timer.wait()
+  if manager: manager.set_match(False)
+  return collections[0], tmax
+
+auto_count, auto_max = run_loop(None)
+manager = gcmanager.GcManager()
+managed_count, managed_max = run_loop(manager)
+gc.callbacks.remove(on_gc)
+
+print("")
+print("                          Automatic    Managed")
+print("Collections in ticks     %10d %10d" % (auto_count, managed_count))
+print("Max tick (ms)            %10.3f %10.3f" % (auto_max * 1000.0, managed_max * 1000.0))
+print("Managed gc counts: %s" % manager.get_counts())
+bot.mqtt.close()
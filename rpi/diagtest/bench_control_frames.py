@@ -0,0 +1,53 @@
+# bench_control_frames.py -- compare text and binary joystick frames
+# EPIC Robotz, dlb, Apr 2021
+#
+# Encodes and decodes the three joystick topics (axes, buttons and pov) many
+# times in each format, and reports the payload size and the time per
+# encode and decode.  No broker or hardware is used.
+#
+# usage: python3 bench_control_frames.py [count]
+
+import sys
+import time
+import mqttrobot
+
+count = 20000
+if len(sys.argv) > 1:
+  count = int(sys.argv[1])
+
+axes = (0.1234, -0.5678, 1.0, -1.0, 0.0, 0.3333)
+btns = [True, False, False, True, False, False, False, False, True, False, False, True]
+pov = (-1, 1)
+buf = [False for _ in range(12)]
+
+def run_bench(binary):
+  ''' Returns a list of (name, bytes, encode usecs, decode usecs) for each topic. '''
+  results = []
+  for name, encode, decode in (
+      ("axes", lambda: mqttrobot.encode_axes(axes, binary), mqttrobot.decode_axes),
+      ("buttons", lambda: mqttrobot.encode_buttons(btns, binary), lambda d: mqttrobot.decode_buttons_into(d, buf)),
+      ("pov", lambda: mqttrobot.encode_pov(pov, binary), mqttrobot.decode_pov)):
+    t0 = time.perf_counter()
+    for _ in range(count): data = encode()
+    t_enc = (time.perf_counter() - t0) / count
+    # The robot sees text as a str, and binary frames as bytes.
+    nbytes = len(data) if binary else len(data.encode("ascii"))
+    t0 = time.perf_counter()
+    for _ in range(count): decode(data)
+    t_dec = (time.perf_counter() - t0) / count
+    results.append((name, nbytes, t_enc * 1e6, t_dec * 1e6))
+  return results
+
+text = run_bench(False)
+binary = run_bench(True)
+okay, vals = mqttrobot.decode_axes(mqttrobot.encode_axes(axes))
+err = max([abs(a - b) for a, b in zip(axes, vals)])
+
+print("Each topic encoded and decoded %d times:" % count)
+print("                 ------ Text ------      ----- Binary -----")
+print("Topic            Bytes   Enc us  Dec us  Bytes   Enc us  Dec us")
+for (name, b0, e0, d0), (_, b1, e1, d1) in zip(text, binary):
+  print("%-14s  %5d  %7.2f %7.2f  %5d  %7.2f %7.2f" % (name, b0, e0, d0, b1, e1, d1))
+print("Total bytes per joystick: text = %d, binary = %d" %
+  (sum([r[1] for r in text]), sum([r[1] for r in binary])))
+print("Largest axis error in binary: %.6f" % err)
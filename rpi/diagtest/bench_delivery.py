@@ -0,0 +1,125 @@
+# bench_delivery.py -- compare the delivery profiles of mqttrobot on a broker
+# EPIC Robotz, dlb, Apr 2021
+#
+# Connects a sender and a receiver to the broker, and for each delivery
+# profile (default, stream, command and telemetry) sends messages on a topic
+# of its own, each with the time it was sent.  Three tests are run:
+#
+#   paced  -- count messages at the given rate.  Shows the latency of each
+#             profile when the link keeps up.
+#   burst  -- count messages back to back, faster than the link can take
+#             them.  Shows how long the newest value takes to arrive, which
+#             is where coalescing helps.
+#   late   -- a new receiver subscribes after the tests.  Shows which
+#             profiles hand it an old, retained message.
+#
+# Run it on the Pi against the robot's broker, or on any computer with a
+# local broker (such as mosquitto).  Add "mqtt5" to use MQTT 5, so that the
+# expiry is used; the broker must support it.
+#
+# usage: python3 bench_delivery.py [broker] [count] [rate] [mqtt5]
+
+import sys
+import time
+import mqttrobot
+
+broker = "localhost"
+count = 500
+rate = 100.0
+mqtt5 = "mqtt5" in sys.argv[1:]
+args = [a for a in sys.argv[1:] if a != "mqtt5"]
+if len(args) > 0:
+  broker = args[0]
+if len(args) > 1:
+  count = int(args[1])
+if len(args) > 2:
+  rate = float(args[2])
+
+profiles = (("default", mqttrobot.profile_default), ("stream", mqttrobot.profile_stream),
+  ("command", mqttrobot.profile_command), ("telemetry", mqttrobot.profile_telemetry))
+
+class Receiver():
+  ''' Records the latency of each message received on a topic. '''
+  def __init__(self):
+    self.latencies = []
+    self.last_seq = -1
+
+  def on_message(self, topic, data):
+    seq, tsent = data.split()
+    self.latencies.append(time.monotonic() - float(tsent))
+    self.last_seq = int(seq)
+
+  def reset(self):
+    self.latencies = []
+    self.last_seq = -1
+
+def wait_connected(mqtt, timeout=5.0):
+  t_end = time.monotonic() + timeout
+  while not mqtt.is_connected():
+    if time.monotonic() > t_end:
+      print("Unable to connect to the broker at %s." % broker)
+      sys.exit()
+    time.sleep(0.05)
+
+def percentile(vals, p):
+  if not vals: return 0.0
+  svals = sorted(vals)
+  return svals[min(len(svals) - 1, int(p * len(svals)))]
+
+tx = mqttrobot.MqttRobot(broker, mqtt5=mqtt5)
+rx = mqttrobot.MqttRobot(broker, mqtt5=mqtt5)
+wait_connected(tx)
+wait_connected(rx)
+receivers = {}
+for name, profile in profiles:
+  topic = "bench/%s" % name
+  receivers[name] = Receiver()
+  rx.register_topic(topic, receivers[name].on_message)
+  tx.register_publish(topic, profile)
+time.sleep(0.5)  # let the subscriptions settle
+
+def run_test(name, paced):
+  ''' Sends the messages for one profile, and returns (sent, received,
+  p50, p99, max, secs until the last message arrived). '''
+  r = receivers[name]
+  r.reset()
+  topic = "bench/%s" % name
+  t_next = time.monotonic()
+  for seq in range(count):
+    if paced:
+      time.sleep(max(0.0, t_next - time.monotonic()))
+      t_next += 1.0 / rate
+    tx.publish(topic, "%d %.6f" % (seq, time.monotonic()))
+  t_sent = time.monotonic()
+  t_end = t_sent + 5.0
+  while r.last_seq != count - 1 and time.monotonic() < t_end: time.sleep(0.001)
+  t_last = time.monotonic() - t_sent
+  if r.last_seq != count - 1: t_last = float("nan")
+  time.sleep(0.2)
+  lat = r.latencies
+  return (count, len(lat), percentile(lat, 0.5), percentile(lat, 0.99), max(lat + [0.0]), t_last)
+
+print("Broker %s, %d messages per test, MQTT %s" % (broker, count, "5" if mqtt5 else "3.1.1"))
+for paced in (True, False):
+  if paced: print("\nPaced at %.0f Hz:" % rate)
+  else: print("\nBurst:")
+  print("Profile       Sent  Received   p50 ms   p99 ms   max ms   last arrived ms")
+  for name, _ in profiles:
+    sent, nrx, p50, p99, pmax, t_last = run_test(name, paced)
+    print("%-10s  %6d  %8d  %7.2f  %7.2f  %7.2f  %10.2f" % (name, sent, nrx, p50 * 1000.0,
+      p99 * 1000.0, pmax * 1000.0, t_last * 1000.0))
+
+late = mqttrobot.MqttRobot(broker, mqtt5=mqtt5)
+late_receivers = {}
+for name, _ in profiles:
+  late_receivers[name] = Receiver()
+  late.register_topic("bench/%s" % name, late_receivers[name].on_message)
+wait_connected(late)
+time.sleep(0.5)
+print("\nLate subscriber:")
+for name, _ in profiles:
+  r = late_receivers[name]
+  if r.last_seq < 0: print("  %-10s  nothing (good for control data)" % name)
+  else: print("  %-10s  got message %d, sent %.1f secs ago" % (name, r.last_seq, r.latencies[-1]))
+print("\nSender counts: %s" % tx.get_counts())
+for m in (tx, rx, late): m.close()
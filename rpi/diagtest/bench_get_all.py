@@ -0,0 +1,53 @@
+# bench_get_all.py -- compare block reads and single register reads for get_all()
+# EPIC Robotz, dlb, Apr 2021
+#
+# Reads the full register file from the arduino many times, first one
+# register at a time, and then with a block read, and reports the number
+# of bus transactions and the wall time per snapshot for each mode.
+#
+# usage: python3 bench_get_all.py [count]
+
+import sys
+import time
+import arduino_wb
+import busmonitor
+
+count = 200
+if len(sys.argv) > 1:
+  count = int(sys.argv[1])
+
+monitor = busmonitor.BusMonitor()
+arduino = arduino_wb.Arduino_wb(bus_monitor=monitor)
+
+okay, sigv = arduino.get_version()
+if not okay:
+  print("Unable to read the arduino signature.  Bus error!")
+  sys.exit()
+print("Arduino signature = %c" % sigv)
+
+def run_bench(block):
+  ''' Runs the benchmark in one mode, and returns (transactions, secs, errors)
+  per snapshot. '''
+  arduino.set_block_read(block)
+  arduino.supports_block_read()  # Get the signature probe out of the way.
+  n0 = monitor.get_total_success_count()
+  e0 = monitor.get_total_error_count()
+  t0 = time.monotonic()
+  for _ in range(count):
+    arduino.get_all()
+  t1 = time.monotonic()
+  nxfers = monitor.get_total_success_count() - n0
+  nerrs = monitor.get_total_error_count() - e0
+  return nxfers / count, (t1 - t0) / count, nerrs
+
+print("Reading %d snapshots in each mode..." % count)
+results = [("single", run_bench(False))]
+arduino.set_block_read(True)
+if arduino.supports_block_read():
+  results.append(("block", run_bench(True)))
+else:
+  print("Firmware is too old for block reads.  Only single mode tested.")
+print("")
+print("Mode      Xfers/Snapshot    ms/Snapshot   Errors")
+for name, (nx, secs, nerrs) in results:
+  print("%-8s  %14.1f  %13.3f  %7d" % (name, nx, secs * 1000.0, nerrs))
@@ -0,0 +1,62 @@
+# bench_jitter.py -- measure main loop jitter with and without real-time tuning
+# EPIC Robotz, dlb, Apr 2021
+#
+# Runs a 100 Hz loop with a small amount of work that makes garbage, first
+# as a normal process, and then again after the real-time tuning steps in
+# rttune.py, and reports how late the ticks ran in each case.  No hardware
+# is used.  Run it as root for the priority and memory locking steps, and
+# load the Pi (for example, with a build) in another window to see the
+# difference.
+#
+# usage: sudo python3 bench_jitter.py [secs] [cpu]
+
+import sys
+import time
+import looptimer
+import rttune
+
+secs = 20.0
+cpu = 3
+if len(sys.argv) > 1:
+  secs = float(sys.argv[1])
+if len(sys.argv) > 2:
+  cpu = int(sys.argv[2])
+
+def work():
+  ''' A stand-in for one tick of the robot: some math and some garbage. '''
+  lst = []
+  for i in range(200):
+    lst.append((i, str(i), [i * 0.5]))
+  return sum(x for x, _, _ in lst)
+
+def run_bench():
+  ''' Runs the loop for secs, and returns the loop timer. '''
+  timer = looptimer.LoopTimer(100.0)
+  t_end = time.monotonic() + secs
+  while time.monotonic() < t_end:
+    work()
+    timer.wait()
+  return timer
+
+print("Running %.0f secs without tuning..." % secs)
+normal = run_bench()
+print("Tuning...")
+rttune.apply(priority=50, cpu=cpu, lock_mem=True, freeze=True)
+print("Running %.0f secs with tuning..." % secs)
+tuned = run_bench()
+
+print("")
+print("                        Normal      Tuned")
+for name, key in (("Ticks", "ticks"), ("Overruns", "overruns"), ("Skipped", "skipped")):
+  print("%-18s  %10d %10d" % (name, normal.get_stats()[key], tuned.get_stats()[key]))
+for name, key in (("Avg late (ms)", "avg_late"), ("Max late (ms)", "max_late")):
+  print("%-18s  %10.3f %10.3f" % (name, normal.get_stats()[key] * 1000.0, tuned.get_stats()[key] * 1000.0))
+print("Late by up to (ms):")
+hist0 = normal.get_jitter_histogram()
+hist1 = tuned.get_jitter_histogram()
+for i in range(len(hist0)):
+  edge, n0 = hist0[i]
+  _, n1 = hist1[i]
+  if edge is None: label = "more"
+  else: label = "%g" % (edge * 1000.0)
+  print("  %-16s  %10d %10d" % (label, n0, n1))
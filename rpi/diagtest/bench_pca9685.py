@@ -0,0 +1,56 @@
+# bench_pca9685.py -- count bus transactions for the PCA9685 driver
+# EPIC Robotz, dlb, Apr 2021
+#
+# Runs the same set of operations on the PCA9685 with the original single
+# byte writes, and then with the auto increment mode, and reports the number
+# of bus transactions and the time for each operation.
+#
+# WARNING: This drives the PWM outputs.  Disconnect motors before running.
+#
+# usage: python3 bench_pca9685.py [count]
+
+import sys
+import time
+import pca9685
+import busmonitor
+
+count = 100
+if len(sys.argv) > 1:
+  count = int(sys.argv[1])
+
+monitor = busmonitor.BusMonitor()
+
+def measure(fnc):
+  ''' Runs fnc count times, and returns (transactions, msecs) per call. '''
+  n0 = monitor.get_total_success_count()
+  t0 = time.monotonic()
+  for _ in range(count):
+    fnc()
+  t1 = time.monotonic()
+  nxfers = monitor.get_total_success_count() - n0
+  return nxfers / count, (t1 - t0) * 1000.0 / count
+
+def run_bench(pca):
+  ''' Runs each operation on the given driver, and returns a list of results.'''
+  results = []
+  results.append(("set_pwm (1 chan)", measure(lambda: pca.set_pwm(15, 1500))))
+  results.append(("killall", measure(pca.killall)))
+  many = {4: 1550, 5: 1550, 15: 1500}
+  results.append(("set_pwm_many (3 chans)", measure(lambda: pca.set_pwm_many(many))))
+  allchans = {}
+  for i in range(16): allchans[i] = 1500
+  results.append(("set_pwm_many (16 chans)", measure(lambda: pca.set_pwm_many(allchans))))
+  pca.killall()
+  return results
+
+print("Running each operation %d times..." % count)
+legacy = run_bench(pca9685.PCA9685(bus_monitor=monitor, auto_increment=False))
+autoinc = run_bench(pca9685.PCA9685(bus_monitor=monitor, auto_increment=True))
+if monitor.get_total_error_count() > 0:
+  print("Warning: %d bus errors during the test." % monitor.get_total_error_count())
+print("")
+print("Operation                  Single Byte Xfers/ms    Auto Increment Xfers/ms")
+for i in range(len(legacy)):
+  name, (nx0, ms0) = legacy[i]
+  _, (nx1, ms1) = autoinc[i]
+  print("%-24s  %8.1f  %8.3f          %8.1f  %8.3f" % (name, nx0, ms0, nx1, ms1))
@@ -0,0 +1,101 @@
+# bench_stale_inputs.py -- measure how fast runbot reacts when the driver station goes quiet
+# EPIC Robotz, dlb, Apr 2021
+#
+# Builds the robot from runbot.py (without user code), and feeds it control
+# frames as if from a driver station, every 50 ms in TELEOP with the sticks
+# pushed.  The pretend driver station's clock is far off from ours, and each
+# frame is stamped as if it spent a random time in transit, so the clock
+# offset estimate can be checked against the truth.  Then the frames stop,
+# and the ticks go on, to see how long it takes each stale policy to act:
+#
+#   stale  -- time from the last frame sent until the inputs are marked stale
+#   acted  -- time until the policy is done: the axes are zero (decay), or
+#             the mode is STOP (stop).  Hold never acts on its own.
+#
+# No broker is needed.  Run on the Pi, with the hardware connected.
+#
+# usage: python3 bench_stale_inputs.py [frames]
+
+import os
+import sys
+import random
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import runbot
+import mqttrobot
+
+frames = 40
+if len(sys.argv) > 1:
+  frames = int(sys.argv[1])
+
+ds_clock_offset = 1234.5   # the pretend driver station's clock is this far ahead of ours
+frame_period = 0.050
+max_wait = 1.0             # secs to wait for the policy to act
+
+class FakeMessage():
+  ''' Looks enough like a paho message for MqttRobot._on_message. '''
+  def __init__(self, topic, payload):
+    self.topic = topic
+    self.payload = payload
+
+def transit_delay():
+  ''' Returns a made up delay for one frame: mostly a few ms, sometimes much more. '''
+  if random.random() < 0.1: return random.uniform(0.010, 0.040)
+  return random.uniform(0.0005, 0.004)
+
+def run_policy(bot, policy):
+  ''' Sends frames, then stops, and returns (stale secs, acted secs, worst
+  offset error secs, mean age on arrival secs).  A time is None if it did not
+  happen within max_wait. '''
+  runbot.stale_policy = policy
+  f = mqttrobot.ControlFrame()
+  f.session = random.randint(0, 0xFFFF)
+  f.mode = "TELEOP"
+  f.time_to_go = 100.0
+  f.axes[0] = (0.8, -0.5, 0.0, 0.0, 0.0, 0.0)
+  f.buttons[0][0] = True
+  nframes0, age_sum0 = bot.frame_count, bot.input_age_sum
+  offset_err = 0.0
+  t_next = time.monotonic()
+  t_last_sent = t_next
+  for n in range(frames):
+    while time.monotonic() < t_next:
+      bot.arduino.begin_tick()
+      bot.tasks.run_tick()
+      bot.loop_timer.wait()
+    t_next += frame_period
+    f.seq += 1
+    f.ds_loop = n
+    delay = transit_delay()
+    t_last_sent = time.monotonic() - delay
+    f.t_sent = t_last_sent + ds_clock_offset
+    bot.mqtt._on_message(None, None, FakeMessage("wbot/control", f.encode()))
+    bot.get_control_inputs()
+    if bot.ds_clock.is_valid():
+      offset_err = max(offset_err, abs(bot.ds_clock.to_local(f.t_sent) - t_last_sent))
+  t_stale = t_acted = None
+  while time.monotonic() - t_last_sent < max_wait:
+    bot.arduino.begin_tick()
+    bot.tasks.run_tick()
+    dt = time.monotonic() - t_last_sent
+    if t_stale is None and bot.input_stale: t_stale = dt
+    if t_acted is None:
+      if policy == "decay" and bot.axes0 == mqttrobot.zero_axes: t_acted = dt
+      if policy == "stop" and bot.botmode == "STOP": t_acted = dt
+    bot.loop_timer.wait()
+  nframes = bot.frame_count - nframes0
+  return t_stale, t_acted, offset_err, (bot.input_age_sum - age_sum0) / max(1, nframes)
+
+def ms(t):
+  if t is None: return "      --"
+  return "%8.1f" % (t * 1000.0)
+
+bot = runbot.WaterBotBase(None)
+print("Frames every %.0f ms, stale after %.0f ms, decay over %.0f ms, ticks at %.0f Hz" % (frame_period * 1000.0,
+  runbot.stale_input_age * 1000.0, runbot.stale_decay_time * 1000.0, runbot.loop_rate))
+print("Policy     Stale ms  Acted ms  Offset err ms  Age on arrival ms")
+for policy in ("hold", "decay", "stop"):
+  t_stale, t_acted, err, age = run_policy(bot, policy)
+  print("%-8s  %s  %s  %13.2f  %17.2f" % (policy, ms(t_stale), ms(t_acted), err * 1000.0, age * 1000.0))
+print("Mode after the last test: %s, stale count = %d" % (bot.botmode, bot.stale_count))
+bot.mqtt.close()
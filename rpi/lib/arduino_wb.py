@@ -2,27 +2,69 @@
 # EPIC Robotz, dlb, Mar 2021
 
 import sys
-from smbus import SMBus
 import RPi.GPIO as gpio
 import time
 import arduino_reg_map as reg
 import arduino_decode as decode
 import random
+import i2cbus
+import clocksync
 
 default_addr = 0x8 # bus address of ardunio
 default_bus = 1 # indicates /dev/ic2-1
+device_name = "arduino"  # name used in the bus statistics
 
 # The D0 and D1 pins are used to restert the arduino in case of massive failure.
 d1_pin = 7      # aux data pin D1 connected directly to Arduino
 d0_pin = 11     # aux data pin D0 connected directly to Arduino
 
+# The read-only registers are shadowed on the Pi, so that repeated reads in
+# the same loop tick do not go to the bus.  The registers are grouped as
+# (first, last, class), where each group is refreshed together, and each
+# class has its own maximum age, in seconds, before it must be re-read.
+shadow_groups = ((reg.SIGV, reg.SIGV, "signature"), (reg.BAT_M, reg.BAT_M, "battery"),
+    (reg.DTME1, reg.DTME4, "time"), (reg.A1, reg.A7, "analog"), (reg.SI, reg.SC, "digital"),
+    (reg.BAT_L, reg.BAT_L, "battery"))
+default_max_age = {"signature": 10.0, "battery": 1.0, "time": 0.0, "analog": 0.020,
+    "digital": 0.010}
+
+# The last value written to each writable register is remembered, and writing the
+# same value again is skipped.  However, the value is re-sent after this many seconds
+# anyway, so that an arduino that has been reset gets back in sync.
+default_refresh_interval = 1.0
+
 class Arduino_wb():
     ''' Manages arduino that is embedded in the water bot. '''
-    def __init__(self, address=default_addr, bus_number=default_bus, bus_monitor=None):
+    def __init__(self, address=default_addr, bus_number=default_bus, bus_monitor=None,
+            use_block_read=True, use_shadow=False, shadow_max_age=None,
+            refresh_interval=default_refresh_interval, bus=None):
+        ''' The bus is a shared i2cbus.I2CBus.  If not given, the arduino
+        gets a bus of its own on bus_number. '''
         self._addr = address
         self._bus_number = bus_number
-        self._bus = SMBus(bus_number)
+        if bus is None: bus = i2cbus.I2CBus(bus_number)
+        self._bus = bus
         self._bus_monitor = bus_monitor
+        self._use_block_read = use_block_read
+        self._firmware_sigv = None  # Unknown until the signature is read.
+        self._use_shadow = use_shadow
+        self._max_age = dict(default_max_age)
+        if shadow_max_age: self._max_age.update(shadow_max_age)
+        self._shadow = [0 for _ in range(reg.LAST_V2 + 1)]
+        self._shadow_group = [None for _ in range(reg.LAST_V2 + 1)]
+        for g in shadow_groups:
+            first, last, _ = g
+            for i in range(first, last + 1): self._shadow_group[i] = g
+        self._tick = 0
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self.invalidate_shadow()
+        self._refresh_interval = refresh_interval
+        self._last_written = {}  # keyword=register, value = tuple of (data, timestamp)
+        self._writes_sent = 0
+        self._writes_skipped = 0
+        self._last_timestamp = None  # tuple of (arduino ms, time.monotonic()) when last read
+        self._clock = clocksync.ClockSync(scale=0.001)  # maps arduino ms to time.monotonic()
         gpio.setwarnings(False)
         gpio.setmode(gpio.BOARD)
         gpio.setup(d0_pin, gpio.OUT)
@@ -45,6 +87,10 @@ class Arduino_wb():
         gpio.output(d0_pin, True)
         gpio.output(d1_pin, True)
         time.sleep(0.025)  # allow time for the arduino to boot. (By experiment, it takes 1-2ms.)
+        self.invalidate_shadow()
+        self._last_written = {}
+        self._firmware_sigv = None
+        self._clock.reset()
         okay, tme = self.get_timestamp()
         if not okay: return (False, "Unable to get timestamp after reset.")
         okay = self.test_health()
@@ -52,32 +98,178 @@ class Arduino_wb():
         if tme > 1000: return (False, "Timestamp (%ld) too large for reset to have occured." % tme)
         return (True, "Reset seems to have occurred correctly.")
 
-    def writereg(self, regadr, dat):
+    def _xfer(self, op, priority, deadline, *args):
+        ''' Runs one transaction on the shared bus, and reports it to the bus
+        monitor.  IOError is raised on bus errors, and i2cbus.DeadlineMissed
+        if the transaction could not be started in time. '''
+        t0 = time.monotonic()
+        try:
+            dat = self._bus.transact(device_name, priority, op, self._addr, *args, deadline=deadline)
+        except i2cbus.DeadlineMissed:
+            raise
+        except IOError:
+            if self._bus_monitor: 
+                self._bus_monitor.on_fail(op, device_name, args[0], time.monotonic() - t0)
+            raise
+        if self._bus_monitor: 
+            nwrites, nreads = i2cbus.payload_size(op, args)
+            self._bus_monitor.on_success(op, nwrites, nreads, device_name, args[0], time.monotonic() - t0)
+        return dat
+
+    def writereg(self, regadr, dat, priority=i2cbus.PRIO_ACTUATOR, deadline=None):
         ''' Reads a register from the arduino.  This is done without
         protection against errors on the I2C bus. '''
         try:
-            self._bus.write_byte_data(self._addr, regadr, dat)
-            if self._bus_monitor: self._bus_monitor.on_success()
+            self._xfer("write_byte_data", priority, deadline, regadr, dat)
         except IOError:
-            if self._bus_monitor: self._bus_monitor.on_fail()
+            self._last_written.pop(regadr, None)
             raise
-        except OSError:
-            if self._bus_monitor: self._bus_monitor.on_fail()
-            raise IOError()
+        self._writes_sent += 1
+        self._last_written[regadr] = (dat, time.monotonic())
+
+    def writeblock(self, regadr, dat, priority=i2cbus.PRIO_ACTUATOR, deadline=None):
+        ''' Writes the list of bytes in dat to consecutive registers on the
+        arduino, starting at regadr, in one transaction.  This requires
+        firmware that supports block writes (see supports_block_write()).
+        This is done without protection against errors on the I2C bus. '''
+        try:
+            self._xfer("write_i2c_block_data", priority, deadline, regadr, dat)
+        except IOError:
+            for i in range(len(dat)): self._last_written.pop(regadr + i, None)
+            raise
+        self._writes_sent += 1
+        timenow = time.monotonic()
+        for i, v in enumerate(dat): self._last_written[regadr + i] = (v, timenow)
+
+    def is_write_needed(self, regadr, dat):
+        ''' Returns True if writing dat to the register would change it, or if
+        the last write is older than the refresh interval. '''
+        if regadr not in self._last_written: return True
+        v, tme = self._last_written[regadr]
+        if v != dat: return True
+        return time.monotonic() - tme > self._refresh_interval
+
+    def writereg_if_changed(self, regadr, dat):
+        ''' Writes a register, unless the same value was written to it within
+        the refresh interval, in which case nothing is sent.  Returns True if
+        the write was actually sent.  IOError is raised on bus errors. '''
+        if not self.is_write_needed(regadr, dat):
+            self._writes_skipped += 1
+            return False
+        self.writereg(regadr, dat)
+        return True
+
+    def set_refresh_interval(self, secs):
+        ''' Sets the number of seconds after which an unchanged value is
+        written again by writereg_if_changed(). '''
+        self._refresh_interval = secs
+
+    def get_write_stats(self):
+        ''' Returns a dict of write counts: {sent:, skipped:}, where sent is
+        the number of write transactions, and skipped is the number of
+        unchanged writes that were not sent. '''
+        return {"sent": self._writes_sent, "skipped": self._writes_skipped}
     
-    def readreg(self, regadr):
+    def readreg(self, regadr, priority=i2cbus.PRIO_TELEMETRY, deadline=None):
         ''' Writes to a register on the arduino.  This is done without
         protection against errors on the I2C bus. '''
-        try:
-            dat = self._bus.read_byte_data(self._addr, regadr)
-            if self._bus_monitor: self._bus_monitor.on_success()
-            return dat
-        except IOError:    
-            if self._bus_monitor: self._bus_monitor.on_fail()
-            raise
-        except OSError:
-            if self._bus_monitor: self._bus_monitor.on_fail()
-            raise IOError()
+        return self._xfer("read_byte_data", priority, deadline, regadr)
+
+    def readblock(self, regadr, n, priority=i2cbus.PRIO_TELEMETRY, deadline=None):
+        ''' Reads n consecutive registers from the arduino, starting at
+        regadr, in one transaction, and returns them as a list of bytes.
+        This requires firmware that supports block reads (see
+        supports_block_read()).  This is done without protection against
+        errors on the I2C bus. '''
+        return self._xfer("read_i2c_block_data", priority, deadline, regadr, n)
+
+    def _get_firmware_sigv(self):
+        ''' Returns the firmware signature, or 0 if it cannot be read.  The
+        signature is read from the arduino once, and remembered after that.'''
+        if self._firmware_sigv is None:
+            try:
+                self._firmware_sigv = self.readreg(reg.SIGV)
+            except IOError:
+                return 0
+        return self._firmware_sigv
+
+    def supports_block_read(self):
+        ''' Returns True if block reads are enabled and the firmware on the
+        arduino is new enough to support them.'''
+        if not self._use_block_read: return False
+        return self._get_firmware_sigv() >= reg.SIGV_BLOCK_READ
+
+    def supports_block_write(self):
+        ''' Returns True if the firmware on the arduino is new enough to
+        support writing several registers in one transaction.'''
+        return self._get_firmware_sigv() >= reg.SIGV_BLOCK_WRITE
+
+    def set_block_read(self, enable):
+        ''' Enables or disables the use of block reads.  When disabled, all
+        registers are read one at a time, the same as with old firmware. '''
+        self._use_block_read = enable
+
+    def begin_tick(self):
+        ''' Call once at the start of each pass of the main loop.  A shadowed
+        register is read from the bus at most once per tick. '''
+        self._tick += 1
+
+    def set_shadow_max_age(self, regclass, secs):
+        ''' Sets the maximum age, in seconds, for a class of shadowed registers.
+        The classes are: "signature", "battery", "time", "analog", and "digital". '''
+        if regclass not in self._max_age: raise ValueError("Unknown register class.")
+        self._max_age[regclass] = secs
+
+    def invalidate_shadow(self):
+        ''' Forces all shadowed registers to be read from the bus on next use. '''
+        self._shadow_time = [None for _ in range(reg.LAST_V2 + 1)]
+        self._shadow_tick = [-1 for _ in range(reg.LAST_V2 + 1)]
+
+    def get_cache_stats(self):
+        ''' Returns a dict of shadow cache counts: {hits:, misses:}. '''
+        return {"hits": self._cache_hits, "misses": self._cache_misses}
+
+    def _update_shadow(self, regadr, dat):
+        ''' Stores bytes read from the bus starting at regadr into the shadow. '''
+        timenow = time.monotonic()
+        for i, v in enumerate(dat):
+            r = regadr + i
+            if r > reg.LAST_V2: break
+            if self._shadow_group[r] is None: continue
+            self._shadow[r] = v
+            self._shadow_time[r] = timenow
+            self._shadow_tick[r] = self._tick
+
+    def _is_shadow_fresh(self, regadr, max_age=None):
+        ''' Returns True if the shadow copy of a register can be used. '''
+        t = self._shadow_time[regadr]
+        if t is None: return False
+        if self._tick > 0 and self._shadow_tick[regadr] == self._tick: return True
+        if max_age is None:
+            _, _, regclass = self._shadow_group[regadr]
+            max_age = self._max_age[regclass]
+        return time.monotonic() - t <= max_age
+
+    def read_shadow(self, regadr, priority=i2cbus.PRIO_TELEMETRY, max_age=None):
+        ''' Reads a read-only register through the shadow cache.  If the
+        shadow copy is still fresh, or was read during this tick, it is
+        returned without using the bus.  Otherwise the register's group is
+        refreshed from the bus.  max_age, if given, is used instead of the
+        class's maximum age; with max_age=0 the register is read from the bus
+        once per tick.  If the shadow is disabled, this is the same as
+        readreg().  IOError is raised on bus errors. '''
+        if not self._use_shadow or self._shadow_group[regadr] is None:
+            return self.readreg(regadr, priority=priority)
+        if self._is_shadow_fresh(regadr, max_age):
+            self._cache_hits += 1
+            return self._shadow[regadr]
+        first, last, _ = self._shadow_group[regadr]
+        self._cache_misses += 1
+        if last > first and self.supports_block_read():
+            self._update_shadow(first, self.readblock(first, last - first + 1, priority=priority))
+        else:
+            self._update_shadow(regadr, [self.readreg(regadr, priority=priority)])
+        return self._shadow[regadr]
 
     def test_health(self):
         ''' Tests the health of the i2c bus and the arduino by writing
@@ -85,9 +277,9 @@ class Arduino_wb():
         True is returned. '''
         v = random.randint(0,255)
         try:
-            self.writereg(reg.XXX1, v)
+            self.writereg(reg.XXX1, v, priority=i2cbus.PRIO_SAFETY)
             time.sleep(0.00025)
-            vgot = self.readreg(reg.XXX1)
+            vgot = self.readreg(reg.XXX1, priority=i2cbus.PRIO_SAFETY)
             if vgot != v: return False
             return True
         except OSError:
@@ -109,7 +301,7 @@ class Arduino_wb():
         ''' Returns the signature byte on the arduino as (okayflag, char)
         wehre okayflag is True if all is okay, and char is the signature byte.'''
         try:
-            id = self.readreg(reg.SIGV)
+            id = self.read_shadow(reg.SIGV)
         except IOError:
             return False, 0
         return True, id
@@ -118,14 +310,30 @@ class Arduino_wb():
         ''' Returns the individule bytes that make up the timestamp, 
         and returns (okayflag, tuple_of_bytes), where okayflag is True
         if all is okay, and tuple_of_bytes contains 4 bytes, with the
-        LSB first. '''
+        LSB first.  The four bytes always come from the same snapshot of
+        the arduino's clock: with block read firmware they are read in one
+        transaction, and older firmware latches the clock when DTME1 is read.
+        Each read from the bus is also used to update the clock mapping
+        (see arduino_to_monotonic()). '''
+        if self._use_shadow and self._is_shadow_fresh(reg.DTME1):
+            self._cache_hits += 1
+            return True, tuple(self._shadow[reg.DTME1:reg.DTME4 + 1])
+        if self._use_shadow: self._cache_misses += 1
+        block = self.supports_block_read()
         try:
-            u0 = self.readreg(reg.DTME1)
-            u1 = self.readreg(reg.DTME2)
-            u2 = self.readreg(reg.DTME3)
-            u3 = self.readreg(reg.DTME4)
+            t0 = time.monotonic()
+            if block:
+                blist = self.readblock(reg.DTME1, 4)
+            else:
+                blist = [self.readreg(r) for r in (reg.DTME1, reg.DTME2, reg.DTME3, reg.DTME4)]
+            t1 = time.monotonic()
         except IOError:
             return False, (0, 0, 0, 0)
+        self._update_shadow(reg.DTME1, blist)
+        u0, u1, u2, u3 = blist
+        tt = decode.fourbytestolong(u3, u2, u1, u0)
+        self._last_timestamp = (tt, t1)
+        self._clock.add_sample(tt, t0, t1)
         return True, (u0, u1, u2, u3)
 
     def get_timestamp(self):
@@ -139,6 +347,31 @@ class Arduino_wb():
         tt = decode.fourbytestolong(u3, u2, u1, u0)
         return True, tt
 
+    def get_last_timestamp(self):
+        ''' Returns the last timestamp that was read from the arduino, without
+        using the bus, as (arduino_ms, monotonic), where monotonic is the
+        time.monotonic() when it was read.  Returns None if no timestamp has
+        been read yet.  This lets the health of the arduino be judged from 
+        its clock advancing between reads. '''
+        return self._last_timestamp
+
+    def arduino_to_monotonic(self, tme):
+        ''' Converts an arduino timestamp (ms) into the Pi's time.monotonic(), 
+        using the running estimate of the offset and drift between the two 
+        clocks.  The estimate is updated on each timestamp read from the bus, 
+        so get_timestamp() should be called now and then. '''
+        return self._clock.to_local(tme)
+
+    def get_clock_stats(self):
+        ''' Returns a dict describing the clock mapping: {valid:, offset:, 
+        drift_ppm:, rtt_min:, rtt_avg:}, where offset is the Pi time (secs) at 
+        which the arduino clock read zero, drift_ppm is how much faster the Pi 
+        clock runs, and rtt_min and rtt_avg are the bus round trip times (secs)
+        for a timestamp read. '''
+        rtt_min, rtt_avg = self._clock.get_latency()
+        return {"valid": self._clock.is_valid(), "offset": self._clock.get_offset(),
+            "drift_ppm": self._clock.get_drift_ppm(), "rtt_min": rtt_min, "rtt_avg": rtt_avg}
+
     def get_battery_voltage(self, battype="M"):
         ''' Returns the battery voltage from the arduino as 
         (okayflag, batvolts) where okayflag is True if all is okay,
@@ -151,7 +384,7 @@ class Arduino_wb():
         if r == 0:
             raise ValueError("Unknown battery type.")
         try:
-            batv = self.readreg(r)
+            batv = self.read_shadow(r)
         except IOError:
             return False, 0.0
         batv = batv / 10.0
@@ -162,7 +395,7 @@ class Arduino_wb():
         (okayflag, batvolts) where okayflag is True if all is okay,
         and batvolts is the battery voltage for the motors as a float.'''
         try:
-            batv = self.readreg(reg.BAT_M)
+            batv = self.read_shadow(reg.BAT_M)
         except IOError:
             return False, 0.0
         batv = batv / 10.0
@@ -184,7 +417,7 @@ class Arduino_wb():
             if i == ichan: okay = True 
         if not okay: raise Exception("Unknown analog channel.")
         try:
-            a = self.readreg(ichan)
+            a = self.read_shadow(ichan)
         except IOError:
             return False, 0.0
         va = a / 255.0
@@ -203,7 +436,7 @@ class Arduino_wb():
             ipin = pin
         if ipin < 3 or ipin > 8 : raise Exception("Bad input arg.")
         try: 
-            dat = self.readreg(reg.SI)
+            dat = self.read_shadow(reg.SI, priority=i2cbus.PRIO_SAFETY)
         except IOError:
             return False, False
         ibit = ipin - 3
@@ -215,18 +448,19 @@ class Arduino_wb():
         ''' Returns the PI data bits as (okayflag, data),  where the least significant 2
         bits in data are the aux command bits from the Rpi: D1, D0. '''
         try:
-            dat = self.readreg(reg.SI)
+            dat = self.read_shadow(reg.SI, priority=i2cbus.PRIO_SAFETY)
         except IOError:
             return False, 0 
         return True, (dat >> 6) & (0x03)
 
-    def clear_change_bits(self):
-        ''' Clear all change bits on the digital inputs.  Returns 
-        True if no error. '''
+    def clear_change_bits(self, keep=0):
+        ''' Clear all change bits on the digital inputs, except for the
+        bits that are set in keep, in one write.  Returns True if no error. '''
         try:
-            self.writereg(reg.SCC, 0)
+            self.writereg(reg.SCC, keep & 0xFF, priority=i2cbus.PRIO_SAFETY)
         except IOError:
             return False
+        self._shadow_time[reg.SC] = None
         return True
 
     def set_pwm(self, chan, v):
@@ -234,7 +468,8 @@ class Arduino_wb():
         The chan can be the string name of a registor such as "PWM10", or its 
         address from the table above.  If chan == "ALL" or 0, then all pwm
         channels are set.  The value is from 0.0 to 1.0.  If success,
-        True is returned.'''
+        True is returned.  Nothing is sent if the channel already has the 
+        value (see writereg_if_changed()). '''
         iv = int(v * 255)
         if iv < 0: iv = 0
         if iv > 255: iv = 255
@@ -246,8 +481,14 @@ class Arduino_wb():
             ichan = chan
         if ichan == 0: 
             try:
-              for i in reg.pwm_chans:
-                  self.writereg(i, iv)
+              needed = [self.is_write_needed(i, iv) for i in reg.pwm_chans]
+              if not any(needed):
+                  self._writes_skipped += len(reg.pwm_chans)
+              elif self.supports_block_write():
+                  self.writeblock(reg.PWM9, [iv for _ in reg.pwm_chans])
+              else:
+                  for i in reg.pwm_chans:
+                      self.writereg_if_changed(i, iv)
             except IOError:
               return False
             return True
@@ -256,7 +497,7 @@ class Arduino_wb():
             if ichan == i: okay = True
         if not okay: raise Exception("Unknown or invalid channel.")
         try:
-            self.writereg(ichan, iv)
+            self.writereg_if_changed(ichan, iv)
         except IOError:
             return False
         return True
@@ -282,15 +523,39 @@ class Arduino_wb():
             return False, 0.0
         return True, (iv / 255.0)
 
+    def read_range(self, first, n):
+        ''' Reads n consecutive registers starting at first, and returns them as
+        (okayflag, bytes).  If the firmware supports it, this is done in one block
+        read, and the shadow is updated, otherwise each register is read separately.
+        If the range covers the timestamp, it is remembered, and block reads are
+        also used for the clock mapping. '''
+        t0 = time.monotonic()
+        if self.supports_block_read():
+            try:
+                d = self.readblock(first, n)
+                self._update_shadow(first, d)
+            except IOError:
+                return (False, [0 for _ in range(n)])
+        else:
+            d = []
+            try:
+                for i in range(first, first + n):
+                    v = self.readreg(i)
+                    d.append(v)
+            except:
+                return (False, [0 for _ in range(n)])
+        t1 = time.monotonic()
+        if first <= reg.DTME1 and first + n > reg.DTME4:
+            i = reg.DTME1 - first
+            tt = decode.fourbytestolong(d[i + 3], d[i + 2], d[i + 1], d[i])
+            self._last_timestamp = (tt, t1)
+            if self.supports_block_read(): self._clock.add_sample(tt, t0, t1)
+        return True, d
+
     def get_all(self):
         ''' Reads all the registers in the arduino and returns them as
         (okayflag, bytes) where okayflag is True if nothing goes wrong,
-        and bytes is a list of byte values. '''
-        d = []
-        try:
-            for i in range(reg.LAST_V2 + 1):
-                v = self.readreg(i)
-                d.append(v)
-        except:
-            return (False, [0 for _ in range(reg.LAST_V2 + 1)])
-        return True, d
+        and bytes is a list of byte values.  If the firmware supports it,
+        this is done in one block read, otherwise each register is read
+        separately. '''
+        return self.read_range(0, reg.LAST_V2 + 1)
@@ -1,10 +1,25 @@
 # busmonitor.py -- Provides monitor and alerts for I2C errors
 # EPIC Robotz, dlb, Mar 2021
+#
+# Besides the error counts used for alerts, the monitor keeps statistics on
+# every transaction: counts per device and per register, a latency histogram,
+# and error rate and transactions per second over a sliding window.  These are
+# cheap to keep (a few additions per transaction), so they can stay on during
+# matches, and get_snapshot() returns them in a compact form.
+
+import time
+
+# Upper edges of the latency histogram buckets, in seconds.  The last bucket
+# catches everything slower.
+latency_buckets = (0.0002, 0.0005, 0.001, 0.002, 0.005, 0.010, 0.020, 0.050)
+default_window = 5  # seconds in the sliding window for rates
 
 class BusMonitor():
-    def __init__(self, alert_cb=None):
+    def __init__(self, alert_cb=None, window=default_window):
         self._alert_cb = alert_cb
+        self._window = window
         self.reset()
+        self.reset_stats()
 
     def set_alert_callback(self, cb):
         ''' Set the callback for an alert. '''
@@ -13,30 +28,68 @@ class BusMonitor():
     def reset(self):
         ''' Reset the monitor, usually called after a bus restart.'''
         self._total_err_count = 0
-        self._total_success_count = 0   
+        self._total_success_count = 0
         self._sequential_err_count = 0  # Number of errors in a row
         self._on_alert = False
-    
-    def on_success(self, activity="", nwrites=0, nreads=0):
-        ''' Call this on success of bus read or write. '''
+
+    def reset_stats(self):
+        ''' Clears the transaction statistics.  Unlike reset(), this does not
+        change the error counts used for alerts. '''
+        self._stats_start_time = time.monotonic()
+        self._devices = {}    # keyword=device, value = list of [xfers, errors, bytes_out, bytes_in, latency]
+        self._registers = {}  # keyword=(device, reg), value = list of [xfers, errors]
+        self._histogram = [0 for _ in range(len(latency_buckets) + 1)]
+        self._slots = [[-1, 0, 0] for _ in range(self._window)]  # per second: [second, xfers, errors]
+
+    def on_success(self, activity="", nwrites=0, nreads=0, device="", reg=-1, latency=0.0):
+        ''' Call this on success of bus read or write.  The activity is the
+        kind of transaction, nwrites and nreads the number of data bytes sent
+        and received, device the name of the device, reg the register address,
+        and latency the time the transaction took, in seconds. '''
         self._total_success_count += 1
         self._sequential_err_count = 0
-    
-    def on_fail(self):
+        self._record(device, reg, nwrites, nreads, latency, False)
+
+    def on_fail(self, activity="", device="", reg=-1, latency=0.0):
         ''' Call this on fail.  If conditions seem super bad, an
         alert will be raised. '''
         self._total_err_count += 1
         self._sequential_err_count += 1
+        self._record(device, reg, 0, 0, latency, True)
         self.analyze()
 
+    def _record(self, device, reg, nwrites, nreads, latency, failed):
+        ''' Adds one transaction to the statistics. '''
+        d = self._devices.get(device)
+        if d is None: d = self._devices[device] = [0, 0, 0, 0, 0.0]
+        r = self._registers.get((device, reg))
+        if r is None: r = self._registers[(device, reg)] = [0, 0]
+        d[0] += 1
+        r[0] += 1
+        d[2] += nwrites
+        d[3] += nreads
+        d[4] += latency
+        if failed:
+            d[1] += 1
+            r[1] += 1
+        i = 0
+        while i < len(latency_buckets) and latency > latency_buckets[i]: i += 1
+        self._histogram[i] += 1
+        sec = int(time.monotonic())
+        slot = self._slots[sec % self._window]
+        if slot[0] != sec:
+            slot[0], slot[1], slot[2] = sec, 0, 0
+        slot[1] += 1
+        if failed: slot[2] += 1
+
     def analyze(self):
         ''' Analyzes the bus traffic. Will invoke the
             alert callback if bus seems like it is broken.'''
         if self._sequential_err_count > 10:
             self._on_alert = True
             if self._alert_cb:
-                self._alert_cb() 
-    
+                self._alert_cb()
+
     def in_alert(self):
         ''' Returns True if an alert has been declared.'''
         return self._on_alert
@@ -45,4 +98,49 @@ class BusMonitor():
         ''' Returns the total error count. '''
         return self._total_err_count
 
-    
+    def get_sequential_error_count(self):
+        ''' Returns the number of errors in a row since the last success. '''
+        return self._sequential_err_count
+
+    def get_total_success_count(self):
+        ''' Returns the total number of successful transactions. '''
+        return self._total_success_count
+
+    def get_rates(self):
+        ''' Returns (xfers_per_sec, error_rate) over the sliding window, where
+        error_rate is the fraction (0.0 to 1.0) of transactions that failed.
+        The current second is not counted, since it is not over yet, so the
+        rates cover the window - 1 complete seconds before it.'''
+        sec = int(time.monotonic())
+        nxfers = nerrs = 0
+        for slotsec, x, e in self._slots:
+            if slotsec < sec and slotsec > sec - self._window:
+                nxfers += x
+                nerrs += e
+        span = min(self._window - 1, sec - int(self._stats_start_time))
+        if span <= 0: return 0.0, 0.0
+        rate = 0.0
+        if nxfers > 0: rate = nerrs / nxfers
+        return nxfers / span, rate
+
+    def get_latency_histogram(self):
+        ''' Returns a list of (upper_edge_secs, count) for the latency histogram.
+        The last upper edge is None, for all transactions slower than the rest. '''
+        edges = list(latency_buckets) + [None]
+        return list(zip(edges, self._histogram))
+
+    def get_snapshot(self):
+        ''' Returns a compact dict of the statistics:  {tps:, err_rate:, hist:,
+        devices: {name: {xfers:, errs:, out:, in:, avg_ms:}}, regs: {"name:reg":
+        [xfers, errs]}}, where hist is the list of latency bucket counts. '''
+        tps, err_rate = self.get_rates()
+        devices = {}
+        for name, (x, e, nout, nin, lat) in self._devices.items():
+            avg_ms = 0.0
+            if x > 0: avg_ms = lat * 1000.0 / x
+            devices[name] = {"xfers": x, "errs": e, "out": nout, "in": nin, "avg_ms": round(avg_ms, 3)}
+        regs = {}
+        for (name, reg), (x, e) in self._registers.items():
+            regs["%s:%d" % (name, reg)] = [x, e]
+        return {"tps": round(tps, 1), "err_rate": round(err_rate, 4),
+            "hist": list(self._histogram), "devices": devices, "regs": regs}
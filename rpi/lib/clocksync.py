@@ -0,0 +1,115 @@
+# clocksync.py -- Maps a remote clock (such as the arduino's) onto time.monotonic()
+# EPIC Robotz, dlb, Apr 2021
+#
+# Each sample is a remote timestamp, along with the local times just before
+# and just after the remote timestamp was requested.  The remote clock was
+# read somewhere in between, so samples with the shortest round trip are the
+# most accurate.  The estimator keeps a window of recent samples, throws out
+# those with slow round trips, and fits a straight line through the rest:
+#
+#     local = remote * scale * (1 + drift) + offset
+#
+# where scale converts the remote units to seconds (0.001 for milliseconds).
+#
+# Some remote clocks can not be asked for the time, and are only seen in
+# timestamps on messages the remote sends, such as the driver station's
+# control frames.  For those, add_one_way() is used instead: each sample is
+# the remote send time and the local arrival time.  The difference is the
+# clock offset plus the delay in transit, and the delay is never negative, so
+# the smallest difference in the window is the best estimate (a min filter).
+# The offset found this way includes the shortest delay seen, so times
+# mapped with to_local() are early by that much; ages measured from them are
+# the delay beyond the fastest message, which is what matters for judging
+# whether a message is late.  No drift is estimated for one way samples.
+
+import collections
+
+default_window = 32       # number of samples kept
+default_rtt_slack = 0.0005  # samples within this many secs of the best round trip are used
+min_fit_span = 1.0        # secs of remote time needed before drift is estimated
+
+class ClockSync():
+    def __init__(self, scale=0.001, window=default_window, rtt_slack=default_rtt_slack):
+        self._scale = scale
+        self._rtt_slack = rtt_slack
+        self._samples = collections.deque(maxlen=window)  # tuples of (remote secs, local, rtt)
+        self.reset()
+
+    def reset(self):
+        ''' Forgets all samples.  Call this if the remote clock is reset. '''
+        self._samples.clear()
+        self._offset = 0.0
+        self._drift = 0.0
+        self._valid = False
+        self._sample_count = 0
+        self._rtt_sum = 0.0
+        self._rtt_min = None
+
+    def add_sample(self, remote, t_before, t_after):
+        ''' Adds a sample, where remote is the remote timestamp (in remote units),
+        and t_before and t_after are the time.monotonic() just before the request
+        and just after the answer.  If the remote clock goes backwards, it is
+        assumed to have been reset, and the old samples are forgotten. '''
+        rsecs = remote * self._scale
+        if self._samples and rsecs < self._samples[-1][0]: self.reset()
+        rtt = t_after - t_before
+        self._samples.append((rsecs, (t_before + t_after) / 2.0, rtt))
+        self._sample_count += 1
+        self._rtt_sum += rtt
+        if self._rtt_min is None or rtt < self._rtt_min: self._rtt_min = rtt
+        self._fit()
+
+    def add_one_way(self, remote, t_arrival):
+        ''' Adds a one way sample, where remote is the timestamp (in remote
+        units) the remote put on a message when it was sent, and t_arrival is
+        the time.monotonic() when it arrived.  The offset becomes the smallest
+        arrival minus send time in the window.  Do not mix these with
+        add_sample() on the same object.  If the remote clock goes backwards,
+        the old samples are forgotten. '''
+        rsecs = remote * self._scale
+        if self._samples and rsecs < self._samples[-1][0]: self.reset()
+        self._samples.append((rsecs, t_arrival, 0.0))
+        self._offset = min(l - r for r, l, _ in self._samples)
+        self._valid = True
+
+    def _fit(self):
+        ''' Recomputes the offset and drift from the best samples in the window. '''
+        best = min(s[2] for s in self._samples)
+        pts = [(r, l) for r, l, rtt in self._samples if rtt <= best + self._rtt_slack]
+        n = len(pts)
+        rmean = sum(r for r, _ in pts) / n
+        lmean = sum(l for _, l in pts) / n
+        slope = 1.0
+        if pts[-1][0] - pts[0][0] >= min_fit_span and n >= 2:
+            sxx = sum((r - rmean) * (r - rmean) for r, _ in pts)
+            sxy = sum((r - rmean) * (l - lmean) for r, l in pts)
+            if sxx > 0.0: slope = sxy / sxx
+        self._drift = slope - 1.0
+        self._offset = lmean - rmean * slope
+        self._valid = True
+
+    def is_valid(self):
+        ''' Returns True once at least one sample has been added. '''
+        return self._valid
+
+    def to_local(self, remote):
+        ''' Converts a remote timestamp (in remote units) to time.monotonic(). '''
+        return remote * self._scale * (1.0 + self._drift) + self._offset
+
+    def to_remote(self, local):
+        ''' Converts a time.monotonic() value to a remote timestamp (in remote units). '''
+        return (local - self._offset) / ((1.0 + self._drift) * self._scale)
+
+    def get_offset(self):
+        ''' Returns the offset in seconds: the local time when the remote clock read zero.'''
+        return self._offset
+
+    def get_drift_ppm(self):
+        ''' Returns how much faster the local clock runs than the remote, in parts per million. '''
+        return self._drift * 1.0e6
+
+    def get_latency(self):
+        ''' Returns the round trip time of a request as (min, avg) in seconds, over
+        all samples since the last reset. '''
+        if self._sample_count == 0: return 0.0, 0.0
+        return self._rtt_min, self._rtt_sum / self._sample_count
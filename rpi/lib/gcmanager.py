@@ -0,0 +1,86 @@
+# gcmanager.py -- Runs the garbage collector in the idle time at the end of each tick
+# EPIC Robotz, dlb, Apr 2021
+#
+# Python's garbage collector runs whenever enough objects have been
+# allocated, which can be in the middle of any tick.  During a match, that
+# shows up as a tick that runs late for no reason in our code.
+#
+# The manager turns automatic collection off during a match, and instead
+# is handed the slack (the time left before the next tick is due) at the end
+# of each tick.  If there is enough slack, it collects the youngest
+# generation, which is quick, and the middle generation when it is due.
+# The oldest generation is never collected during a match.  If the young
+# generation grows past max_pending objects without enough slack to collect
+# it, it is collected anyway, so memory can not grow without bound.
+#
+# Outside of a match (in STOP), automatic collection is turned back on, and
+# a full collection is done right away to clean up after the match.
+
+import gc
+import time
+
+default_min_slack = 0.002  # secs of slack needed to collect the young generation
+default_max_pending = 5000  # young objects allowed before collecting without slack
+
+class GcManager():
+    def __init__(self, min_slack=default_min_slack, max_pending=default_max_pending):
+        self._min_slack = min_slack
+        self._max_pending = max_pending
+        self._in_match = False
+        self._collections = 0
+        self._gen1_collections = 0
+        self._forced = 0
+        self._full = 0
+        self._time_sum = 0.0
+        self._time_max = 0.0
+
+    def set_match(self, in_match):
+        ''' Call once per tick with True during a match (AUTO or TELEOP) and
+        False otherwise.  Turns automatic collection off at the start of a
+        match, and back on, after a full collection, at the end of one. '''
+        if in_match == self._in_match: return
+        self._in_match = in_match
+        if in_match:
+            gc.disable()
+            return
+        gc.collect()
+        self._full += 1
+        gc.enable()
+
+    def in_match(self):
+        ''' Returns True if automatic collection is off for a match. '''
+        return self._in_match
+
+    def collect_in_slack(self, slack):
+        ''' Call at the end of each tick with the number of seconds until the
+        next tick is due.  During a match, collects the young generation (and
+        the middle one, if it is due) if there is enough slack.  Does nothing
+        outside of a match. '''
+        if not self._in_match: return
+        gen0, gen1, _ = gc.get_count()
+        if gen0 == 0: return
+        forced = gen0 > self._max_pending
+        if slack < self._min_slack and not forced: return
+        generation = 0
+        if gen1 >= gc.get_threshold()[1] and slack >= 2 * self._min_slack: generation = 1
+        t0 = time.monotonic()
+        gc.collect(generation)
+        dt = time.monotonic() - t0
+        self._collections += 1
+        if generation == 1: self._gen1_collections += 1
+        if forced and slack < self._min_slack: self._forced += 1
+        self._time_sum += dt
+        if dt > self._time_max: self._time_max = dt
+
+    def get_counts(self):
+        ''' Returns a dict of counts: {in_match:, collections:, gen1:, forced:,
+        full:, avg:, max:}, where collections is the number of collections done
+        in the slack, gen1 how many of those included the middle generation,
+        forced how many were done without enough slack, full the number of full
+        collections done at the end of matches, and avg and max are the run
+        times of the collections in the slack, in seconds. '''
+        avg = 0.0
+        if self._collections > 0: avg = self._time_sum / self._collections
+        return {"in_match": self._in_match, "collections": self._collections,
+            "gen1": self._gen1_collections, "forced": self._forced, "full": self._full,
+            "avg": avg, "max": self._time_max}
@@ -0,0 +1,124 @@
+# i2cbus.py -- Shared I2C bus with prioritized transactions
+# EPIC Robotz, dlb, Apr 2021
+#
+# All the devices on the robot share one I2C bus.  This module owns the
+# bus handle, and runs the transactions from all the device drivers one at
+# a time.  When several threads want the bus at once, the transactions are
+# run in priority order: actuator writes first, then safety reads, then
+# telemetry.  A transaction can also have a deadline -- if it cannot start
+# before then, it is dropped and DeadlineMissed is raised.
+
+import heapq
+import threading
+import time
+from smbus import SMBus
+
+default_bus_num = 1 # indicates /dev/ic2-1
+
+# Transaction priorities.  Lower numbers go first.
+PRIO_ACTUATOR  = 0  # Motor and other output writes
+PRIO_SAFETY    = 1  # Health checks and safety inputs, such as limit switches
+PRIO_TELEMETRY = 2  # Status and reporting reads
+
+def payload_size(op, args):
+    ''' Returns (nwrites, nreads), the number of data bytes sent and received 
+    by an SMBus op with the given args (not counting the device address). '''
+    if op == "write_byte_data": return 1, 0
+    if op == "read_byte_data": return 0, 1
+    if op == "write_i2c_block_data": return len(args[-1]), 0
+    if op == "read_i2c_block_data": return 0, args[-1]
+    return 0, 0
+
+class DeadlineMissed(IOError):
+    ''' Raised when a transaction could not start before its deadline.
+    Nothing was sent on the bus. '''
+    pass
+
+class I2CBus():
+    def __init__(self, bus_num=default_bus_num):
+        self._bus_num = bus_num
+        self._bus = SMBus(bus_num)
+        self._cond = threading.Condition()
+        self._queue = []    # heap of tuples of (priority, seqnum)
+        self._seqnum = 0
+        self._busy = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        ''' Clears all the statistics. '''
+        with self._cond:
+            self._stats = {}  # keyword=device, value = dict of counts
+            self._stats_start_time = time.monotonic()
+            self._busy_time = 0.0
+
+    def _device_stats(self, device):
+        ''' Returns the stats dict for a device, creating it if needed. '''
+        if device not in self._stats:
+            self._stats[device] = {"count": 0, "depth": 0, "max_depth": 0,
+                "wait": 0.0, "max_wait": 0.0, "busy": 0.0, "missed": 0}
+        return self._stats[device]
+
+    def transact(self, device, priority, op, *args, deadline=None):
+        ''' Runs one transaction on the bus, and returns its result.  The device
+        is a name used for the statistics, such as "arduino".  The op is the name
+        of the SMBus method to call, such as "read_byte_data", and args are passed
+        to it.  If the bus is in use, this waits until all queued transactions
+        with a higher priority (lower number) are done.  The deadline, if given,
+        is a time.monotonic() value; if the transaction cannot start by then,
+        DeadlineMissed is raised.  Bus errors are raised as IOError. '''
+        t_submit = time.monotonic()
+        with self._cond:
+            st = self._device_stats(device)
+            self._seqnum += 1
+            entry = (priority, self._seqnum)
+            heapq.heappush(self._queue, entry)
+            st["depth"] += 1
+            if st["depth"] > st["max_depth"]: st["max_depth"] = st["depth"]
+            while self._busy or self._queue[0] != entry:
+                self._cond.wait()
+            heapq.heappop(self._queue)
+            st["depth"] -= 1
+            t_start = time.monotonic()
+            wait = t_start - t_submit
+            st["wait"] += wait
+            if wait > st["max_wait"]: st["max_wait"] = wait
+            if deadline is not None and t_start > deadline:
+                st["missed"] += 1
+                self._cond.notify_all()
+                raise DeadlineMissed()
+            self._busy = True
+        try:
+            return getattr(self._bus, op)(*args)
+        finally:
+            t_end = time.monotonic()
+            with self._cond:
+                self._busy = False
+                self._busy_time += t_end - t_start
+                st["count"] += 1
+                st["busy"] += t_end - t_start
+                self._cond.notify_all()
+
+    def get_utilization(self):
+        ''' Returns the fraction of time (0.0 to 1.0) that the bus has been
+        busy since the statistics were reset. '''
+        with self._cond:
+            elapsed = time.monotonic() - self._stats_start_time
+            if elapsed <= 0.0: return 0.0
+            return self._busy_time / elapsed
+
+    def get_stats(self):
+        ''' Returns a dict of statistics for each device.  The keyword is the
+        device name, and the value is a dict with: count (transactions run),
+        depth (transactions waiting now), max_depth, avg_wait and max_wait
+        (seconds spent waiting for the bus), busy (seconds spent using the bus),
+        and missed (transactions dropped because of their deadline). '''
+        with self._cond:
+            d = {}
+            for device, st in self._stats.items():
+                n = st["count"] + st["missed"]
+                avg_wait = 0.0
+                if n > 0: avg_wait = st["wait"] / n
+                d[device] = {"count": st["count"], "depth": st["depth"],
+                    "max_depth": st["max_depth"], "avg_wait": avg_wait,
+                    "max_wait": st["max_wait"], "busy": st["busy"], "missed": st["missed"]}
+            return d
@@ -0,0 +1,120 @@
+# inputservice.py -- Change-bit driven service for the arduino's digital inputs
+# EPIC Robotz, dlb, Apr 2021
+#
+# The arduino sets a change bit in the SC register whenever one of the
+# digital inputs (D3-D8) changes, and keeps it set until it is cleared
+# through SCC.  This service reads SC once per loop tick, and only looks at
+# the inputs themselves (SI) when a change bit is set.  The change bits are
+# then cleared in one write, and edge events are recorded for user code.
+#
+# If a change bit is set but the input has the same value as before, the
+# input must have changed and changed back between two ticks.  That is
+# counted as a short pulse, and both edges are reported, so that no edge
+# is lost.  Note that the arduino only samples its inputs every 10 ms, so
+# pulses shorter than that may still be missed.
+
+import collections
+import arduino_reg_map as reg
+import i2cbus
+
+pin_names = ("D3", "D4", "D5", "D6", "D7", "D8")  # bit 0 to bit 5 in SI and SC
+pin_mask = 0x3F
+max_events = 64  # oldest events are dropped if user code does not collect them
+
+class InputService():
+    def __init__(self, arduino):
+        self._arduino = arduino
+        self._values = 0
+        self._have_values = False
+        self._events = collections.deque(maxlen=max_events)
+        self._edge_counts = [0 for _ in pin_names]
+        self._pulse_counts = [0 for _ in pin_names]
+        self._si_uses = 0
+        self._updates = 0
+
+    def _pin_to_bit(self, pin):
+        ''' Converts a pin number (3-8) or name ("D3"-"D8") to its bit number. '''
+        if type(pin) is str:
+            if pin in pin_names: return pin_names.index(pin)
+        elif type(pin) is int:
+            if pin >= 3 and pin <= 8: return pin - 3
+        raise ValueError("Bad input pin.")
+
+    def update(self):
+        ''' Call once per loop tick.  Reads the change bits, and if any are
+        set, reads the inputs, records the edges, and clears the change bits.
+        Returns True if there were no bus errors. '''
+        self._updates += 1
+        a = self._arduino
+        try:
+            if not self._have_values:
+                self._values = a.read_shadow(reg.SI, priority=i2cbus.PRIO_SAFETY) & pin_mask
+                self._si_uses += 1
+                self._have_values = True
+                return a.clear_change_bits()
+            # SC is read from the bus on every tick, so no change is seen late.
+            # SI is in the same shadow group, so it usually comes along with it.
+            changes = a.read_shadow(reg.SC, priority=i2cbus.PRIO_SAFETY, max_age=0) & pin_mask
+            if changes == 0: return True
+            si = a.read_shadow(reg.SI, priority=i2cbus.PRIO_SAFETY) & pin_mask
+            self._si_uses += 1
+        except IOError:
+            return False
+        okay = a.clear_change_bits(keep=~changes)
+        _, tme = a.get_timestamp()
+        for bit in range(len(pin_names)):
+            mask = 1 << bit
+            if changes & mask == 0: continue
+            pin = bit + 3
+            was_on = self._values & mask != 0
+            is_on = si & mask != 0
+            if was_on == is_on:
+                self._pulse_counts[bit] += 1
+                self._add_edge(pin, not was_on, tme)
+            self._add_edge(pin, is_on, tme)
+        self._values = si
+        return okay
+
+    def _add_edge(self, pin, is_on, tme):
+        ''' Records one edge event. '''
+        self._edge_counts[pin - 3] += 1
+        if is_on: self._events.append((pin, "rising", tme))
+        else: self._events.append((pin, "falling", tme))
+
+    def get_value(self, pin):
+        ''' Returns the last known value of the given pin (3-8 or "D3"-"D8"),
+        without using the bus. '''
+        return self._values & (1 << self._pin_to_bit(pin)) != 0
+
+    def get_digital(self, pin):
+        ''' Returns (okayflag, bool) for the given pin, the same as
+        Arduino_wb.get_digital(), so this service can be used in its place,
+        for example by a LimitSwitch. '''
+        return self._have_values, self.get_value(pin)
+
+    def get_events(self):
+        ''' Returns the list of edge events since the last call, oldest first.
+        Each event is a tuple of (pin, edge, tme), where pin is 3-8, edge is
+        "rising" (the input turned on) or "falling" (it turned off), and tme is
+        the arduino timestamp (ms) of the tick in which the edge was seen. '''
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+    def get_edge_count(self, pin):
+        ''' Returns the number of edges seen on the given pin. '''
+        return self._edge_counts[self._pin_to_bit(pin)]
+
+    def get_pulse_count(self, pin):
+        ''' Returns the number of pulses on the given pin that were shorter
+        than a loop tick, and so would have been missed by polling the input.'''
+        return self._pulse_counts[self._pin_to_bit(pin)]
+
+    def get_counts(self):
+        ''' Returns a dict of counts: {updates:, si_uses:}, where updates is
+        the number of ticks serviced, and si_uses the number of times the
+        inputs were needed because a change bit was set (or on the first
+        update).  SI is shadowed in the same group as SC, so with block reads
+        it comes from the same bus read as SC, and these are not separate
+        reads of the bus. '''
+        return {"updates": self._updates, "si_uses": self._si_uses}
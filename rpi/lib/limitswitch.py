@@ -5,7 +5,9 @@
 class LimitSwitch():
   def __init__(self, arduino, pin):
     ''' The pin can be 3-8, or "D3" - "D8".  See
-    arduino_wb.py for more info'''
+    arduino_wb.py for more info.  Instead of the arduino, the
+    base's input service (base.inputs) can be given, which
+    does not use the bus on each read.'''
     self.arduino = arduino
     self.pin = pin
   
@@ -0,0 +1,138 @@
+# looptimer.py -- Fixed rate timer for the main loop
+# EPIC Robotz, dlb, Apr 2021
+#
+# Instead of sleeping a fixed time after each pass (which makes the real
+# period the sleep time plus the work time), the timer sleeps until an
+# absolute deadline, and then moves the deadline forward by one period.
+# So the loop runs at the target rate no matter how long the work takes,
+# as long as it fits in a period.
+#
+# When a pass takes longer than a period (an overrun), the next tick runs
+# right away, and then the policy decides what happens to the ticks that
+# were missed:
+#
+#   "skip"    -- The missed ticks are dropped, and the loop goes back to
+#                its original schedule.  Good for control loops, where
+#                running several ticks back to back does no good.
+#   "catchup" -- The missed ticks are run back to back, until the loop is
+#                back on schedule.  Good when every tick must be counted.
+#                If the loop falls more than max_catchup ticks behind, the
+#                schedule is restarted instead.
+#
+# The timer also keeps a histogram of how late each tick was, compared to
+# its deadline, which is the jitter of the loop.
+#
+# A wake event (a threading.Event) can also be given to wait().  If it is set
+# before the next deadline, wait() returns right away, so that the loop can
+# respond to new input without waiting for the next tick.  These early wakes
+# do not move the schedule, so the fixed rate ticks still happen, and the
+# rate is a floor.
+
+import time
+
+default_rate = 100.0  # Hz
+policies = ("skip", "catchup")
+max_catchup = 10  # ticks
+
+# Upper edges of the jitter histogram buckets, in seconds.  The last bucket
+# catches everything later.
+jitter_buckets = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.010)
+
+class LoopTimer():
+    def __init__(self, rate_hz=default_rate, policy="skip"):
+        if policy not in policies: raise ValueError("Bad loop timer policy.")
+        self._policy = policy
+        self._period = 1.0 / rate_hz
+        self._next = None
+        self._behind = False  # True while catching up on missed ticks
+        self.reset_stats()
+
+    def reset_stats(self):
+        ''' Clears the statistics. '''
+        self._ticks = 0
+        self._wakes = 0
+        self._overruns = 0
+        self._skipped = 0
+        self._late_sum = 0.0
+        self._late_max = 0.0
+        self._histogram = [0 for _ in range(len(jitter_buckets) + 1)]
+
+    def set_rate(self, rate_hz):
+        ''' Changes the target rate.  The schedule restarts on the next tick. '''
+        self._period = 1.0 / rate_hz
+        self._next = None
+
+    def get_period(self):
+        ''' Returns the target period in seconds. '''
+        return self._period
+
+    def get_slack(self):
+        ''' Returns the number of seconds until the next tick is due, which is
+        the idle time left in this tick.  Zero if the loop is already late. '''
+        if self._next is None: return 0.0
+        slack = self._next - time.monotonic()
+        if slack < 0.0: return 0.0
+        return slack
+
+    def wait(self, wake_event=None):
+        ''' Call once per pass of the loop.  Sleeps until the next tick is due,
+        and returns True.  If a wake_event is given, and it is set before the
+        tick is due, the event is cleared, and False is returned right away.
+        The event is also cleared when the tick is due, since the tick handles
+        whatever set it, so it does not cause an extra event tick later.'''
+        now = time.monotonic()
+        if self._next is None: self._next = now
+        deadline = self._next
+        if now < deadline:
+            if wake_event is None: 
+                time.sleep(deadline - now)
+            elif wake_event.wait(deadline - now):
+                wake_event.clear()
+                self._wakes += 1
+                return False
+            now = time.monotonic()
+        elif now > deadline and not self._behind:
+            self._overruns += 1
+        if wake_event is not None: wake_event.clear()
+        self._record(now - deadline)
+        self._next = deadline + self._period
+        self._behind = self._next <= now
+        if self._behind:
+            nbehind = int((now - self._next) / self._period) + 1
+            if self._policy == "skip":
+                self._skipped += nbehind
+                self._next += nbehind * self._period
+                self._behind = False
+            elif nbehind > max_catchup:
+                self._skipped += nbehind
+                self._next = now + self._period
+                self._behind = False
+        return True
+
+    def _record(self, late):
+        ''' Adds the lateness of one tick to the statistics. '''
+        self._ticks += 1
+        self._late_sum += late
+        if late > self._late_max: self._late_max = late
+        i = 0
+        while i < len(jitter_buckets) and late > jitter_buckets[i]: i += 1
+        self._histogram[i] += 1
+
+    def get_jitter_histogram(self):
+        ''' Returns a list of (upper_edge_secs, count) for how late the ticks were.
+        The last upper edge is None, for all ticks later than the rest. '''
+        edges = list(jitter_buckets) + [None]
+        return list(zip(edges, self._histogram))
+
+    def get_stats(self):
+        ''' Returns a dict of statistics: {rate:, policy:, ticks:, wakes:, overruns:,
+        skipped:, avg_late:, max_late:}, where ticks is the number of fixed rate
+        ticks, wakes the number of early returns due to the wake event, overruns
+        the number of passes that took longer than a period, skipped the number of
+        ticks that were dropped, and avg_late and max_late are how late the ticks
+        ran, in seconds. '''
+        avg_late = 0.0
+        if self._ticks > 0: avg_late = self._late_sum / self._ticks
+        return {"rate": 1.0 / self._period, "policy": self._policy, "ticks": self._ticks,
+            "wakes": self._wakes, "overruns": self._overruns, "skipped": self._skipped,
+            "avg_late": avg_late, "max_late": self._late_max}
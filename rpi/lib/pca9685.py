@@ -1,12 +1,13 @@
 # pca9685.py -- Driver for PCA9685 module. 
 # EPIC Robotz, dlb, Feb 2021
 
-from smbus import SMBus
 import time
+import i2cbus
 
 default_addr = 0x4c # bus addres of PCA9685 board
 default_bus_num = 1 # SMBus(1) # indicates /dev/ic2-1
 default_masterfreq =  25000000  # acording to the specs
+device_name = "pca9685"  # name used in the bus statistics
 
 # Registors
 r_mode1    = 0x00
@@ -19,11 +20,18 @@ r_led0_on_L  = 0x06
 r_led0_on_H  = 0x07
 r_led0_off_L = 0x08
 r_led0_off_H = 0x09
+r_all_led_on_L  = 0xFA
+r_all_led_on_H  = 0xFB
+r_all_led_off_L = 0xFC
+r_all_led_off_H = 0xFD
+
+max_block_chans = 8  # An SMBus block is at most 32 bytes, which is 8 channels.
+default_keepalive = 0.5  # Seconds before an unchanged staged channel is written again.
 
 # Bits in Mode1
 b_restart = 1 << 7  # Used to awake from sleep.
 b_extclk  = 1 << 6  # Enables (1) of external clock. Not needed by us.
-b_ai      = 1 << 5  # Auto increment feature. Not needed by us.
+b_ai      = 1 << 5  # Auto increment feature. Used to write a channel in one transaction.
 b_sleep   = 1 << 4  # Setting this bit causes chip to sleep.  Must clear for operation.
 b_allcall = 1 << 0  # Setting this bit enabled response to all-call. Not needed by us.
 
@@ -32,15 +40,46 @@ b_invrt   = 1 << 4  # Enables inverted output state. Not needed by us.
 b_och     = 1 << 3  # Controls with PWM settings take effect. We want 1 for immediate.
 b_outdrv  = 1 << 2  # Sets totem pole (1) or Open Drain (0) outputs. We want 1.
 
+def servo_to_usec(rotation, minpw=800, maxpw=2200):
+    ''' Converts a servo rotation from -1 (lowest angle) to 1 (highest angle)
+    to a pulsewidth in usecs, limited to minpw and maxpw. '''
+    span = int(maxpw - minpw)
+    center = int(minpw + span/2)
+    move = int(rotation * (span / 2))
+    usec = center + move
+    if usec > maxpw: usec = maxpw 
+    if usec < minpw: usec = minpw
+    return usec
+
 class PCA9685():
-    def __init__(self, addr=default_addr, bus_num=default_bus_num, skipinit=False, bus_monitor=None):
+    def __init__(self, addr=default_addr, bus_num=default_bus_num, skipinit=False, bus_monitor=None,
+            auto_increment=True, staging=False, keepalive=default_keepalive, bus=None):
+        ''' The bus is a shared i2cbus.I2CBus.  If not given, the pca9685
+        gets a bus of its own. '''
         self._addr = default_addr
         self._bus_num = default_bus_num
-        self._bus = SMBus(self._bus_num)
+        if bus is None: bus = i2cbus.I2CBus(self._bus_num)
+        self._bus = bus
         self._inited = False
         self._usec_per_tick = 4.84  # Recalculated when frequency is set.
         self._bus_monitor = bus_monitor
+        self._auto_increment = auto_increment
+        self._staging = staging
+        self._default_keepalive = keepalive
+        self._keepalive = {}  # keyword=chan, value = keepalive secs, if not default
+        self._staged = {}     # keyword=chan, value = requested off time in ticks
+        self._flushed = {}    # keyword=chan, value = tuple of (ticks, timestamp) last written
+        self._dirty = {}      # reused by flush(), so nothing is allocated when nothing changed
+        self._chan_writes = 0
+        self._writes_avoided = 0
         if skipinit:
+            # The chip was set up by someone else, so auto increment may be
+            # off.  Block writes are only used if it is on, since without it
+            # all the bytes would land in the first register.
+            try:
+                self._auto_increment = auto_increment and (self.readreg(r_mode1) & b_ai) != 0
+            except IOError:
+                self._auto_increment = False
             self._inited = True
         else:
             self.init()
@@ -51,51 +90,149 @@ class PCA9685():
         should try calling init().'''
         return self._inited
     
-    def writereg(self, regadr, dat):
-        ''' Reads a register from the pca9685.  This is done without
-        protection against errors on the I2C bus. '''
+    def _xfer(self, op, *args):
+        ''' Runs one transaction on the shared bus at actuator priority, and
+        reports it to the bus monitor.  IOError is raised on bus errors. '''
+        t0 = time.monotonic()
         try:
-            self._bus.write_byte_data(self._addr, regadr, dat)
-            if self._bus_monitor: self._bus_monitor.on_success()
+            dat = self._bus.transact(device_name, i2cbus.PRIO_ACTUATOR, op, self._addr, *args)
         except IOError:
-            if self._bus_monitor: self._bus_monitor.on_fail()
+            if self._bus_monitor: 
+                self._bus_monitor.on_fail(op, device_name, args[0], time.monotonic() - t0)
             raise
-        except OSError:
-            if self._bus_monitor: self._bus_monitor.on_fail()
-            raise IOError()
+        if self._bus_monitor: 
+            nwrites, nreads = i2cbus.payload_size(op, args)
+            self._bus_monitor.on_success(op, nwrites, nreads, device_name, args[0], time.monotonic() - t0)
+        return dat
+
+    def writereg(self, regadr, dat):
+        ''' Reads a register from the pca9685.  This is done without
+        protection against errors on the I2C bus. '''
+        self._xfer("write_byte_data", regadr, dat)
 
     def readreg(self, regadr):
         ''' Writes to a register on the pca9685.  This is done without
         protection against errors on the I2C bus. '''
-        try:
-            dat = self._bus.read_byte_data(self._addr, regadr)
-            if self._bus_monitor: self._bus_monitor.on_success()
-            return dat
-        except IOError:    
-            if self._bus_monitor: self._bus_monitor.on_fail()
-            raise
-        except OSError:
-            if self._bus_monitor: self._bus_monitor.on_fail()
-            raise IOError()
+        return self._xfer("read_byte_data", regadr)
 
-    def set_pwm(self, chan, pulsewidth_usec):
-        ''' Sets a channel's pulsewidth, given in usecs. 
-            Returns True if no error detected. '''
-        if not self._inited: return
-        offtime = int(round(pulsewidth_usec / self._usec_per_tick))
+    def writeblock(self, regadr, dat):
+        ''' Writes the list of bytes in dat to consecutive registers on the 
+        pca9685 in one transaction.  The auto increment mode must be on.
+        This is done without protection against errors on the I2C bus. '''
+        self._xfer("write_i2c_block_data", regadr, dat)
+
+    def usec_to_ticks(self, pulsewidth_usec):
+        ''' Converts a pulsewidth in usecs to the off time in ticks. '''
+        return int(round(pulsewidth_usec / self._usec_per_tick))
+
+    def _write_ticks(self, chan, offtime):
+        ''' Writes the on and off time registers for one channel. '''
         byteH = (offtime >> 8) & 0xFF
         byteL = offtime & 0xFF
         regnum = r_led0_on_L + (chan * 4)
+        # Note: all 4 regs for the chan must be writen to cause effect
+        if self._auto_increment:
+            self.writeblock(regnum, [0, 0, byteL, byteH])
+            return
+        self.writereg(regnum + 0, 0)     # Low byte of on time
+        self.writereg(regnum + 1, 0)     # High byte of on time
+        self.writereg(regnum + 2, byteL) # Low byte of off time
+        self.writereg(regnum + 3, byteH) # High byte of off time
+
+    def _write_ticks_many(self, ticks):
+        ''' Writes the off time for each channel in the dict ticks, {chan: ticks}.
+        Runs of consecutive channels are written in one transaction each. '''
+        chans = sorted(ticks.keys())
+        if not self._auto_increment:
+            for chan in chans: self._write_ticks(chan, ticks[chan])
+            return
+        i = 0
+        while i < len(chans):
+            first = chans[i]
+            dat = []
+            while i < len(chans) and chans[i] == first + len(dat) // 4 and len(dat) < 4 * max_block_chans:
+                offtime = ticks[chans[i]]
+                dat.extend((0, 0, offtime & 0xFF, (offtime >> 8) & 0xFF))
+                i += 1
+            self.writeblock(r_led0_on_L + (first * 4), dat)
+
+    def set_pwm(self, chan, pulsewidth_usec):
+        ''' Sets a channel's pulsewidth, given in usecs.  If staging is on, 
+        the pulsewidth is only recorded, and is written on the next flush().
+            Returns True if no error detected. '''
+        if not self._inited: return
+        if self._staging:
+            self._staged[chan] = self.usec_to_ticks(pulsewidth_usec)
+            return True
+        try:
+            self._write_ticks(chan, self.usec_to_ticks(pulsewidth_usec))
+        except IOError:
+            return False
+        return True
+
+    def set_pwm_many(self, pulsewidths):
+        ''' Sets the pulsewidth of several channels, given as a dict of
+        {chan: usecs}.  Consecutive channels are written together, so that
+        as few bus transactions as possible are used.
+            Returns True if no error detected. '''
+        if not self._inited: return
+        ticks = {}
+        for chan, usec in pulsewidths.items():
+            ticks[chan] = self.usec_to_ticks(usec)
+        if self._staging:
+            self._staged.update(ticks)
+            return True
         try:
-            # Note: all 4 regs for the chan must be writen to cause effect
-            self.writereg(regnum + 0, 0)     # Low byte of on time
-            self.writereg(regnum + 1, 0)     # High byte of on time
-            self.writereg(regnum + 2, byteL) # Low byte of off time
-            self.writereg(regnum + 3, byteH) # High byte of off time
+            self._write_ticks_many(ticks)
         except IOError:
             return False
         return True
 
+    def enable_staging(self, enable):
+        ''' Turns output staging on or off.  With staging on, set_pwm() only
+        records the pulsewidth, and flush() writes the channels that have
+        changed.  Turning staging off flushes anything still staged.'''
+        if not enable and self._staging: self.flush()
+        self._staging = enable
+
+    def set_keepalive(self, chan, secs):
+        ''' Sets the number of seconds after which a staged channel is 
+        written again by flush(), even if it has not changed.  This guards
+        against lost writes. '''
+        self._keepalive[chan] = secs
+
+    def flush(self):
+        ''' Writes the staged channels that have changed since they were last 
+        written, or whose keepalive period has run out.  Call this once at the
+        end of each control tick.  Returns True if no error detected. '''
+        if not self._inited or not self._staged: return True
+        timenow = time.monotonic()
+        dirty = self._dirty
+        dirty.clear()
+        for chan, ticks in self._staged.items():
+            if chan in self._flushed:
+                last_ticks, last_time = self._flushed[chan]
+                keepalive = self._keepalive.get(chan, self._default_keepalive)
+                if last_ticks == ticks and timenow - last_time < keepalive:
+                    self._writes_avoided += 1
+                    continue
+            dirty[chan] = ticks
+        if not dirty: return True
+        try:
+            self._write_ticks_many(dirty)
+        except IOError:
+            for chan in dirty: self._flushed.pop(chan, None)
+            return False
+        self._chan_writes += len(dirty)
+        for chan, ticks in dirty.items(): self._flushed[chan] = (ticks, timenow)
+        return True
+
+    def get_staging_stats(self):
+        ''' Returns a dict of staging counts: {written:, avoided:}, where 
+        written is the number of channel writes made by flush(), and avoided
+        is the number of staged channels that did not need to be written.'''
+        return {"written": self._chan_writes, "avoided": self._writes_avoided}
+
     def set_frequency(self, hz, masterfreq=2500000):
         ''' Sets the PWM frequency for all channels. Default is 50 Hz. 
             Returns True if no error detected. '''
@@ -121,9 +258,11 @@ class PCA9685():
         ''' Initialize PWM module -- must be called before setting pwm signals. 
             Currently, this is being done when the object is created.
             Returns True if no error detected. '''
+        self._flushed = {}  # After a (re)init, staged channels must all be rewritten.
         try:
             # set overall modes with the two main registors
-            self.writereg(r_mode1, 0)
+            if self._auto_increment: self.writereg(r_mode1, b_ai)
+            else: self.writereg(r_mode1, 0)
             self.writereg(r_mode2, b_och | b_outdrv)
             time.sleep(0.0005) # Time required to start the chips oscillator.
             # now we need to write zero to the sleep bit without distrubing the other bits
@@ -142,12 +281,7 @@ class PCA9685():
         ''' Set servo rotation from -1 (lowest angle) to 1 (highest angle).
         You can control the extreme settings for pulsewidth with minpw, maxpw.
         Returns True if no error detected. '''
-        span = int(maxpw - minpw)
-        center = int(minpw + span/2)
-        move = int(rotation * (span / 2))
-        usec = center + move
-        if usec > maxpw: usec = maxpw 
-        if usec < minpw: usec = minpw
+        usec = servo_to_usec(rotation, minpw, maxpw)
         try:
             self.set_pwm(chan, usec)
         except IOError:
@@ -155,10 +289,26 @@ class PCA9685():
         return True
         
     def killall(self):
-        ''' Shuts down pwm on all channels. Returns True if no error detected.'''
+        ''' Shuts down pwm on all channels. Returns True if no error detected.
+        With auto increment on, this is done with one write to the ALL_LED
+        registers.'''
+        if not self._inited: return True
         try:
-            for i in range(16):
-                self.set_pwm(i, 0)
+            if self._auto_increment:
+                self.writeblock(r_all_led_on_L, [0, 0, 0, 0])
+            else:
+                for i in range(16):
+                    self._write_ticks(i, 0)
         except IOError:
             return False 
+        # killall is never staged, but the staged values must agree with it.
+        # All the channels are now zero on the chip, so all are marked as
+        # flushed at zero, but only the channels already staged are staged,
+        # so that channels the robot never uses are not rewritten by flush()
+        # at each keepalive.
+        timenow = time.monotonic()
+        for chan in range(16):
+            self._flushed[chan] = (0, timenow)
+        for chan in self._staged:
+            self._staged[chan] = 0
         return True
\ No newline at end of file
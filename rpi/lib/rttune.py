@@ -0,0 +1,90 @@
+# rttune.py -- Tunes the main loop thread for steadier loop timing on the Raspberry Pi
+# EPIC Robotz, dlb, Apr 2021
+#
+# Most of the jitter in the main loop does not come from our code, but from
+# the OS running other things, from page faults, and from the garbage
+# collector.  These steps can reduce it:
+#
+#   priority   -- Run the calling thread with SCHED_FIFO, so that normal
+#                 processes cannot get in its way.  Needs root (or
+#                 CAP_SYS_NICE).
+#   cpu        -- Pin the calling thread to one core, so it is not moved
+#                 around.  Best with a core kept free of other work (isolcpus).
+#   lock_mem   -- Lock all current and future memory of the process into RAM
+#                 (mlockall), so that it can never be paged out.  Needs root
+#                 (or CAP_IPC_LOCK).
+#   freeze_gc  -- Collect once, and then move all the objects that exist
+#                 after initialization into a permanent generation, so the
+#                 collector never scans them again (gc.freeze).
+#
+# Each step is optional.  A step that fails is logged, and the others are
+# still done.
+#
+# The priority and cpu steps only apply to the calling thread, and to
+# threads it starts afterwards.  runbot calls apply() from the main loop
+# thread after initialization, so only the main loop gets SCHED_FIFO and
+# the pinning.  The threads that are already running (the MQTT network
+# thread, the terminal reporter) and the sandbox process keep the normal
+# scheduler, and can run on the other cores, so they do not compete with
+# the main loop.  A process started later from the main loop (such as a
+# restarted sandbox) would inherit them, so it calls reset_thread() first.
+# Initialization must also be done before freeze_gc.
+
+import ctypes
+import ctypes.util
+import gc
+import os
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+def set_priority(priority):
+    ''' Sets SCHED_FIFO at the given priority (1-99) for the calling thread. '''
+    os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+
+def set_cpu(cpu):
+    ''' Pins the calling thread to the given core. '''
+    os.sched_setaffinity(0, {cpu})
+
+def reset_thread():
+    ''' Puts the calling thread back on the normal scheduler, on all cores.
+    Does nothing if the platform does not support it, or does not allow it. '''
+    if not hasattr(os, "sched_setscheduler"): return
+    try:
+        os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+        os.sched_setaffinity(0, range(os.cpu_count()))
+    except OSError:
+        pass
+
+def lock_memory():
+    ''' Locks all current and future pages of the process into RAM. '''
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+def freeze_gc():
+    ''' Collects, and then freezes all objects into the permanent generation. '''
+    gc.collect()
+    gc.freeze()
+
+def apply(priority=None, cpu=None, lock_mem=False, freeze=False, log=print):
+    ''' Does the requested steps: SCHED_FIFO at priority if not None, pinning to
+    the cpu if not None, locking memory if lock_mem, and freezing the gc heap if
+    freeze.  Each step's result is logged.  Returns a dict of the steps that were
+    requested, where the value is True if the step worked. '''
+    steps = []
+    if priority is not None: steps.append(("priority", lambda: set_priority(priority), "SCHED_FIFO priority %d" % priority))
+    if cpu is not None: steps.append(("cpu", lambda: set_cpu(cpu), "pinned to cpu %d" % cpu))
+    if lock_mem: steps.append(("lock_mem", lock_memory, "memory locked"))
+    if freeze: steps.append(("freeze_gc", freeze_gc, "gc heap frozen"))
+    results = {}
+    for name, fnc, desc in steps:
+        try:
+            fnc()
+            results[name] = True
+            log("Real-time tuning: %s." % desc)
+        except Exception as e:
+            results[name] = False
+            log("Real-time tuning: %s failed: %s" % (name, e))
+    return results
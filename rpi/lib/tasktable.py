@@ -0,0 +1,161 @@
+# tasktable.py -- Multi-rate task table for the main loop
+# EPIC Robotz, dlb, Apr 2021
+#
+# The main loop calls run_tick() once per tick.  Each task in the table has
+# a period (a whole number of ticks), a phase (the tick within its period on
+# which it runs), and a priority (lower numbers run first within a tick).
+#
+# Tasks that do not run every tick are "slow" tasks.  If a slow task is added
+# without a phase, a phase is picked so that it never runs on the same tick
+# as the slow tasks already in the table, if that is possible.  Two tasks with
+# periods p1 and p2 and phases f1 and f2 meet on some tick exactly when f1 and
+# f2 are equal modulo gcd(p1, p2), so the check is cheap.
+#
+# Tasks can also be marked to run on event ticks.  These are extra ticks,
+# between the regular ones, when new input arrives.  Only the marked tasks
+# run on them, and they do not count toward the periods of the others.
+#
+# The run time of each task is measured, so that slow tasks can be found.
+# Besides the average and max, the p50 and p99 over the recent runs are
+# kept, along with the same for the whole tick.
+#
+# An exception raised by a task is caught and counted, and the traceback is
+# printed the first time, so that one failing task (such as a user task) can
+# not stop the others, or the main loop.
+
+import math
+import time
+import traceback
+import perfstats
+
+class Task():
+    def __init__(self, name, func, period, phase, priority, on_event=False):
+        self.name = name
+        self.func = func
+        self.period = period   # ticks
+        self.phase = phase     # ticks
+        self.priority = priority
+        self.on_event = on_event  # True to also run on event ticks
+        self.errors = 0           # exceptions raised by func
+        self.times = perfstats.RollingStats()
+        self.reset_stats()
+
+    def reset_stats(self):
+        ''' Clears the run time statistics. '''
+        self.runs = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = 0.0
+        self.times.reset()
+
+class TaskTable():
+    def __init__(self, rate_hz):
+        self._rate = rate_hz
+        self._tasks = []   # in order of priority
+        self._tick = 0
+        self._tick_times = perfstats.RollingStats()  # run time of whole ticks
+
+    def secs_to_ticks(self, secs):
+        ''' Converts a period in seconds to a whole number of ticks (at least one). '''
+        if secs is None: return 1
+        return max(1, int(round(secs * self._rate)))
+
+    def add_task(self, name, func, period=None, phase=None, priority=10, on_event=False):
+        ''' Adds a task to the table.  The func is called with no arguments.  The
+        period is in seconds, where None means every tick.  The phase is in ticks;
+        if None, it is picked to keep slow tasks apart.  Tasks with the same
+        priority run in the order they were added.  If on_event is True, the task
+        also runs on event ticks. Returns the Task. '''
+        if self.find_task(name) is not None: raise ValueError("Task %s already exists." % name)
+        nticks = self.secs_to_ticks(period)
+        if phase is None: phase = self._pick_phase(nticks)
+        task = Task(name, func, nticks, phase % nticks, priority, on_event)
+        i = 0
+        while i < len(self._tasks) and self._tasks[i].priority <= priority: i += 1
+        self._tasks.insert(i, task)
+        return task
+
+    def remove_task(self, name):
+        ''' Removes the named task.  Returns True if it was found. '''
+        task = self.find_task(name)
+        if task is None: return False
+        self._tasks.remove(task)
+        return True
+
+    def find_task(self, name):
+        ''' Returns the named Task, or None if not found. '''
+        for task in self._tasks:
+            if task.name == name: return task
+        return None
+
+    def _pick_phase(self, nticks):
+        ''' Returns the phase that collides with the fewest slow tasks. '''
+        if nticks <= 1: return 0
+        best_phase, best_count = 0, None
+        for phase in range(nticks):
+            count = 0
+            for task in self._tasks:
+                if task.period <= 1: continue
+                if (phase - task.phase) % math.gcd(nticks, task.period) == 0: count += 1
+            if best_count is None or count < best_count:
+                best_phase, best_count = phase, count
+            if count == 0: break
+        return best_phase
+
+    def run_tick(self, event=False):
+        ''' Runs all the tasks that are due on this tick, in priority order.  If
+        event is True, this is an event tick, and only the tasks marked to run
+        on events are run. '''
+        tick = self._tick
+        if not event: self._tick += 1
+        t_start = time.monotonic()
+        for task in self._tasks:
+            if event:
+                if not task.on_event: continue
+            elif task.period > 1 and tick % task.period != task.phase: continue
+            t0 = time.monotonic()
+            try:
+                task.func()
+            except Exception:
+                task.errors += 1
+                if task.errors == 1:
+                    print("**** Task %s failed." % task.name)
+                    traceback.print_exc()
+            dt = time.monotonic() - t0
+            task.runs += 1
+            task.total_time += dt
+            task.last_time = dt
+            task.times.add(dt)
+            if dt > task.max_time: task.max_time = dt
+        self._tick_times.add(time.monotonic() - t_start)
+
+    def get_tick(self):
+        ''' Returns the number of ticks run so far. '''
+        return self._tick
+
+    def reset_stats(self):
+        ''' Clears the run time statistics for all tasks. '''
+        for task in self._tasks: task.reset_stats()
+        self._tick_times.reset()
+
+    def get_tick_percentiles(self):
+        ''' Returns (p50, p99, max) of the recent run times of whole ticks, in seconds. '''
+        return self._tick_times.get_percentiles()
+
+    def get_stats(self):
+        ''' Returns a list of dicts, one for each task in priority order:
+        {name:, period:, phase:, priority:, runs:, errors:, avg:, max:, last:, p50:,
+        p99:, recent_max:}, where period and phase are in ticks, errors is the
+        number of exceptions the task raised, and the rest are run times in
+        seconds.  The max is since the stats were reset, and p50, p99 and
+        recent_max are over the recent runs. '''
+        lst = []
+        for task in self._tasks:
+            avg = 0.0
+            if task.runs > 0: avg = task.total_time / task.runs
+            p50, p99, recent_max = task.times.get_percentiles()
+            lst.append({"name": task.name, "period": task.period, "phase": task.phase,
+                "priority": task.priority, "runs": task.runs, "errors": task.errors, "avg": avg,
+                "max": task.max_time, "last": task.last_time, "p50": p50, "p99": p99,
+                "recent_max": recent_max})
+        return lst
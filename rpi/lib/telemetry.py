@@ -0,0 +1,95 @@
+# telemetry.py -- Collects the arduino's registers for the driver station, a few at a time
+# EPIC Robotz, dlb, Apr 2021
+#
+# Reading all the registers at once, in the same tick as the status report,
+# makes that tick much longer than the others.  Instead, step() is called
+# from a task, spread out over the report period, and reads only a small
+# budget of registers each time, in order.  When the last register has been
+# read, the values are saved as a complete snapshot, and collection starts
+# over.  The reports to the driver station just use the latest snapshot,
+# without using the bus.
+#
+# The four timestamp registers (DTME1-DTME4) are always read together, so
+# the timestamp in a snapshot is never torn.
+
+import time
+import arduino_reg_map as reg
+
+default_budget = 4  # registers read per tick
+atomic_groups = ((reg.DTME1, reg.DTME4),)  # registers that must be read in one chunk
+
+def make_chunks(nregs, budget):
+    ''' Splits the registers 0 to nregs-1 into a list of (first, n) chunks,
+    each of at most budget registers, without splitting an atomic group. '''
+    chunks = []
+    first = 0
+    while first < nregs:
+        end = min(first + budget, nregs)
+        for g0, g1 in atomic_groups:
+            if g0 < end <= g1:
+                if g0 > first: end = g0
+                else: end = g1 + 1
+        chunks.append((first, end - first))
+        first = end
+    return chunks
+
+class Telemetry():
+    def __init__(self, arduino, budget=default_budget):
+        self._arduino = arduino
+        self._nregs = reg.LAST_V2 + 1
+        self._chunks = make_chunks(self._nregs, budget)
+        self._values = [0 for _ in range(self._nregs)]
+        self._index = 0
+        self._frame_okay = True
+        self._frame_start = None
+        self._snapshot = None   # tuple of (okay, values, time.monotonic() when complete)
+        self._frame_count = 0
+        self._read_errors = 0
+
+    def step(self):
+        ''' Reads the next chunk of registers.  Call it often enough that all
+        the chunks are read once per report. '''
+        if self._index == 0:
+            self._frame_start = time.monotonic()
+            self._frame_okay = True
+        first, n = self._chunks[self._index]
+        okay, d = self._arduino.read_range(first, n)
+        if okay: self._values[first:first + n] = d
+        else:
+            self._frame_okay = False
+            self._read_errors += 1
+        self._index += 1
+        if self._index >= len(self._chunks):
+            self._index = 0
+            self._frame_count += 1
+            self._snapshot = (self._frame_okay, tuple(self._values), time.monotonic())
+
+    def restart(self):
+        ''' Starts a new frame on the next step, such as after a bus failure. '''
+        self._index = 0
+
+    def get_snapshot(self):
+        ''' Returns the latest complete snapshot as (okayflag, values, age), where
+        okayflag is False if any read for the snapshot failed, values is a tuple of
+        all the register values, and age is the number of seconds since the snapshot
+        was completed.  Returns (False, None, 0.0) if there is no snapshot yet. '''
+        if self._snapshot is None: return False, None, 0.0
+        okay, values, tme = self._snapshot
+        return okay, values, time.monotonic() - tme
+
+    def get_battery_voltages(self):
+        ''' Returns (bat_m, bat_l), the battery voltages from the latest snapshot,
+        or zeros if there is none. '''
+        if self._snapshot is None: return 0.0, 0.0
+        _, values, _ = self._snapshot
+        return values[reg.BAT_M] / 10.0, values[reg.BAT_L] / 10.0
+
+    def get_frame_count(self):
+        ''' Returns the number of complete snapshots collected. '''
+        return self._frame_count
+
+    def get_counts(self):
+        ''' Returns a dict of counts: {frames:, chunks:, errors:}, where chunks
+        is the number of steps needed for each snapshot. '''
+        return {"frames": self._frame_count, "chunks": len(self._chunks),
+            "errors": self._read_errors}
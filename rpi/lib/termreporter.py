@@ -0,0 +1,63 @@
+# termreporter.py -- Writes status reports to the terminal from a background thread
+# EPIC Robotz, dlb, Apr 2021
+#
+# Printing to the terminal can block when stdout is slow, such as over a
+# slow SSH or VNC link.  To keep that from stalling the main loop, the loop
+# only takes a snapshot of its state (a dict) and submits it here.  The
+# snapshots are queued, and a background thread hands them to the report
+# function, which does the formatting and printing.
+#
+# The queue is bounded.  If the terminal falls behind and the queue is
+# full, the oldest snapshot is dropped to make room, so submit() never
+# blocks, and the reports that are printed are the most recent ones.
+
+import collections
+import threading
+
+default_maxlen = 2  # snapshots waiting to be reported
+
+class TermReporter():
+    def __init__(self, report_fn, maxlen=default_maxlen):
+        ''' The report_fn is called on the background thread with each
+        snapshot, and should print the report. '''
+        self._report_fn = report_fn
+        self._queue = collections.deque(maxlen=maxlen)
+        self._event = threading.Event()
+        self._submitted = 0
+        self._dropped = 0
+        self._reported = 0
+        self._errors = 0
+        self._thread = threading.Thread(target=self._run, name="term-reporter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, snapshot):
+        ''' Queues a snapshot to be reported.  Never blocks.  If the queue is
+        full, the oldest snapshot in it is dropped. '''
+        if len(self._queue) >= self._queue.maxlen: self._dropped += 1
+        self._queue.append(snapshot)
+        self._submitted += 1
+        self._event.set()
+
+    def _run(self):
+        ''' Background thread that reports the queued snapshots. '''
+        while True:
+            self._event.wait()
+            self._event.clear()
+            while True:
+                try:
+                    snapshot = self._queue.popleft()
+                except IndexError:
+                    break
+                try:
+                    self._report_fn(snapshot)
+                    self._reported += 1
+                except Exception:
+                    self._errors += 1
+
+    def get_counts(self):
+        ''' Returns a dict of counts: {submitted:, reported:, dropped:, errors:},
+        where dropped is the number of snapshots thrown away because the terminal
+        was too slow, and errors the number of times the report function failed. '''
+        return {"submitted": self._submitted, "reported": self._reported,
+            "dropped": self._dropped, "errors": self._errors}
@@ -0,0 +1,347 @@
+# usersandbox.py -- Runs the user's WaterBot code in a separate process
+# EPIC Robotz, dlb, Apr 2021
+#
+# Normally the user's stop(), auto() and teleop() are called right in the
+# main loop, so if they are slow or hang, the whole robot hangs with them,
+# including the code that stops the robot when the driver station goes
+# quiet.  In sandbox mode, the user's WaterBot runs in a child process
+# instead.  The base talks to it through a block of shared memory:
+#
+#   1. On each tick, the base writes the inputs (mode, joysticks, digital
+#      inputs and batteries) into shared memory, and signals the child.
+#   2. The child copies the inputs into a stand-in base object, calls the
+#      user's code, and writes the actuator commands it made (PCA9685
+#      pulsewidths and arduino PWM values) back into shared memory.
+#   3. The base waits for the child, but no longer than the per-tick budget.
+#      If the child finishes in time, its commands are sent to the hardware.
+#      If not, that is counted as an overrun.  While the child is still busy,
+#      it is not given new ticks.  If it is late for failsafe_ticks ticks in
+#      a row (overrun, or still busy), the failsafe is applied: all the
+#      actuators are turned off.  If it stays busy longer than hang_timeout,
+#      it is killed and started over.
+#
+# Only the PCA9685 channels the user code has set are sent on, so the
+# channels it never uses are left alone.  A killall() in the child is passed
+# to the base as a count, and the base does one real killall().
+#
+# In the child, the user code sees base.pca, base.arduino and base.inputs,
+# but these are proxies that only support the calls for actuators and
+# inputs (set_pwm, set_servo, killall, get_digital, and so on).
+
+import math
+import multiprocessing
+import os
+import time
+import traceback
+import arduino_reg_map as reg
+import pca9685
+import rttune
+
+default_budget = 0.005     # secs the user code may take per tick
+hang_timeout = 1.0         # secs before a busy child is restarted
+failsafe_ticks = 3         # late ticks in a row before the actuators are turned off
+startup_timeout = 10.0     # secs to wait for the child to initialize
+
+modes = ("stop", "auto", "teleop")  # the user method for each mode code
+
+# Layout of the shared memory, an array of doubles.
+IN_SEQ      = 0    # tick sequence number, written by the base
+IN_MODE     = 1    # index into modes
+IN_LOOP     = 2    # loop_count
+IN_TIME     = 3    # time_to_run
+IN_AXES0    = 4    # 6 values
+IN_AXES1    = 10   # 6 values
+IN_BUTTONS0 = 16   # 12 values, 0 or 1
+IN_BUTTONS1 = 28   # 12 values, 0 or 1
+IN_POV0     = 40   # 2 values
+IN_POV1     = 42   # 2 values
+IN_DIGITAL  = 44   # input bits for D3-D8, as from the SI register
+IN_BAT_M    = 45
+IN_BAT_L    = 46
+OUT_SEQ     = 47   # tick sequence number the child has finished
+OUT_ERROR   = 48   # number of exceptions raised by the user code
+OUT_KILL    = 49   # number of times the user code called pca.killall()
+OUT_PCA     = 50   # 16 pulsewidths in usecs, NaN if not set since the last killall
+OUT_ARD_PWM = 66   # 3 arduino PWM values (PWM9-PWM11), NaN if never set
+IN_AGE      = 69   # age in secs of the newest joystick input
+SHM_SIZE    = 70
+
+class PcaProxy():
+    ''' Stands in for the PCA9685 in the child process. '''
+    def __init__(self, shm):
+        self._shm = shm
+
+    def is_initialized(self):
+        return True
+
+    def set_pwm(self, chan, pulsewidth_usec):
+        self._shm[OUT_PCA + chan] = pulsewidth_usec
+        return True
+
+    def set_pwm_many(self, pulsewidths):
+        for chan, usec in pulsewidths.items(): self._shm[OUT_PCA + chan] = usec
+        return True
+
+    def set_servo(self, chan, rotation, minpw=800, maxpw=2200):
+        return self.set_pwm(chan, pca9685.servo_to_usec(rotation, minpw, maxpw))
+
+    def killall(self):
+        ''' The base does the real killall(), so the channels are just unset. '''
+        for chan in range(16): self._shm[OUT_PCA + chan] = math.nan
+        self._shm[OUT_KILL] += 1
+        return True
+
+class ArduinoProxy():
+    ''' Stands in for the arduino in the child process. '''
+    def __init__(self, shm):
+        self._shm = shm
+
+    def set_pwm(self, chan, v):
+        ichan = -1
+        if type(chan) is str:
+            if chan.upper() == "ALL": ichan = 0
+            else: ichan = reg.name2adr(chan)
+        if type(chan) is int: ichan = chan
+        if ichan == 0:
+            for i in range(len(reg.pwm_chans)): self._shm[OUT_ARD_PWM + i] = v
+            return True
+        if ichan not in reg.pwm_chans: raise Exception("Unknown or invalid channel.")
+        self._shm[OUT_ARD_PWM + reg.pwm_chans.index(ichan)] = v
+        return True
+
+    def get_digital(self, pin):
+        if type(pin) is str: pin = int(pin[1:])
+        if pin < 3 or pin > 8: raise ValueError("Bad input pin.")
+        return True, int(self._shm[IN_DIGITAL]) & (1 << (pin - 3)) != 0
+
+    def get_battery_voltage(self, battype="M"):
+        if battype == "M": return True, self._shm[IN_BAT_M]
+        if battype == "L": return True, self._shm[IN_BAT_L]
+        raise ValueError("Unknown battery type.")
+
+class InputsProxy():
+    ''' Stands in for the input service in the child process. '''
+    def __init__(self, arduino):
+        self._arduino = arduino
+
+    def get_digital(self, pin):
+        return self._arduino.get_digital(pin)
+
+    def get_value(self, pin):
+        _, v = self._arduino.get_digital(pin)
+        return v
+
+class SandboxBase():
+    ''' The base object given to the user's WaterBot in the child process. '''
+    def __init__(self, shm):
+        self._shm = shm
+        self.pca = PcaProxy(shm)
+        self.arduino = ArduinoProxy(shm)
+        self.inputs = InputsProxy(self.arduino)
+        self.botmode = "STOP"
+        self.time_to_run = 0.0
+        self.load_inputs()
+
+    def load_inputs(self):
+        ''' Copies the inputs from shared memory. '''
+        shm = self._shm
+        self.botmode = modes[int(shm[IN_MODE])].upper()
+        self.time_to_run = shm[IN_TIME]
+        self.axes0 = tuple(shm[IN_AXES0:IN_AXES0 + 6])
+        self.axes1 = tuple(shm[IN_AXES1:IN_AXES1 + 6])
+        self.buttons0 = [b != 0.0 for b in shm[IN_BUTTONS0:IN_BUTTONS0 + 12]]
+        self.buttons1 = [b != 0.0 for b in shm[IN_BUTTONS1:IN_BUTTONS1 + 12]]
+        self.pov0 = (int(shm[IN_POV0]), int(shm[IN_POV0 + 1]))
+        self.pov1 = (int(shm[IN_POV1]), int(shm[IN_POV1 + 1]))
+        self.input_age = shm[IN_AGE]
+
+    def set_report_callback(self, cb):
+        ''' Terminal reports are not available in sandbox mode. '''
+        pass
+
+def _child_main(module_name, shm, go, done, ready):
+    ''' Runs in the child process. Loads the user's module, and then
+    runs one tick each time the go event is set. '''
+    rttune.reset_thread()  # in case the base was tuned before this was started
+    parent = os.getppid()
+    user_module = __import__(module_name)
+    base = SandboxBase(shm)
+    user = user_module.WaterBot(base)
+    user.initialize()
+    ready.set()
+    while True:
+        if not go.wait(1.0):
+            if os.getppid() != parent: return  # The base has died.
+            continue
+        go.clear()
+        base.load_inputs()
+        try:
+            getattr(user, modes[int(shm[IN_MODE])])(int(shm[IN_LOOP]))
+        except Exception:
+            shm[OUT_ERROR] += 1
+            traceback.print_exc()
+        shm[OUT_SEQ] = shm[IN_SEQ]
+        done.set()
+
+class UserSandbox():
+    ''' Stands in for the user's WaterBot in the base, and runs the real one in
+    a child process.  The module_name is the name of the user's module. '''
+    def __init__(self, base, module_name, budget=default_budget):
+        self._base = base
+        self._module_name = module_name
+        self._budget = budget
+        self._ctx = multiprocessing.get_context("spawn")
+        self._shm = self._ctx.Array("d", SHM_SIZE, lock=False)
+        for i in range(16): self._shm[OUT_PCA + i] = math.nan
+        for i in range(3): self._shm[OUT_ARD_PWM + i] = math.nan
+        self._go = self._ctx.Event()
+        self._done = self._ctx.Event()
+        self._ready = self._ctx.Event()
+        self._process = None
+        self._seq = 0
+        self._busy_since = None   # time.monotonic() when the unfinished tick was started
+        self._errors_seen = 0
+        self._kills_seen = 0
+        self._ticks = 0
+        self._overruns = 0
+        self._skipped = 0
+        self._restarts = 0
+        self._late_ticks = 0      # ticks in a row the child was late
+        self._failsafe_count = 0
+
+    def _start(self):
+        ''' Starts the child process. '''
+        self._go.clear()
+        self._done.clear()
+        self._ready.clear()
+        self._busy_since = None
+        self._late_ticks = 0
+        self._process = self._ctx.Process(target=_child_main, name="user-sandbox",
+            args=(self._module_name, self._shm, self._go, self._done, self._ready))
+        self._process.daemon = True
+        self._process.start()
+
+    def initialize(self):
+        ''' Starts the child process, and waits for the user's initialize() to finish.
+        Raises an exception if it does not start. '''
+        self._start()
+        if not self._ready.wait(startup_timeout):
+            raise Exception("User code did not start in the sandbox.")
+
+    def stop(self, loop_count):
+        self._tick(0, loop_count)
+
+    def auto(self, loop_count):
+        self._tick(1, loop_count)
+
+    def teleop(self, loop_count):
+        self._tick(2, loop_count)
+
+    def _tick(self, mode, loop_count):
+        ''' Runs one tick of the user code in the child, within the budget. '''
+        self._ticks += 1
+        if self._busy_since is not None:
+            # Still working on an earlier tick.
+            if self._done.is_set():
+                self._done.clear()
+                self._busy_since = None
+            else:
+                self._skipped += 1
+                self._note_late()
+                if time.monotonic() - self._busy_since > hang_timeout: self._restart()
+                return
+        if not self._ready.is_set() or not self._process.is_alive():
+            self._skipped += 1
+            if not self._process.is_alive(): self._restart()
+            return
+        self._write_inputs(mode, loop_count)
+        self._done.clear()
+        self._go.set()
+        if not self._done.wait(self._budget):
+            self._overruns += 1
+            self._busy_since = time.monotonic()
+            self._note_late()
+            return
+        self._done.clear()
+        self._late_ticks = 0
+        self._apply_outputs()
+
+    def _note_late(self):
+        ''' Counts a tick where the child was late, and applies the failsafe
+        once it has been late for failsafe_ticks ticks in a row. '''
+        self._late_ticks += 1
+        if self._late_ticks == failsafe_ticks: self.apply_failsafe()
+
+    def _write_inputs(self, mode, loop_count):
+        ''' Copies the base's inputs to shared memory. '''
+        base, shm = self._base, self._shm
+        self._seq += 1
+        shm[IN_SEQ] = self._seq
+        shm[IN_MODE] = mode
+        shm[IN_LOOP] = loop_count
+        shm[IN_TIME] = base.time_to_run
+        shm[IN_AXES0:IN_AXES0 + 6] = base.axes0
+        shm[IN_AXES1:IN_AXES1 + 6] = base.axes1
+        for i in range(12):
+            shm[IN_BUTTONS0 + i] = base.buttons0[i]
+            shm[IN_BUTTONS1 + i] = base.buttons1[i]
+        shm[IN_POV0:IN_POV0 + 2] = base.pov0
+        shm[IN_POV1:IN_POV1 + 2] = base.pov1
+        shm[IN_AGE] = base.input_age
+        bits = 0
+        for pin in range(3, 9):
+            if base.inputs.get_value(pin): bits |= 1 << (pin - 3)
+        shm[IN_DIGITAL] = bits
+        shm[IN_BAT_M] = base.bat_m
+        shm[IN_BAT_L] = base.bat_l
+
+    def _apply_outputs(self):
+        ''' Sends the child's actuator commands to the hardware.  Raises an
+        exception if the user code raised one during the tick. '''
+        base, shm = self._base, self._shm
+        if shm[OUT_KILL] != self._kills_seen:
+            self._kills_seen = shm[OUT_KILL]
+            base.pca.killall()
+        pulsewidths = {}
+        for chan in range(16):
+            v = shm[OUT_PCA + chan]
+            if not math.isnan(v): pulsewidths[chan] = int(v)
+        if pulsewidths: base.pca.set_pwm_many(pulsewidths)
+        for i, chan in enumerate(reg.pwm_chans):
+            v = shm[OUT_ARD_PWM + i]
+            if not math.isnan(v): base.arduino.set_pwm(chan, v)
+        if shm[OUT_ERROR] != self._errors_seen:
+            self._errors_seen = shm[OUT_ERROR]
+            raise Exception("User code raised an exception in the sandbox.")
+
+    def apply_failsafe(self):
+        ''' Turns off all the actuators. '''
+        self._failsafe_count += 1
+        self._base.pca.killall()
+        self._base.arduino.set_pwm("ALL", 0.0)
+
+    def _restart(self):
+        ''' Kills the child process, and starts a new one.  The new one is
+        not given ticks until the user's initialize() is done. '''
+        print("**** Restarting the user code sandbox.")
+        self._restarts += 1
+        self.apply_failsafe()
+        if self._process is not None and self._process.is_alive():
+            self._process.terminate()
+            self._process.join(0.1)
+        self._start()
+
+    def close(self):
+        ''' Stops the child process. '''
+        if self._process is not None and self._process.is_alive():
+            self._process.terminate()
+
+    def get_counts(self):
+        ''' Returns a dict of counts: {ticks:, overruns:, skipped:, restarts:,
+        failsafes:}, where overruns is the number of ticks where the user code
+        took longer than the budget, skipped the number of ticks not run because
+        the user code was still busy or starting, restarts the number of times
+        the child was restarted, and failsafes the number of times the actuators
+        were turned off (after failsafe_ticks late ticks in a row, or a restart). '''
+        return {"ticks": self._ticks, "overruns": self._overruns, "skipped": self._skipped,
+            "restarts": self._restarts, "failsafes": self._failsafe_count}
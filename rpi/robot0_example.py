@@ -31,7 +31,7 @@ class WaterBot():
         self.right_motor = hydromotor.HydroMotor(self.base.pca, 5)
         self.hydrodrive = hydromotor.HydroDrive(self.left_motor, self.right_motor)
         self.elecmag = electromagnet.ElectroMagnet(self.base.arduino, 10)
-        self.switch = limitswitch.LimitSwitch(self.base.arduino, 3)
+        self.switch = limitswitch.LimitSwitch(self.base.inputs, 3)
         self.hydrodrive.shutdown()
         self.elecmag.turn_off()
 
@@ -9,11 +9,25 @@
 #
 
 import os
+import sys
+import json
 import traceback
+import importlib
 import mqttrobot
 import pca9685 as pca
 import arduino_wb
 import busmonitor 
+import i2cbus
+import inputservice
+import looptimer
+import tasktable
+import termreporter
+import telemetry
+import perfstats
+import usersandbox
+import rttune
+import gcmanager
+import clocksync
 import hydromotor
 import utils
 import time
@@ -21,6 +35,80 @@ import time
 version = "v1"  # A version indicator for the driver station
 dstimeout = 3.0  # number of seconds before kill due to no msg received from driver station
 
+# How the health of the I2C bus and arduino is checked while the hardware is okay.
+# In "active" mode, a write/readback probe is done on every loop.  In "passive" mode,
+# health is judged from the bus errors seen by the bus monitor, and from the arduino's
+# clock advancing between reads.  The probe is then only done once per
+# health_probe_period, or right away if the passive signs look suspicious.
+health_mode = "passive"
+health_probe_period = 1.0  # seconds between active probes in passive mode
+
+# The main loop runs at a fixed rate.  If a pass takes too long, the loop policy
+# decides what happens to the missed ticks: "skip" drops them, and "catchup" runs
+# them back to back.  See looptimer.py.
+loop_rate = 100.0  # Hz
+loop_policy = "skip"
+
+# If event_driven is True, new joystick data wakes the main loop right away, and
+# the control tasks run on an extra tick, without waiting for the next regular
+# tick.  The regular ticks still run at loop_rate.
+event_driven = False
+
+# Periods, in seconds, of the tasks that do not run on every tick.
+report_to_ds_period = 1.0
+report_to_term_period = 3.0
+report_perf_period = 1.0
+
+# If user_sandbox is True, the user's WaterBot runs in its own process, and
+# may take at most user_budget seconds per tick.  If it takes longer, all the
+# actuators are turned off until it catches up.  See usersandbox.py.
+user_sandbox = False
+user_budget = 0.005
+
+# Real-time tuning, done after initialization when runbot is started with the
+# "rt" argument (python3 runbot.py rt).  Set a step to None or False to skip it.
+# The priority and memory locking steps need root.  Only the main loop thread
+# gets the priority and the pinning; the threads started before it keep the
+# normal scheduler.  See rttune.py.
+rt_priority = 50     # SCHED_FIFO priority, 1-99
+rt_cpu = 3           # core to pin to
+rt_lock_memory = True
+rt_freeze_gc = True
+
+# If managed_gc is True, automatic garbage collection is turned off during
+# AUTO and TELEOP, and the young objects are collected in the idle time at the
+# end of each tick instead, so the collector does not stall a tick at random.
+# See gcmanager.py.
+managed_gc = False
+
+# The user code can be reloaded without restarting runbot, while in STOP.  The
+# driver station asks for a reload with its "Reload Code" button.  If
+# reload_on_change is True, the user's robot_*.py file is also checked every
+# reload_check_period seconds, and reloaded when it changes.
+reload_on_change = False
+reload_check_period = 1.0
+
+# Each control frame carries the driver station's clock when it was sent, and
+# the offset between that clock and ours is estimated from them (see
+# clocksync.py), so the age of the joystick inputs is known.  Once the newest
+# input is older than stale_input_age seconds, the stale_policy is applied
+# until a fresh frame arrives:
+#   "hold"  -- keep using the last inputs, until the mode times out.  This is
+#              the default, and is how the robot always behaved.
+#   "decay" -- ramp the axes down to zero over stale_decay_time seconds, and
+#              release the buttons and the povs right away.
+#   "stop"  -- assert STOP.
+# The driver station sends a frame about every 50 ms, but Wi-Fi hiccups can
+# hold frames up for longer than stale_input_age.  With "decay" or "stop",
+# raise stale_input_age if the robot stutters on a good link.  The policy is
+# only applied while the driver station sends control frames, since the
+# separate joystick topics are only sent when a value changes.  The user code
+# can read the age of the newest input from base.input_age.
+stale_input_age = 0.15
+stale_policy = "hold"
+stale_decay_time = 0.1
+ds_clock_window = 200  # control frames kept for the clock offset estimate
+
 #  Attempt to load in the user code here.  The first module found with robot_*.py will
 # be used.
 
@@ -63,38 +151,104 @@ class WaterBotBase():
       self.msg_err_count = 0 # number of decoding errors on input messages
       self.recovered_count = 0 # number of times hardware recovered after bus error
       self.time_of_hw_fail_check = 0 # used to remember when restarts were tried.
+      self.time_of_health_probe = 0 # used to remember when the last active probe was done.
+      self.health_probe_count = 0 # number of active health probes done
+      self.health_err_count = 0 # bus error count at the last health check
+      self.health_timestamp = None # arduino timestamp at the last health check
       self.report_callback = None
+      self.loop_timer = looptimer.LoopTimer(loop_rate, loop_policy)
+      self.gc_manager = gcmanager.GcManager()
+      self.term_reporter = termreporter.TermReporter(self.print_status_report)
+      self.bat_m = 0.0  # battery voltages, as last sent to the driver station
+      self.bat_l = 0.0
+      self.tasks = tasktable.TaskTable(loop_rate)
+      self.tasks.add_task("check_i2cbus", self.check_i2cbus, priority=0)
+      self.tasks.add_task("update_inputs", self.update_inputs, priority=1)
+      self.tasks.add_task("control_inputs", self.get_control_inputs, priority=2, on_event=True)
+      self.tasks.add_task("control_bot", self.control_bot, priority=3, on_event=True)
+      self.tasks.add_task("flush_outputs", self.flush_outputs, priority=4, on_event=True)
+      self.tasks.add_task("report_to_ds", self.report_status_to_ds, report_to_ds_period, priority=20)
+      self.tasks.add_task("report_to_term", self.report_status_to_term, report_to_term_period, priority=21)
+      self.tasks.add_task("report_perf", self.report_perf_to_ds, report_perf_period, priority=22)
+      self.tasks.add_task("reload_user", self.check_user_reload, reload_check_period, priority=23)
+      self.user_task_names = []     # tasks added by the user code, removed on reload
+      self.reload_requested = False # set by the driver station's ReloadUser command
+      self.reload_count = 0
+      self.reload_time = 0.0        # seconds the last reload took
+      self.user_mtime = self.get_user_mtime()
+      self.user_times = perfstats.RollingStats()  # run time of the user's stop/auto/teleop calls
       self.last_mode_cmd_time = time.monotonic() - 100.0
       self.mqtt.register_topic("wbot/mode", self.on_mode)
-      self.mqtt.register_topic("wbot/joystick0/buttons")
-      self.mqtt.register_topic("wbot/joystick0/axes")
-      self.mqtt.register_topic("wbot/joystick0/pov")
-      self.mqtt.register_topic("wbot/joystick1/buttons")
-      self.mqtt.register_topic("wbot/joystick1/axes")
-      self.mqtt.register_topic("wbot/joystick1/pov")
+      self.control_topics = ("wbot/joystick0/buttons", "wbot/joystick0/axes", "wbot/joystick0/pov",
+        "wbot/joystick1/buttons", "wbot/joystick1/axes", "wbot/joystick1/pov")
+      control_decoders = (mqttrobot.decode_buttons, mqttrobot.decode_axes, mqttrobot.decode_pov) * 2
+      for topic, decoder in zip(self.control_topics, control_decoders):
+        self.mqtt.register_topic(topic, wake=event_driven, decoder=decoder)
+      self.control_versions = [0 for _ in self.control_topics]  # topic versions last used
+      # The driver station can also send everything in one frame per tick, on wbot/control.
+      self.control_frame_version = 0
+      self.control_session = None
+      self.control_seq = 0
+      self.frame_count = 0        # control frames used
+      self.frame_dropped = 0      # frames lost, or replaced by a newer one before they were read
+      self.frame_out_of_order = 0 # frames older than one already used, which are ignored
+      self.frame_resyncs = 0      # times the driver station started a new session
+      self.ds_clock = clocksync.ClockSync(scale=1.0, window=ds_clock_window)  # maps the ds clock to ours
+      self.mqtt.register_topic("wbot/control", self.on_control, wake=event_driven,
+        decoder=mqttrobot.decode_control_frame)
+      self.input_rx_time = 0       # time.monotonic() the newest control input was received
+      self.input_flushed_time = 0  # input_rx_time of the newest input that has been flushed
+      self.input_latency_count = 0
+      self.input_latency_sum = 0.0
+      self.input_latency_max = 0.0
+      self.input_sent_times = [0.0 for _ in self.control_topics]  # when each input was sent, on our clock
+      self.input_sent_time = 0.0  # when the newest input was sent, on our clock
+      self.input_age = 0.0        # age of the newest input, as of the last tick
+      self.input_age_sum = 0.0    # age of each control frame when it was used
+      self.input_age_max = 0.0
+      self.input_stale = False
+      self.stale_count = 0        # times the inputs went stale
       self.mqtt.register_topic("wbot/pingbot", self.on_ping)
+      self.mqtt.register_publish("wbot/pingds", mqttrobot.profile_command)
+      for topic in ("wbot/status", "wbot/arduino", "wbot/bus", "wbot/perf"):
+        self.mqtt.register_publish(topic, mqttrobot.profile_telemetry)
       self.hw_okay = True
       self.bus_monitor = busmonitor.BusMonitor()
-      self.pca = pca.PCA9685(bus_monitor=self.bus_monitor)
-      self.arduino = arduino_wb.Arduino_wb(bus_monitor=self.bus_monitor) 
+      self.i2c = i2cbus.I2CBus()
+      self.pca = pca.PCA9685(bus_monitor=self.bus_monitor, staging=True, bus=self.i2c)
+      self.arduino = arduino_wb.Arduino_wb(bus_monitor=self.bus_monitor, use_shadow=True, bus=self.i2c)
+      self.inputs = inputservice.InputService(self.arduino)
+      self.telemetry = telemetry.Telemetry(self.arduino)
+      self.telemetry_frame_sent = 0  # frame count of the last snapshot sent to the driver station
+      # The steps are spread out so that one snapshot takes a little less than a
+      # report period: the bus is not read any faster than the reports need.
+      telemetry_period = report_to_ds_period / (self.telemetry.get_counts()["chunks"] + 1)
+      self.tasks.add_task("telemetry", self.collect_telemetry, telemetry_period, priority=15)
       self.pca.killall()
       self.arduino.set_pwm("ALL", 0.0)
       if not self.arduino.test_health() or not self.pca.is_initialized():
         self.hw_okay = False
-      self.last_report_time_to_ds = time.monotonic() - 5.0
-      self.last_report_time_to_term = time.monotonic() - 5.0
       self.axes0 = (0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
       self.pov0 = (0,0)
       self.buttons0 = list((False for _ in range(12)))
       self.axes1 = (0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
       self.pov1 = (0,0)
       self.buttons1 = list((False for _ in range(12)))
+      self.held_axes = [self.axes0, self.axes1]  # axes of the last frame, for the decay policy
       self.user_class = None
       self.user = None
+      self.create_user()
+    
+  def create_user(self):
+      ''' Creates the user's WaterBot object from the user module, and calls its
+      initialize().  On failure, user_code_error is set. '''
       if self.user_module is not None:
         try:
           self.user_class = getattr(self.user_module, "WaterBot")
-          self.user = self.user_class(self)
+          if user_sandbox:
+            self.user = usersandbox.UserSandbox(self, self.user_module.__name__, user_budget)
+          else:
+            self.user = self.user_class(self)
         except Exception:
           print("*** Unable to create user WaterBot object.")
           self.user_code_error = True
@@ -108,7 +262,7 @@ class WaterBotBase():
           print("Exception = ", e)
           traceback.print_exc()
       self.user_code_error = self.user is None
-    
+
   # -------------------------------------------------------------------
   # Callback Functions
 
@@ -120,48 +274,82 @@ class WaterBotBase():
       ''' Called when a mode command/status msg is received. '''
       words = data.split()
       if len(words) < 3:
-        self.time_to_run = 0.0
-        self.msg_err_count += 1
-        self.botmode = "STOP"
-        self.mode_switch = True
+        self.mode_error()
         return 
-      if len(words) >= 4:
-        if words[3].lower() == "RestartArduino".lower():
-          print("******* Restarting Arduino")
-          self.arduino.reset_hardware()  
+      if len(words) >= 4: self.do_aux_command(words[3])
       try:
-        self.ds_loop_count = int(words[1])
-        self.time_to_run = float(words[2])
+        ds_loop_count = int(words[1])
+        time_to_run = float(words[2])
       except ValueError:
-          self.time_to_run = 0.0
-          self.msg_err_count += 1
-          self.botmode = "STOP"
-          self.mode_switch = True
-          return       
-      newmode = words[0]
+        self.mode_error()
+        return       
+      self.set_mode(words[0], ds_loop_count, time_to_run)
+
+  def on_control(self, topic, frame):
+      ''' Called when a combined control frame is received, with the decoded
+      frame.  Only the aux command is handled here, so that it is never lost if
+      a newer frame arrives before the main loop reads this one.  The rest of
+      the frame is used by get_control_inputs(). '''
+      if frame.aux != "NoOp": self.do_aux_command(frame.aux)
+
+  def set_mode(self, newmode, ds_loop_count, time_to_run):
+      ''' Applies a mode command from the driver station.  If the mode is not
+      known, STOP is asserted. '''
+      self.ds_loop_count = ds_loop_count
       if newmode == "STOP" or newmode == "TELEOP" or newmode == "AUTO":
+          self.time_to_run = time_to_run
           self.last_mode_cmd_time = time.monotonic()
           if newmode != self.botmode: self.mode_switch = True
           self.botmode = newmode 
           return 
-      else:
-          self.time_to_run = 0.0
-          self.msg_err_count += 1
-          self.botmode = "STOP"
-          self.mode_switch = True
+      self.mode_error()
+
+  def mode_error(self):
+      ''' Asserts STOP after a bad mode command. '''
+      self.time_to_run = 0.0
+      self.msg_err_count += 1
+      self.botmode = "STOP"
+      self.mode_switch = True
+
+  def do_aux_command(self, auxcmd):
+      ''' Carries out an aux command from the driver station. '''
+      if auxcmd.lower() == "RestartArduino".lower():
+        print("******* Restarting Arduino")
+        self.arduino.reset_hardware()  
+      if auxcmd.lower() == "ReloadUser".lower():
+        self.reload_requested = True
 
   # -------------------------------------------------------------------
   # Main Run Loop 
 
   def run(self):
     ''' Main loop for water bot '''
+    wake_event = None
+    if event_driven: wake_event = self.mqtt.get_wake_event()
+    event = False
     while True:
-      self.check_i2cbus() 
-      self.get_control_inputs()
-      self.report_status_to_term()
-      self.report_status_to_ds()
-      self.control_bot()
-      time.sleep(0.01)
+      self.arduino.begin_tick()
+      self.tasks.run_tick(event)
+      if managed_gc:
+        self.gc_manager.set_match(self.botmode != "STOP")
+        self.gc_manager.collect_in_slack(self.loop_timer.get_slack())
+      event = not self.loop_timer.wait(wake_event)
+
+  def add_user_task(self, name, func, period=None, priority=10):
+    ''' Adds a task for user code to the main loop.  The func is called with no
+    arguments, once every period seconds (every tick if None).  User tasks run
+    after the control tasks with a lower priority number.  If the task raises an
+    exception, it is reported once, and the user code is marked as failed.'''
+    def run_user_task():
+      try:
+        func()
+      except Exception:
+        if not self.user_code_error:
+          print("**** User task %s Failed." % name)
+          traceback.print_exc()
+        self.user_code_error = True
+    self.tasks.add_task(name, run_user_task, period, priority=priority)
+    self.user_task_names.append(name)
 
   # -------------------------------------------------------------------
   # Major Task Functions that Main Loop calls apon.
@@ -175,6 +363,10 @@ class WaterBotBase():
         ## If this proves to be a problem then we will try to figure out a way to restart the hardware.
         return
     if self.hw_okay:
+      if health_mode == "passive" and not self.health_looks_suspicious():
+        if timenow - self.time_of_health_probe < health_probe_period: return
+      self.time_of_health_probe = timenow
+      self.health_probe_count += 1
       if not self.arduino.test_health():
         print("Arduino health fail!!!")
         self.hw_okay = False
@@ -192,88 +384,376 @@ class WaterBotBase():
         self.bus_monitor.reset() 
         self.recovered_count += 1
 
+  def get_user_mtime(self):
+    ''' Returns the modification time of the user module's file, or None. '''
+    try:
+      return os.stat(self.user_module.__file__).st_mtime
+    except Exception:
+      return None
+
+  def check_user_reload(self):
+    ''' Reloads the user code if the driver station asked for it, or if the
+    file has changed and reload_on_change is set.  Only done in STOP; a
+    changed file is reloaded when the robot next goes to STOP. '''
+    if reload_on_change and self.user_module is not None and self.get_user_mtime() != self.user_mtime:
+      self.reload_requested = True
+    if not self.reload_requested or self.botmode != "STOP": return
+    self.reload_requested = False
+    self.reload_user()
+
+  def reload_user(self):
+    ''' Replaces the user's WaterBot with a new one made from a fresh import of
+    the user module.  The hardware and MQTT objects are kept.  If the new code
+    will not import, the old WaterBot is kept running. '''
+    t0 = time.monotonic()
+    print("******* Reloading user code")
+    if self.user_module is None:
+      module = get_user_module()
+    else:
+      try:
+        module = importlib.reload(self.user_module)
+      except Exception:
+        print("**** Reload of %s failed.  Keeping the old code." % self.user_module.__name__)
+        traceback.print_exc()
+        module = None
+    if self.user_module is not None: self.user_mtime = self.get_user_mtime()
+    if module is None: return
+    self.pca.killall()
+    for name in self.user_task_names: self.tasks.remove_task(name)
+    self.user_task_names = []
+    if self.user is not None and hasattr(self.user, "close"):
+      try:
+        self.user.close()
+      except Exception:
+        traceback.print_exc()
+    self.user_module = module
+    self.user_mtime = self.get_user_mtime()
+    self.user_class = None
+    self.user = None
+    self.create_user()
+    self.mode_switch = True
+    self.reload_count += 1
+    self.reload_time = time.monotonic() - t0
+    print("******* User code reloaded in %.1f ms" % (self.reload_time * 1000.0))
+
+  def update_inputs(self):
+    ''' Services the arduino's digital inputs. '''
+    if self.hw_okay: self.inputs.update()
+
+  def collect_telemetry(self):
+    ''' Reads a few more of the arduino's registers for the driver station. '''
+    if self.hw_okay: self.telemetry.step()
+    else: self.telemetry.restart()
+
+  def flush_outputs(self):
+    ''' Sends the staged PWM outputs to the PCA9685, and measures the time from
+    when the newest control input was sent to now.  For control frames, the
+    send time is the driver station's, mapped onto our clock; for the other
+    control topics, it is when the input was received. '''
+    if self.hw_okay: self.pca.flush()
+    if self.input_rx_time > self.input_flushed_time:
+      latency = time.monotonic() - self.input_sent_time
+      self.input_flushed_time = self.input_rx_time
+      self.input_latency_count += 1
+      self.input_latency_sum += latency
+      if latency > self.input_latency_max: self.input_latency_max = latency
+
+  def health_looks_suspicious(self):
+    ''' Judges the health of the bus from signals that are already available,
+    without using the bus.  Returns True if there have been bus errors since
+    the last check, or if the arduino's clock has not advanced (or has gone
+    backwards) between two reads.'''
+    suspicious = False
+    errs = self.bus_monitor.get_total_error_count()
+    if errs != self.health_err_count:
+      self.health_err_count = errs
+      suspicious = True
+    stamp = self.arduino.get_last_timestamp()
+    if stamp is not None and stamp != self.health_timestamp:
+      if self.health_timestamp is not None:
+        tt, tobs = stamp
+        tt0, tobs0 = self.health_timestamp
+        if tt <= tt0 and tobs - tobs0 > 0.005: suspicious = True
+      self.health_timestamp = stamp
+    return suspicious
+
   def get_control_inputs(self):
-      ''' Gather all inputs '''
-      okay, btns = self.mqtt.get_12_bools("wbot/joystick0/buttons")
-      if okay: self.buttons0 = list(btns)
-      okay, btns = self.mqtt.get_12_bools("wbot/joystick1/buttons")
-      if okay: self.buttons1 = list(btns)
-      okay, axes = self.mqtt.get_6_floats("wbot/joystick0/axes")
-      if okay: self.axes0 = axes
-      okay, axes = self.mqtt.get_6_floats("wbot/joystick1/axes")
-      if okay: self.axes1 = axes
-      okay, pov = self.mqtt.get_2_ints("wbot/joystick0/pov")
-      if okay: self.pov0 = pov
-      okay, pov = self.mqtt.get_2_ints("wbot/joystick1/pov")
-      if okay: self.pov1 = pov
+      ''' Gather all inputs.  The control topics are decoded by MqttRobot when
+      they arrive, so here only the versions are checked, and the new values
+      are taken.  Nothing is parsed, and on most ticks nothing is allocated.
+      The button lists are filled in place, and are always the same list objects. '''
+      for i in range(len(self.control_topics)):
+        topic = self.control_topics[i]
+        if not self.mqtt.changed_since(topic, self.control_versions[i]): continue
+        self.control_versions[i] = self.mqtt.get_version(topic)
+        tme = self.mqtt.get_timestamp(topic)
+        if tme > self.input_rx_time: self.input_rx_time = tme
+        self.input_sent_times[i] = tme  # these topics are not stamped, so the arrival time is used
+        if tme > self.input_sent_time: self.input_sent_time = tme
+        self.use_control_input(i, self.mqtt.get_value(topic))
+      if self.mqtt.changed_since("wbot/control", self.control_frame_version):
+        self.control_frame_version = self.mqtt.get_version("wbot/control")
+        tme = self.mqtt.get_timestamp("wbot/control")
+        if self.use_control_frame(self.mqtt.get_value("wbot/control"), tme) and tme > self.input_rx_time:
+          self.input_rx_time = tme
+      self.check_input_age()
+
+  def use_control_frame(self, f, tme):
+      ''' If the control frame is newer than the last one used, takes the mode
+      and both joysticks from it, all at once.  tme is when the frame arrived.
+      Returns True if the frame was used. '''
+      if f.session != self.control_session:
+        if self.control_session is not None: self.frame_resyncs += 1
+        self.control_session = f.session
+        self.ds_clock.reset()
+      elif f.seq <= self.control_seq:
+        self.frame_out_of_order += 1
+        return False
+      else:
+        self.frame_dropped += f.seq - self.control_seq - 1
+      self.control_seq = f.seq
+      self.frame_count += 1
+      self.ds_clock.add_one_way(f.t_sent, tme)
+      t_sent = self.ds_clock.to_local(f.t_sent)
+      for i in range(len(self.input_sent_times)):
+        self.input_sent_times[i] = t_sent
+      self.input_sent_time = t_sent
+      age = tme - t_sent
+      self.input_age_sum += age
+      if age > self.input_age_max: self.input_age_max = age
+      self.set_mode(f.mode, f.ds_loop, f.time_to_go)
+      self.axes0, self.axes1 = f.axes[0], f.axes[1]
+      self.held_axes[0], self.held_axes[1] = self.axes0, self.axes1
+      self.buttons0[:] = f.buttons[0]
+      self.buttons1[:] = f.buttons[1]
+      self.pov0, self.pov1 = f.povs[0], f.povs[1]
+      return True
+
+  def check_input_age(self):
+      ''' Updates the age of the newest input, and applies the stale_policy
+      while it is older than stale_input_age.  Only done once control frames
+      have been received. '''
+      self.input_age = time.monotonic() - self.input_sent_time
+      if self.control_session is None: return
+      if self.input_age <= stale_input_age:
+        self.input_stale = False
+        return
+      if not self.input_stale:
+        self.input_stale = True
+        self.stale_count += 1
+      # Applied on every stale tick, since a late frame can still be used.
+      if stale_policy == "stop" and self.botmode != "STOP":
+        self.botmode = "STOP"
+        self.time_to_run = 0.0
+        self.mode_switch = True
+      elif stale_policy == "decay":
+        for i in range(12):
+          self.buttons0[i] = self.buttons1[i] = False
+        self.pov0 = self.pov1 = (0, 0)
+        scale = 0.0
+        if stale_decay_time > 0.0: scale = 1.0 - (self.input_age - stale_input_age) / stale_decay_time
+        self.axes0 = self.scaled_axes(self.held_axes[0], scale)
+        self.axes1 = self.scaled_axes(self.held_axes[1], scale)
+
+  def scaled_axes(self, axes, scale):
+      ''' Returns the axes times scale.  A scale of zero or less gives zero_axes. '''
+      if scale <= 0.0: return mqttrobot.zero_axes
+      x, y, z, r, u, v = axes
+      return (x * scale, y * scale, z * scale, r * scale, u * scale, v * scale)
+
+  def get_input_age(self, i=None):
+      ''' Returns the age in seconds of the control input at index i of
+      control_topics, or of the newest input if i is None.  For control frames,
+      the age is measured from when the driver station sent the frame (less
+      the shortest delay seen), and otherwise from when the input arrived. '''
+      if i is None: return time.monotonic() - self.input_sent_time
+      return time.monotonic() - self.input_sent_times[i]
+
+  def use_control_input(self, i, value):
+      ''' Takes the decoded value of the control topic at index i of control_topics. '''
+      if i == 0: self.buttons0[:] = value
+      elif i == 3: self.buttons1[:] = value
+      elif i == 1: self.axes0 = value
+      elif i == 4: self.axes1 = value
+      elif i == 2: self.pov0 = value
+      elif i == 5: self.pov1 = value
 
   def report_status_to_term(self):
-      ''' Reports the current status to the terminal once every 3 seconds. '''
-      timenow = time.monotonic()
-      if timenow - self.last_report_time_to_term < 3.000: return
-      self.last_report_time_to_term = timenow
+      ''' Takes a snapshot of the current status, and hands it to the terminal
+      reporter, which prints it on its own thread.  No bus reads are done here;
+      the battery voltages are the ones last sent to the driver station.  The
+      user's report callback is called here, on the main loop. '''
+      snap = {"botmode": self.botmode, "time": time.monotonic(), "time_to_run": self.time_to_run,
+        "hw_okay": self.hw_okay, "i2c_errs": self.bus_monitor.get_total_error_count(),
+        "restarts": self.recovered_count, "health_probes": self.health_probe_count,
+        "bat_m": self.bat_m, "bat_l": self.bat_l, "mqtt_connected": self.mqtt.is_connected(),
+        "mqtt": self.mqtt.get_counts(), "clock": self.arduino.get_clock_stats(),
+        "cache": self.arduino.get_cache_stats(), "inputs": self.inputs.get_counts(),
+        "writes": self.arduino.get_write_stats(), "staging": self.pca.get_staging_stats(),
+        "i2c_util": self.i2c.get_utilization(), "i2c_rates": self.bus_monitor.get_rates(),
+        "i2c_hist": self.bus_monitor.get_latency_histogram(), "i2c_stats": self.i2c.get_stats(),
+        "loop": self.loop_timer.get_stats(), "jitter_hist": self.loop_timer.get_jitter_histogram(),
+        "latency": (self.input_latency_count, self.input_latency_sum, self.input_latency_max),
+        "tasks": self.tasks.get_stats(), "perf": self.get_perf_phases(), "axes0": self.axes0, "axes1": self.axes1,
+        "buttons0": tuple(self.buttons0), "buttons1": tuple(self.buttons1),
+        "pov0": self.pov0, "pov1": self.pov1, "user_loaded": self.user is not None,
+        "msg_errs": self.msg_err_count, "msg_timeouts": self.msg_timeout_count,
+        "reporter": self.term_reporter.get_counts(),
+        "telemetry": self.telemetry.get_counts(), "sandbox": None, "gc": None,
+        "reloads": (self.reload_count, self.reload_time),
+        "frames": (self.frame_count, self.frame_dropped, self.frame_out_of_order, self.frame_resyncs),
+        "input_age": (self.input_age, self.input_age_sum, self.input_age_max, self.input_stale, self.stale_count),
+        "ds_clock": (self.ds_clock.is_valid(), self.ds_clock.get_offset())}
+      if user_sandbox and self.user: snap["sandbox"] = self.user.get_counts()
+      if managed_gc: snap["gc"] = self.gc_manager.get_counts()
+      self.term_reporter.submit(snap)
+      if self.report_callback: self.report_callback()
+
+  def print_status_report(self, snap):
+      ''' Prints a status snapshot to the terminal.  Called on the terminal
+      reporter's thread, so it is okay if printing blocks. '''
       print("")
-      print("Robot Mode: %s" % self.botmode)
-      print("Robot Time: %12.3f   Time_to_go: %6.1f" % (time.monotonic(), self.time_to_run))
-      bat_m = bat_l = 0.0
-      if self.hw_okay:
-        _, bat_m = self.arduino.get_battery_voltage(battype="M")
-        _, bat_l = self.arduino.get_battery_voltage(battype="L")
-      print("Hardware okay: %s   i2c errors = %d  restarts = %d" % (self.hw_okay, 
-        self.bus_monitor.get_total_error_count(), self.recovered_count))
-      print("Main Battery: %6.1f volts,  Logic Battery: %6.1f" % (bat_m, bat_l) )
-      print("Connected to MQTT: %s" % self.mqtt.is_connected())
-      mqttcounts = self.mqtt.get_counts()
+      print("Robot Mode: %s" % snap["botmode"])
+      print("Robot Time: %12.3f   Time_to_go: %6.1f" % (snap["time"], snap["time_to_run"]))
+      print("Hardware okay: %s   i2c errors = %d  restarts = %d  health probes = %d" % (snap["hw_okay"], 
+        snap["i2c_errs"], snap["restarts"], snap["health_probes"]))
+      print("Main Battery: %6.1f volts,  Logic Battery: %6.1f" % (snap["bat_m"], snap["bat_l"]) )
+      print("Connected to MQTT: %s" % snap["mqtt_connected"])
+      mqttcounts = snap["mqtt"]
       print("MQTT messages received: %d " % mqttcounts["rx"])
-      print("MQTT errors: %d" % mqttcounts["err"])
-      print("Axes 0: %6.3f, %6.3f, %6.3f, %6.3f, %6.3f, %6.3f" % self.axes0)
-      print("Axes 1: %6.3f, %6.3f, %6.3f, %6.3f, %6.3f, %6.3f" % self.axes1)
+      print("MQTT errors: %d  undecodable messages: %d" % (mqttcounts["err"], mqttcounts["dec"]))
+      clk = snap["clock"]
+      if clk["valid"]:
+        print("Arduino clock: offset = %.4f s  drift = %.1f ppm  bus rtt = %.2f ms (min %.2f)" % 
+          (clk["offset"], clk["drift_ppm"], clk["rtt_avg"] * 1000.0, clk["rtt_min"] * 1000.0))
+      cache = snap["cache"]
+      print("Arduino register cache: hits = %d  misses = %d" % (cache["hits"], cache["misses"]))
+      inpcounts = snap["inputs"]
+      print("Digital inputs: ticks = %d  SI uses = %d" % (inpcounts["updates"], inpcounts["si_uses"]))
+      tele = snap["telemetry"]
+      print("Telemetry: snapshots = %d  steps per snapshot = %d  read errors = %d" % 
+        (tele["frames"], tele["chunks"], tele["errors"]))
+      writes = snap["writes"]
+      print("Arduino writes: sent = %d  skipped = %d" % (writes["sent"], writes["skipped"]))
+      staging = snap["staging"]
+      print("PCA channel writes: written = %d  avoided = %d" % (staging["written"], staging["avoided"]))
+      print("I2C bus utilization: %5.1f%%" % (snap["i2c_util"] * 100.0))
+      tps, err_rate = snap["i2c_rates"]
+      print("I2C rates: %6.1f xfers/sec  error rate = %5.2f%%" % (tps, err_rate * 100.0))
       s = ""
-      for b in self.buttons0: 
+      for edge, n in snap["i2c_hist"]:
+        if edge is None: s += " >:%d" % n
+        else: s += " %g:%d" % (edge * 1000.0, n)
+      print("I2C latency (ms:count):%s" % s)
+      for device, st in snap["i2c_stats"].items():
+        print("  %-8s xfers = %d  queue = %d (max %d)  wait = %5.2f ms (max %5.2f)  missed = %d" % 
+          (device, st["count"], st["depth"], st["max_depth"], st["avg_wait"] * 1000.0, 
+          st["max_wait"] * 1000.0, st["missed"]))
+      loop = snap["loop"]
+      print("Main loop: %5.1f Hz (%s)  ticks = %d  overruns = %d  skipped = %d  late = %5.2f ms (max %5.2f)" % 
+        (loop["rate"], loop["policy"], loop["ticks"], loop["overruns"], loop["skipped"],
+        loop["avg_late"] * 1000.0, loop["max_late"] * 1000.0))
+      count, total, latency_max = snap["latency"]
+      avg = 0.0
+      if count > 0: avg = total / count
+      s_mode = "polled"
+      if event_driven: s_mode = "event driven"
+      print("Input to output latency, from send (%s): %5.2f ms (max %5.2f)  inputs = %d  wakes = %d" % 
+        (s_mode, avg * 1000.0, latency_max * 1000.0, count, loop["wakes"]))
+      s = ""
+      for edge, n in snap["jitter_hist"]:
+        if edge is None: s += " >:%d" % n
+        else: s += " %g:%d" % (edge * 1000.0, n)
+      print("Loop jitter (ms:count):%s" % s)
+      print("Task                   Period  Phase  Runs      Avg ms   Max ms  Errors")
+      for t in snap["tasks"]:
+        print("  %-20s %6d %6d %6d   %7.3f  %7.3f  %6d" % (t["name"], t["period"], t["phase"],
+          t["runs"], t["avg"] * 1000.0, t["max"] * 1000.0, t["errors"]))
+      print("Phase                  p50 ms   p99 ms   Max ms  (recent)")
+      for name, (p50, p99, pmax) in snap["perf"]:
+        print("  %-20s %7.3f  %7.3f  %7.3f" % (name, p50 * 1000.0, p99 * 1000.0, pmax * 1000.0))
+      print("Axes 0: %6.3f, %6.3f, %6.3f, %6.3f, %6.3f, %6.3f" % snap["axes0"])
+      print("Axes 1: %6.3f, %6.3f, %6.3f, %6.3f, %6.3f, %6.3f" % snap["axes1"])
+      s = ""
+      for b in snap["buttons0"]: 
         if b: s += "T "
         else: s += "F "
       print("Buttons0: %s" % s)
       s = ""
-      for b in self.buttons1: 
+      for b in snap["buttons1"]: 
         if b: s += "T "
         else: s += "F "
       print("Buttons1: %s" % s)
-      x0, y0 = self.pov0
-      x1, y1 = self.pov1
+      x0, y0 = snap["pov0"]
+      x1, y1 = snap["pov1"]
       print("POV0 = (%d, %d)   POV1 = (%d %d)" % (x0, y0, x1, y1))
-      if self.user:
+      if snap["user_loaded"]:
         print("User WaterBot class loaded from %s." % self.user_module.__name__)
       else:
         print("***  User Module Not Loaded!!")
-      print("msgerr = %d, msgtmeouts = %d" % (self.msg_err_count, self.msg_timeout_count))
-      if self.report_callback: self.report_callback()
+      sandbox = snap["sandbox"]
+      if sandbox:
+        print("User sandbox: ticks = %d  overruns = %d  skipped = %d  restarts = %d  failsafes = %d" % 
+          (sandbox["ticks"], sandbox["overruns"], sandbox["skipped"], sandbox["restarts"], sandbox["failsafes"]))
+      gcc = snap["gc"]
+      if gcc:
+        print("Managed GC: in match = %s  collections = %d  gen1 = %d  forced = %d  full = %d  avg = %.3f ms  max = %.3f ms" %
+          (gcc["in_match"], gcc["collections"], gcc["gen1"], gcc["forced"], gcc["full"], gcc["avg"] * 1000.0, gcc["max"] * 1000.0))
+      print("msgerr = %d, msgtmeouts = %d" % (snap["msg_errs"], snap["msg_timeouts"]))
+      nframes, dropped, out_of_order, resyncs = snap["frames"]
+      if nframes > 0:
+        print("Control frames: %d  dropped = %d  out of order = %d  resyncs = %d" % (nframes, dropped, out_of_order, resyncs))
+        age, age_sum, age_max, stale, nstale = snap["input_age"]
+        s_stale = ""
+        if stale: s_stale = "  STALE"
+        print("Input age: %.1f ms  on arrival = %.2f ms (max %.2f)  stale = %d (%s)%s" % (age * 1000.0,
+          age_sum / nframes * 1000.0, age_max * 1000.0, nstale, stale_policy, s_stale))
+        clk_valid, clk_offset = snap["ds_clock"]
+        if clk_valid: print("Driver station clock: offset = %.4f s" % clk_offset)
+      nreloads, reload_time = snap["reloads"]
+      if nreloads > 0:
+        print("User code reloads: %d  last took %.1f ms" % (nreloads, reload_time * 1000.0))
+      reporter = snap["reporter"]
+      print("Terminal reports: %d  dropped = %d" % (reporter["reported"], reporter["dropped"]))
 
   def report_status_to_ds(self):
-      ''' Reports the current status to the driver station, once every 1 second. '''
-      timenow = time.monotonic()
-      if timenow - self.last_report_time_to_ds < 1.000: return
-      self.last_report_time_to_ds = timenow
-      bat_m = bat_l = 0.0
-      if self.hw_okay:
-        _, bat_m = self.arduino.get_battery_voltage(battype="M")
-        _, bat_l = self.arduino.get_battery_voltage(battype="L")
+      ''' Reports the current status to the driver station.  The arduino data
+      comes from the latest telemetry snapshot, so the bus is not used here. '''
+      self.bat_m = self.bat_l = 0.0
+      if self.hw_okay: self.bat_m, self.bat_l = self.telemetry.get_battery_voltages()
       i2c = self.bus_monitor.get_total_error_count()
       s_status = "okay"
       if self.user_code_error: s_status = "code_err"
-      s = "%s %d %s %6.1f %6.1f %d %d %s" % (s_status, self.ds_loop_count, 
-        self.hw_okay, bat_m, bat_l, i2c, self.recovered_count, version)
+      s = "%s %d %s %6.1f %6.1f %d %d %s %d %.1f" % (s_status, self.ds_loop_count, 
+        self.hw_okay, self.bat_m, self.bat_l, i2c, self.recovered_count, version,
+        self.reload_count, self.reload_time * 1000.0)
       self.mqtt.publish("wbot/status", s)
-      if self.hw_okay:
-        try:
-          okay, dat = self.arduino.get_all()
-          if okay:
-            sout = ""
-            for d in dat:
-              sout += "%03d " % d
-            self.mqtt.publish("wbot/arduino", sout) 
-        except OSError:
-          pass
+      nframes = self.telemetry.get_frame_count()
+      if self.hw_okay and nframes != self.telemetry_frame_sent:
+        self.telemetry_frame_sent = nframes
+        okay, dat, _ = self.telemetry.get_snapshot()
+        if okay:
+          sout = ""
+          for d in dat:
+            sout += "%03d " % d
+          self.mqtt.publish("wbot/arduino", sout) 
+      snapshot = self.bus_monitor.get_snapshot()
+      self.mqtt.publish("wbot/bus", json.dumps(snapshot, separators=(",", ":")))
       
+  def get_perf_phases(self):
+    ''' Returns a list of (name, (p50, p99, max)) with the recent run times in
+    seconds for each task, the user code, and the whole tick. '''
+    phases = []
+    for t in self.tasks.get_stats():
+      phases.append((t["name"], (t["p50"], t["p99"], t["recent_max"])))
+    phases.append(("user", self.user_times.get_percentiles()))
+    phases.append(("tick", self.tasks.get_tick_percentiles()))
+    return phases
+
+  def report_perf_to_ds(self):
+    ''' Sends the loop timing to the driver station on wbot/perf. '''
+    self.mqtt.publish("wbot/perf", perfstats.format_perf(self.get_perf_phases()))
+
   def control_bot(self):
     ''' Overall control loop for the robot. Dispatches to various modes. '''
     if time.monotonic() - self.last_mode_cmd_time > 2.5:
@@ -285,15 +765,20 @@ class WaterBotBase():
     if self.mode_switch:
       self.run_loop_count = 0
       self.mode_switch = False
+    t0 = time.monotonic()
     if self.botmode == "STOP":
       self.stop(self.run_loop_count)
     if self.botmode == "AUTO":
       self.run_auto(self.run_loop_count, self.time_to_run)
     if self.botmode == "TELEOP":
       self.run_teleop(self.run_loop_count, self.time_to_run)
+    self.user_times.add(time.monotonic() - t0)
 
   def set_report_callback(self, cb):
-    ''' Sets the function to call when reports are made to the terminal.'''
+    ''' Sets the function to call when reports are made to the terminal.  The
+    function is called from the main loop, when the report's snapshot is
+    taken, so it may use the robot's state; the report itself is printed
+    later, on the terminal reporter's thread.'''
     self.report_callback = cb 
 
   # -------------------------------------------------------------------
@@ -344,7 +829,12 @@ class WaterBotBase():
         self.user_code_error = True
 
 if __name__ == "__main__":
+    rt_mode = False
+    for a in sys.argv[1:]:
+      if a == "rt": rt_mode = True
     user_module = get_user_module()
     wb = WaterBotBase(user_module)
+    if rt_mode:
+      rttune.apply(priority=rt_priority, cpu=rt_cpu, lock_mem=rt_lock_memory, freeze=rt_freeze_gc)
     wb.run()
 
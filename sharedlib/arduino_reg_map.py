@@ -2,7 +2,7 @@
 # EPIC Robotz, dlb, Mar 2021
 
 # This table should match the code in the arduino.
-SIGV    =  0   #  RO  Device Signature/Version.  Currently: 'e'
+SIGV    =  0   #  RO  Device Signature/Version.  Currently: 'h'
 BAT_M   =  1   #  RO  Battery Voltage for Motors (in units of 10ths of volts)
 DTME1   =  2   #  RO  Device Time, Milliseconds, Byte 0, MSB
 DTME2   =  3   #  RO  Device Time, Milliseconds, Byte 1
@@ -27,6 +27,11 @@ BAT_L   = 20   #  RO Battery Voltage for Logic (in units of 10ths of volts)
 LAST_V2 = 20   #  ** Last Registor (Newer Version)
 RW0     = 13   #  ** First Registor where writing is allowed. (except for BAT_L)
 
+# Firmware signatures (the value in SIGV) at which features were added.
+# Older firmware must be accessed one register at a time.
+SIGV_BLOCK_READ  = ord('g')  # Reads auto-increment from the given register to the last.
+SIGV_BLOCK_WRITE = ord('h')  # Writes with several data bytes fill consecutive registers.
+
 # One feature of the arduino code is that it keeps track if a digital input
 # changes on D3-D8.  This is reported in REG_SC.  Note that any change
 # (LOW -> HIGH, or HIGH -> LOW) on these pins will cause the corresponding
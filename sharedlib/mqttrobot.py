@@ -7,21 +7,257 @@
 # copy to both libs.
 
 import paho.mqtt.client as mqtt
+import math
+import struct
 import sys
+import threading
 import time
+try:
+    from paho.mqtt.properties import Properties
+    from paho.mqtt.packettypes import PacketTypes
+except ImportError:
+    Properties = None   # paho older than 1.5: no MQTT 5, so no message expiry
 
 #defaults for the water bot
 default_broker_url = "10.0.5.1"
 default_broker_port = 1883
 
+# Delivery profiles.  Each topic that is published can be given a profile,
+# with register_publish(), that says how its messages are sent:
+#
+#   qos       -- MQTT quality of service, 0 (at most once) or 1 (at least once,
+#                which costs an acknowledgement from the broker).
+#   retain    -- If True, the broker keeps the last message, and gives it to
+#                anyone that subscribes later, such as after a reconnect.
+#   expiry    -- Seconds after which the broker throws the message away if it
+#                has not been delivered yet (and forgets it, if retained).
+#                None for never.  Needs an MQTT 5 connection (mqtt5=True, and
+#                paho 1.5 or later); otherwise it is ignored.
+#   coalesce  -- If True, only one message on the topic is in flight at a time.
+#                Messages published while one is in flight are not queued;
+#                only the newest is kept, and sent when the one in flight is
+#                done.  Good for state that is sent faster than the link can
+#                take it, where only the latest value matters.
+#
+# Topics without a profile use profile_default, which is how everything was
+# sent before profiles: QoS 1 and retained.
+coalesce_timeout = 1.0  # secs after which a message still in flight is given up on
+
+class DeliveryProfile():
+    def __init__(self, qos=1, retain=True, expiry=None, coalesce=False):
+        self.qos = qos
+        self.retain = retain
+        self.expiry = expiry
+        self.coalesce = coalesce
+
+profile_default = DeliveryProfile(qos=1, retain=True)
+# For high rate control data, like the joysticks: no acknowledgements, never a
+# stale retained value after a reconnect, and only the newest message queued.
+profile_stream = DeliveryProfile(qos=0, retain=False, expiry=1.0, coalesce=True)
+# For commands, like the mode and pings: every message must arrive, but a
+# command must not be replayed to someone that connects later.
+profile_command = DeliveryProfile(qos=1, retain=False)
+# For status sent to the driver station: the latest value is kept for a new
+# subscriber, until it gets too old to be useful.
+profile_telemetry = DeliveryProfile(qos=0, retain=True, expiry=10.0, coalesce=True)
+
+# Control frames.  The joystick topics can be sent as text (the original
+# format, such as "T F F ..." for buttons), or as compact binary frames.  A
+# binary frame starts with a tag byte, which has the high bit set so it can
+# never be mistaken for text, and holds the format version in the low bits.
+# The next byte is the kind of frame, and the rest depends on the kind:
+#
+#   axes     -- six int16, each axis (-1.0 to 1.0) times axis_scale
+#   buttons  -- uint16 bitmask, bit 0 for the first button
+#   pov      -- two int8
+#   control  -- everything the driver station sends in one tick, in one
+#               frame, so the robot never mixes inputs from different ticks.
+#               See ControlFrame.
+#
+# All values are little endian.  The decoders accept both text and binary,
+# so a robot can talk to driver stations that send either one.
+#
+# The control frame has a version of its own, since it has changed while the
+# other frames have not.  Version 2 added the sender's clock.
+control_format_version = 1
+binary_tag = 0x80 | control_format_version
+control_frame_version = 2
+control_frame_tag = 0x80 | control_frame_version
+kind_axes, kind_buttons, kind_pov, kind_control = 1, 2, 3, 4
+axis_scale = 32767
+axes_struct = struct.Struct("<BB6h")
+buttons_struct = struct.Struct("<BBH")
+pov_struct = struct.Struct("<BBbb")
+control_struct = struct.Struct("<BBHIdBIfB6hHbb6hHbb")
+zero_axes = (0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+button_bits = tuple(1 << i for i in range(12))
+
+def is_binary(data):
+    ''' Returns True if data is a binary frame, rather than text. '''
+    return isinstance(data, (bytes, bytearray)) and len(data) > 0 and (data[0] & 0x80) != 0
+
+def encode_axes(axes, binary=True):
+    ''' Encodes six axes, each -1.0 to 1.0, as a binary frame (bytes), or as
+    text (str) if binary is False. '''
+    if not binary: return "%7.4f %7.4f %7.4f %7.4f %7.4f %7.4f" % tuple(axes)
+    vals = [int(round(max(-1.0, min(1.0, a)) * axis_scale)) for a in axes]
+    return axes_struct.pack(binary_tag, kind_axes, *vals)
+
+def decode_axes(data):
+    ''' Decodes six axes from a binary frame or text.  Returns okay_flag, val,
+    where val is a tuple of six floats. '''
+    if is_binary(data):
+        if len(data) != axes_struct.size or data[0] != binary_tag or data[1] != kind_axes:
+            return False, zero_axes
+        _, _, x, y, z, r, u, v = axes_struct.unpack(data)
+        return True, (x / axis_scale, y / axis_scale, z / axis_scale, r / axis_scale,
+            u / axis_scale, v / axis_scale)
+    slist = data.split()
+    if len(slist) != 6: return False, zero_axes
+    try:
+        x, y, z, r, u, v = float(slist[0]), float(slist[1]), float(slist[2]), float(slist[3]), float(slist[4]), float(slist[5])
+    except ValueError:
+        return False, zero_axes
+    return True, (x, y, z, r, u, v)
+
+def encode_buttons(btns, binary=True):
+    ''' Encodes 12 buttons as a binary frame (bytes), or as text (str) if
+    binary is False.  If there are more than 12, the rest are left out. '''
+    if not binary: return "".join(["T " if b else "F " for b in btns[:12]])
+    mask = 0
+    for i in range(min(len(btns), 12)):
+        if btns[i]: mask |= button_bits[i]
+    return buttons_struct.pack(binary_tag, kind_buttons, mask)
+
+def decode_buttons_into(data, buf):
+    ''' Decodes 12 buttons from a binary frame or text into the list buf, in
+    place.  Returns True if okay.  If the data can not be decoded, buf is left
+    as it was. '''
+    if is_binary(data):
+        if len(data) != buttons_struct.size or data[0] != binary_tag or data[1] != kind_buttons:
+            return False
+        _, _, mask = buttons_struct.unpack(data)
+        for i in range(12):
+            buf[i] = mask & button_bits[i] != 0
+        return True
+    slist = data.split()
+    if len(slist) != 12: return False
+    for i in range(12):
+        buf[i] = slist[i] == "T"
+    return True
+
+def decode_buttons(data):
+    ''' Decodes 12 buttons from a binary frame or text.  Returns okay_flag, val,
+    where val is a tuple of 12 booleans. '''
+    btns = [False for _ in range(12)]
+    okay = decode_buttons_into(data, btns)
+    return okay, tuple(btns)
+
+def encode_pov(pov, binary=True):
+    ''' Encodes a pov (x, y) as a binary frame (bytes), or as text (str) if
+    binary is False. '''
+    if not binary: return "%d %d" % tuple(pov)
+    return pov_struct.pack(binary_tag, kind_pov, pov[0], pov[1])
+
+def decode_pov(data):
+    ''' Decodes a pov from a binary frame or text.  Returns okay_flag, val,
+    where val is a tuple of 2 integers. '''
+    if is_binary(data):
+        if len(data) != pov_struct.size or data[0] != binary_tag or data[1] != kind_pov:
+            return False, (0, 0)
+        _, _, x, y = pov_struct.unpack(data)
+        return True, (x, y)
+    slist = data.split()
+    if len(slist) != 2: return False, (0, 0)
+    try:
+        x, y = int(slist[0]), int(slist[1])
+    except ValueError:
+        return False, (0, 0)
+    return True, (x, y)
+
+control_modes = ("STOP", "TELEOP", "AUTO")
+aux_commands = ("NoOp", "RestartArduino", "ReloadUser")
+
+class ControlFrame():
+    ''' The driver station's state for one tick: the mode command and both
+    joysticks.  The session is picked at random when the driver station starts,
+    and seq counts up by one for each frame sent in the session, so the robot
+    can tell when frames are lost or arrive out of order.  t_sent is the
+    sender's time.monotonic() when the frame was sent, so the robot can tell
+    how old it is.  The frame is sent in binary as: tag, kind, session
+    (uint16), seq (uint32), t_sent (float64), mode (uint8), ds_loop (uint32),
+    time_to_go (float32), aux (uint8), and then for each joystick: six int16
+    axes, a uint16 button mask, and two int8 for the pov.  A frame object can
+    be reused; decode() fills it in place. '''
+    def __init__(self):
+        self.session = 0
+        self.seq = 0
+        self.t_sent = 0.0
+        self.mode = "STOP"
+        self.ds_loop = 0
+        self.time_to_go = 0.0
+        self.aux = "NoOp"
+        self.axes = [zero_axes, zero_axes]
+        self.buttons = [[False for _ in range(12)], [False for _ in range(12)]]
+        self.povs = [(0, 0), (0, 0)]
+
+    def encode(self):
+        ''' Returns the frame as bytes. '''
+        vals = []
+        for i in range(2):
+            vals.extend([int(round(max(-1.0, min(1.0, a)) * axis_scale)) for a in self.axes[i]])
+            mask = 0
+            for ib in range(12):
+                if self.buttons[i][ib]: mask |= button_bits[ib]
+            vals.append(mask)
+            vals.extend(self.povs[i])
+        return control_struct.pack(control_frame_tag, kind_control, self.session, self.seq,
+            self.t_sent, control_modes.index(self.mode), self.ds_loop, self.time_to_go,
+            aux_commands.index(self.aux), *vals)
+
+    def decode(self, data):
+        ''' Fills the frame from bytes.  Returns True if okay.  If the data is
+        not a good control frame, False is returned, and the frame may have
+        been partly changed. '''
+        if not is_binary(data) or len(data) != control_struct.size: return False
+        if data[0] != control_frame_tag or data[1] != kind_control: return False
+        v = control_struct.unpack(data)
+        if v[5] >= len(control_modes) or v[8] >= len(aux_commands): return False
+        self.session, self.seq, self.t_sent = v[2], v[3], v[4]
+        self.ds_loop, self.time_to_go = v[6], v[7]
+        self.mode = control_modes[v[5]]
+        self.aux = aux_commands[v[8]]
+        for i in range(2):
+            k = 9 + i * 9
+            self.axes[i] = (v[k] / axis_scale, v[k + 1] / axis_scale, v[k + 2] / axis_scale,
+                v[k + 3] / axis_scale, v[k + 4] / axis_scale, v[k + 5] / axis_scale)
+            mask = v[k + 6]
+            btns = self.buttons[i]
+            for ib in range(12):
+                btns[ib] = mask & button_bits[ib] != 0
+            self.povs[i] = (v[k + 7], v[k + 8])
+        return True
+
+def decode_control_frame(data):
+    ''' Decodes a control frame.  Returns okay_flag, frame, where frame is a
+    new ControlFrame.  For use as a topic decoder. '''
+    frame = ControlFrame()
+    okay = frame.decode(data)
+    return okay, frame
+
 class MqttRobot():
 
-    def __init__(self, broker_url=default_broker_url, broker_port=default_broker_port):
+    def __init__(self, broker_url=default_broker_url, broker_port=default_broker_port, mqtt5=False):
+        ''' If mqtt5 is True, the connection uses MQTT 5, which the broker must
+        support.  This is needed for the expiry in delivery profiles. '''
         self._broker_url = broker_url
         self._broker_port = broker_port
-        self._client = mqtt.Client()
+        self._mqtt5 = mqtt5 and Properties is not None
+        if self._mqtt5: self._client = mqtt.Client(protocol=mqtt.MQTTv5)
+        else: self._client = mqtt.Client()
         self._client.on_connect = self._on_connect
         self._client.on_message = self._on_message
+        self._client.on_publish = self._on_publish
         self._client.connect_async(self._broker_url, self._broker_port)
         self._last_connect_tme = 0
         self._last_rx_time = 0
@@ -30,15 +266,38 @@ class MqttRobot():
         self._tx_msg_count = 0
         self._connect_count = 0
         self._err_count = 0
-        self._topics = {}  # keywords=topic, value = tuple of (data, timestamp, callback)
+        self._decode_err_count = 0
+        # keywords=topic, value = tuple of (data, timestamp, callback, decoder, value, version).
+        # The whole tuple is replaced when a message arrives, so readers always see
+        # a matching set.
+        self._topics = {}
+        self._wake_topics = set()  # topics that set the wake event when received
+        self._wake_event = threading.Event()
+        self._profiles = {}  # keywords=topic, value = DeliveryProfile
+        # For coalesced topics, the message in flight and the newest data waiting
+        # behind it.  A message is in flight from the publish until the driver
+        # calls _on_publish with its mid, which may even happen before publish
+        # returns the mid to us; such mids are kept in _early_mids.
+        self._inflight = {}       # keywords=topic, value = (mid, time sent)
+        self._inflight_mids = {}  # keywords=mid, value = topic
+        self._pending = {}        # keywords=topic, value = data waiting to be sent
+        self._early_mids = set()
+        self._sending = 0         # coalesced publishes in progress
+        self._coalesce_lock = threading.Lock()
+        self._coalesced_count = 0
         self._client.loop_start()
 
-    def _on_connect(self, client, userdata, flags, rc):
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
         ''' Called by the MQTT driver when a connection is made
         or rejected. '''
         if rc == 0:
             self._connect_count += 1
             self._last_connect_tme = time.monotonic()
+            # Anything in flight on the old connection is gone.
+            with self._coalesce_lock:
+              self._inflight.clear()
+              self._inflight_mids.clear()
+              self._pending.clear()
             # We found by experiment that the subscription to the server only is valid when 
             # the connection is active.  So refresh all subscriptions here.
             for t in self._topics.keys():
@@ -50,26 +309,71 @@ class MqttRobot():
         self._last_rx_time = time.monotonic()
         self._rx_msg_count += 1
         topic = message.topic
-        data = message.payload.decode()
-        if topic not in self._topics: return
-        _, _, cb = self._topics[topic]
+        data = message.payload
+        if not is_binary(data): data = data.decode()
+        entry = self._topics.get(topic)
+        if entry is None: return
+        _, _, cb, decoder, value, version = entry
+        if decoder is not None:
+          try:
+            okay, value = decoder(data)
+          except Exception:
+            okay = False
+          if not okay:
+            self._decode_err_count += 1
+            return
         timenow = time.monotonic()
-        self._topics[topic] = (data, timenow, cb)
+        self._topics[topic] = (data, timenow, cb, decoder, value, version + 1)
+        if topic in self._wake_topics:
+          self._wake_event.set()
         if cb != None:
-          cb(topic, data)
+          if decoder is not None: cb(topic, value)
+          else: cb(topic, data)
   
     def get_data(self, topic):
         ''' Returns the data for a given topic. The return
         info is a tuple: okayflag, data, timestamp, where
         the okayflag is True if the data is avaliable.  The
-        data is always a string.  The timestamp is the 
+        data is a string, or bytes for a binary frame.  The timestamp is the 
         time.monotinic() at the actual time the data was
         received. '''
         if topic not in self._topics: 
             return False, "", 0
-        v, tme, _ = self._topics[topic]
+        v, tme = self._topics[topic][0:2]
         return True, v, tme
 
+    def get_timestamp(self, topic):
+        ''' Returns the time.monotonic() when the data for the topic was last
+        received, or 0 if it never was.  Nothing is allocated, so this can be
+        used on every tick to find out if a topic needs to be decoded again. '''
+        entry = self._topics.get(topic)
+        if entry is None: return 0
+        return entry[1]
+
+    def get_value(self, topic):
+        ''' Returns the decoded value for a topic registered with a decoder, or
+        None if no good message has been received yet.  The value is the object
+        made by the decoder when the message arrived; nothing is parsed or
+        allocated here.  Treat it as read only. '''
+        entry = self._topics.get(topic)
+        if entry is None: return None
+        return entry[4]
+
+    def get_version(self, topic):
+        ''' Returns the version of a topic, which counts up by one for each
+        message received (for a topic with a decoder, each message that decoded
+        okay).  Zero if nothing has been received. '''
+        entry = self._topics.get(topic)
+        if entry is None: return 0
+        return entry[5]
+
+    def changed_since(self, topic, version):
+        ''' Returns True if the topic has been received since it was at the
+        given version.  Nothing is parsed or allocated. '''
+        entry = self._topics.get(topic)
+        if entry is None: return False
+        return entry[5] != version
+
     def is_connected(self):
         ''' Returns true if the MQTT client is connected. '''
         return self._client.is_connected()
@@ -81,38 +385,114 @@ class MqttRobot():
         return time.monotonic() - self._last_rx_time
 
     def get_counts(self):
-        ''' returns a dict of counts: {rx:, tx:, err:, cc:} where
+        ''' returns a dict of counts: {rx:, tx:, err:, cc:, dec:, coal:} where
         rx is the number of messages received, tx the number of messages
-        sent, err is the number of errors encounterd, and cc is the
-        number of connections and reconnections logged. '''
+        sent, err is the number of errors encounterd, cc is the
+        number of connections and reconnections logged, dec is the
+        number of messages that their topic's decoder rejected, and coal is
+        the number of messages replaced by newer ones on coalesced topics. '''
         d = {"rx": self._rx_msg_count, "tx": self._tx_msg_count, 
-            "err": self._err_count, "cc": self._connect_count }
+            "err": self._err_count, "cc": self._connect_count,
+            "dec": self._decode_err_count, "coal": self._coalesced_count }
         return d
 
-    def register_topic(self, topic, callback=None):
+    def register_topic(self, topic, callback=None, wake=False, decoder=None):
         ''' Registor for receiving a topic.  Callback can be None.
-        The sigurature for the callback is (topic, value). '''
+        The sigurature for the callback is (topic, value).  If wake is
+        True, the wake event is set each time the topic is received.
+
+        If a decoder is given, the topic is typed: the decoder is called
+        once, when each message arrives, with the data (a string, or bytes
+        for a binary frame), and must return okay_flag, value, like the
+        decode_* functions in this module.  The value is stored with the
+        data, and the version counts up.  Messages that do not decode are
+        counted and dropped.  For a typed topic, the callback is given the
+        decoded value instead of the data. '''
+        if wake: self._wake_topics.add(topic)
+        else: self._wake_topics.discard(topic)
         if topic in self._topics:
-          self._topics[topic] = ("", 0, callback)
+          self._topics[topic] = ("", 0, callback, decoder, None, 0)
           return
-        self._topics[topic] = ("", 0, callback)
+        self._topics[topic] = ("", 0, callback, decoder, None, 0)
         if self.is_connected():
           self._client.subscribe(topic, qos=1)
 
+    def get_wake_event(self):
+        ''' Returns the threading.Event that is set when a topic registered
+        with wake=True is received.  The waiter should clear it. '''
+        return self._wake_event
+
     def register_ping_callback(self, callback):
         ''' Register a callback that is called upon receiving a ping message.'''
         self._ping_cb = callback
     
-    def publish(self, topic, data):
+    def register_publish(self, topic, profile):
+        ''' Sets the DeliveryProfile used to publish on a topic. '''
+        self._profiles[topic] = profile
+
+    def publish(self, topic, data, profile=None):
         ''' sends data to the broker. Input is the topic (string), and
-        the data (string).  If the client is not connected, the data
+        the data (string, or bytes for a binary frame).  If the client is not connected, the data
         is not sent, and False is returned.  Otherwise True is returned
-        weither or not the data was actually delivered.'''
+        weither or not the data was actually delivered.  The topic's delivery
+        profile decides how it is sent, unless a profile is given for this
+        message.  For a coalesced topic, the data may be held, and replaced by
+        newer data, until the message in flight is done.  A message sent with
+        a profile that does not coalesce replaces any data held for its topic.'''
         if not self.is_connected(): return False
-        self._client.publish(topic=topic, payload=data.encode("ascii"), qos=1, retain=True)
+        if isinstance(data, str): data = data.encode("ascii")
+        if profile is None: profile = self._profiles.get(topic, profile_default)
+        elif not profile.coalesce:
+            with self._coalesce_lock:
+                if self._pending.pop(topic, None) is not None: self._coalesced_count += 1
+        if profile.coalesce:
+            with self._coalesce_lock:
+                if topic in self._inflight:
+                    mid, tsent = self._inflight[topic]
+                    if time.monotonic() - tsent < coalesce_timeout:
+                        if topic in self._pending: self._coalesced_count += 1
+                        self._pending[topic] = data
+                        return True
+                    # Given up on; it was probably lost with a connection.
+                    del self._inflight[topic]
+                    self._inflight_mids.pop(mid, None)
+        self._send(topic, data, profile)
+        return True
+
+    def _send(self, topic, data, profile):
+        ''' Hands a message to the MQTT driver, as the profile says. '''
+        kwargs = {}
+        if self._mqtt5 and profile.expiry is not None:
+            props = Properties(PacketTypes.PUBLISH)
+            props.MessageExpiryInterval = max(1, int(math.ceil(profile.expiry)))
+            kwargs["properties"] = props
+        if profile.coalesce:
+            with self._coalesce_lock: self._sending += 1
+        info = self._client.publish(topic=topic, payload=data, qos=profile.qos, retain=profile.retain, **kwargs)
+        if profile.coalesce:
+            with self._coalesce_lock:
+                self._sending -= 1
+                if info.mid not in self._early_mids:
+                    self._inflight[topic] = (info.mid, time.monotonic())
+                    self._inflight_mids[info.mid] = topic
+                if self._sending == 0: self._early_mids.clear()
+                else: self._early_mids.discard(info.mid)
         self._tx_msg_count += 1
         self._last_tx_time = time.monotonic()
-        return True
+
+    def _on_publish(self, client, userdata, mid):
+        ''' Called by the MQTT driver when a message has been sent (QoS 0) or
+        acknowledged (QoS 1).  If it was in flight on a coalesced topic, the
+        data waiting behind it, if any, is sent. '''
+        with self._coalesce_lock:
+            topic = self._inflight_mids.pop(mid, None)
+            if topic is None:
+                if self._sending > 0: self._early_mids.add(mid)
+                return
+            del self._inflight[topic]
+            data = self._pending.pop(topic, None)
+        if data is not None:
+            self._send(topic, data, self._profiles.get(topic, profile_default))
 
     def close(self):
         ''' Causes the connection to shut down.  Do not use
@@ -135,48 +515,32 @@ class MqttRobot():
         return True, (x, y, z)
 
     def get_6_floats(self, topic):
-        ''' Decodes six floats from MQTT topic. Returns:
-        okay_flag, val, where val is a list of six floats.'''
+        ''' Decodes six floats from MQTT topic, sent as text or as a binary
+        frame. Returns: okay_flag, val, where val is a list of six floats.'''
         okay, s, _ = self.get_data(topic)
         if not okay:
-          return False, (0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
-        slist = s.split() 
-        if len(slist) != 6:
-          return False, (0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
-        try:
-          x, y, z, r, u, v = float(slist[0]), float(slist[1]), float(slist[2]), float(slist[3]), float(slist[4]), float(slist[5])
-        except ValueError:
-          return False, (0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
-        return True, (x, y, z, r, u, v)
+          return False, zero_axes
+        return decode_axes(s)
 
     def get_12_bools(self, topic):
-        ''' Decodes 12 booleans from MQTT topic. Returns:
-        okay_flag, vals, where vals is a list of 12 booleans. '''
+        ''' Decodes 12 booleans from MQTT topic, sent as text or as a binary
+        frame. Returns: okay_flag, vals, where vals is a list of 12 booleans. '''
+        btns = [False for _ in range(12)]
+        okay = self.get_12_bools_into(topic, btns)
+        return okay, btns
+
+    def get_12_bools_into(self, topic, buf):
+        ''' Decodes 12 booleans from MQTT topic into the list buf, in place,
+        so that no new list is made.  Returns True if okay.  If the data can
+        not be decoded, buf is left as it was. '''
         okay, s, _ = self.get_data(topic)
-        if not okay:
-          return False, [False for _ in range(12)]
-        slist = s.split()
-        if len(slist) != 12:
-          return False, [False for _ in range(12)]
-        btns = []
-        for s in slist:
-          if s == "T": btns.append(True)
-          else: btns.append(False)
-        return True, btns
+        if not okay: return False
+        return decode_buttons_into(s, buf)
 
     def get_2_ints(self, topic):
-        ''' Decodes 2 integers from MQTT topic. Returns:
-        okay_flag, val, where vals is a list of 2 integers. '''
+        ''' Decodes 2 integers from MQTT topic, sent as text or as a binary
+        frame (a pov). Returns: okay_flag, val, where vals is a list of 2 integers. '''
         okay, s, _ = self.get_data(topic)
         if not okay:
           return False, (0, 0)
-        slist = s.split()
-        if len(slist) != 2:
-          return False, (0, 0)
-        try:
-          x, y = int(slist[0]), int(slist[1])
-        except ValueError:
-          return False, (0, 0)
-        return True, (x, y)
-
-
+        return decode_pov(s)
@@ -0,0 +1,63 @@
+# perfstats.py -- Rolling percentiles for timing the phases of the main loop
+# EPIC Robotz, dlb, Apr 2021
+#
+# Each RollingStats keeps the last few hundred samples in a ring buffer.
+# Adding a sample is just a store and an increment, so it can be done on
+# every tick.  The percentiles are only worked out (by sorting a copy of the
+# buffer) when they are asked for, which is about once a second.
+
+default_window = 256  # samples kept
+
+class RollingStats():
+    def __init__(self, window=default_window):
+        self._samples = [0.0 for _ in range(window)]
+        self._window = window
+        self._index = 0
+        self._count = 0
+
+    def add(self, value):
+        ''' Adds a sample. '''
+        self._samples[self._index] = value
+        self._index += 1
+        if self._index >= self._window: self._index = 0
+        self._count += 1
+
+    def reset(self):
+        ''' Forgets all samples. '''
+        self._index = 0
+        self._count = 0
+
+    def get_count(self):
+        ''' Returns the number of samples added since the last reset. '''
+        return self._count
+
+    def get_percentiles(self):
+        ''' Returns (p50, p99, max) over the samples in the window, or zeros
+        if there are none. '''
+        n = min(self._count, self._window)
+        if n == 0: return 0.0, 0.0, 0.0
+        lst = sorted(self._samples[:n])
+        return lst[(n - 1) // 2], lst[((n - 1) * 99) // 100], lst[-1]
+
+def format_perf(phases):
+    ''' Formats a list of (name, (p50, p99, max)) in seconds into the text sent
+    on the wbot/perf topic: groups of four words, "name p50 p99 max", with the
+    times in milliseconds. '''
+    s = ""
+    for name, (p50, p99, pmax) in phases:
+        s += "%s %.3f %.3f %.3f " % (name, p50 * 1000.0, p99 * 1000.0, pmax * 1000.0)
+    return s
+
+def parse_perf(data):
+    ''' Decodes the text from the wbot/perf topic into a dict, where the keyword
+    is the phase name, and the value is (p50, p99, max) in milliseconds.
+    Returns an empty dict if the text cannot be decoded. '''
+    words = data.split()
+    if len(words) % 4 != 0: return {}
+    d = {}
+    try:
+        for i in range(0, len(words), 4):
+            d[words[i]] = (float(words[i + 1]), float(words[i + 2]), float(words[i + 3]))
+    except ValueError:
+        return {}
+    return d
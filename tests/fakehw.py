@@ -0,0 +1,93 @@
+# fakehw.py -- stand-ins for the Pi hardware, so the rpi code can be tested on any computer
+# EPIC Robotz, dlb, Apr 2021
+#
+# Importing this module puts fake smbus and RPi.GPIO modules in place of the
+# real ones, and adds rpi/lib and sharedlib to the path.  So a test must import
+# fakehw before any of the robot modules.
+#
+# The fake SMBus is a register file for each address, and it remembers every
+# transaction, so that a test can check what went over the bus.  It does not
+# act like any particular device: a test sets the registers it needs.
+#
+# FakeClock can be patched in for a module's time, so that timing can be
+# tested without waiting, and without depending on the computer's speed.
+
+import os
+import sys
+import types
+
+_here = os.path.dirname(os.path.abspath(__file__))
+for _d in (os.path.join(_here, "..", "sharedlib"), os.path.join(_here, "..", "rpi", "lib")):
+    if _d not in sys.path: sys.path.insert(0, _d)
+
+class FakeSMBus():
+    ''' Looks enough like smbus.SMBus for the robot code. '''
+    def __init__(self, bus_num=1):
+        self.regs = {}   # keyword=(addr, reg), value = byte
+        self.log = []    # tuples of (op, addr, reg, data) for each transaction
+        self.fail = False  # if True, every transaction raises IOError
+
+    def _do(self, op, addr, reg, data=None):
+        self.log.append((op, addr, reg, data))
+        if self.fail: raise OSError(121, "Remote I/O error")
+
+    def read_byte_data(self, addr, reg):
+        self._do("read_byte_data", addr, reg)
+        return self.regs.get((addr, reg), 0)
+
+    def write_byte_data(self, addr, reg, v):
+        self._do("write_byte_data", addr, reg, v)
+        self.regs[(addr, reg)] = v
+
+    def read_i2c_block_data(self, addr, reg, n):
+        self._do("read_i2c_block_data", addr, reg, n)
+        return [self.regs.get((addr, reg + i), 0) for i in range(n)]
+
+    def write_i2c_block_data(self, addr, reg, data):
+        self._do("write_i2c_block_data", addr, reg, list(data))
+        for i, v in enumerate(data): self.regs[(addr, reg + i)] = v
+
+    def count(self, op=None, reg=None):
+        ''' Returns the number of transactions, of one kind and register if given. '''
+        n = 0
+        for o, _, r, _ in self.log:
+            if op is not None and o != op: continue
+            if reg is not None and r != reg: continue
+            n += 1
+        return n
+
+    def clear_log(self):
+        self.log = []
+
+class FakeClock():
+    ''' Looks enough like the time module for the robot code.  Time only
+    moves when sleep() or advance() is called. '''
+    def __init__(self, start=1000.0):
+        self.now = start
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        if secs > 0: self.now += secs
+
+    def advance(self, secs):
+        self.now += secs
+
+def _install():
+    smbus = types.ModuleType("smbus")
+    smbus.SMBus = FakeSMBus
+    sys.modules["smbus"] = smbus
+    gpio = types.ModuleType("RPi.GPIO")
+    gpio.BOARD = gpio.BCM = gpio.OUT = gpio.IN = 1
+    for name in ("setwarnings", "setmode", "setup", "output", "cleanup"):
+        setattr(gpio, name, lambda *args, **kwargs: None)
+    rpi = types.ModuleType("RPi")
+    rpi.GPIO = gpio
+    sys.modules["RPi"] = rpi
+    sys.modules["RPi.GPIO"] = gpio
+
+_install()
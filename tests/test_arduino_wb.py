@@ -0,0 +1,128 @@
+# test_arduino_wb.py -- checks the register shadow and write coalescing in arduino_wb
+# EPIC Robotz, dlb, Apr 2021
+#
+# usage: python3 -m pytest tests   (or python3 -m unittest discover tests)
+
+import unittest
+from unittest import mock
+import fakehw
+import arduino_reg_map as reg
+import arduino_wb
+
+def make_arduino(**kwargs):
+    ''' Returns (arduino, fake smbus), for an arduino with block read and write. '''
+    ard = arduino_wb.Arduino_wb(**kwargs)
+    fake = ard._bus._bus
+    fake.regs[(ard._addr, reg.SIGV)] = reg.SIGV_BLOCK_WRITE
+    return ard, fake
+
+class TestShadow(unittest.TestCase):
+    def setUp(self):
+        self.clock = fakehw.FakeClock()
+        patcher = mock.patch.object(arduino_wb, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ard, self.fake = make_arduino(use_shadow=True)
+        self.ard.supports_block_read()  # reads the signature
+        self.fake.clear_log()
+
+    def test_group_is_read_in_one_block(self):
+        self.fake.regs[(self.ard._addr, reg.A3)] = 77
+        self.ard.begin_tick()
+        self.assertEqual(self.ard.read_shadow(reg.A3), 77)
+        self.assertEqual(self.fake.log, [("read_i2c_block_data", self.ard._addr, reg.A1, 5)])
+        self.ard.read_shadow(reg.A1)
+        self.ard.read_shadow(reg.A7)
+        self.assertEqual(len(self.fake.log), 1)
+        self.assertEqual(self.ard.get_cache_stats(), {"hits": 2, "misses": 1})
+
+    def test_max_age(self):
+        self.ard.set_shadow_max_age("analog", 0.050)
+        self.ard.begin_tick()
+        self.ard.read_shadow(reg.A1)
+        self.clock.advance(0.040)
+        self.ard.begin_tick()
+        self.ard.read_shadow(reg.A1)
+        self.assertEqual(len(self.fake.log), 1)
+        self.clock.advance(0.020)
+        self.ard.begin_tick()
+        self.ard.read_shadow(reg.A1)
+        self.assertEqual(len(self.fake.log), 2)
+
+    def test_same_tick_is_never_reread(self):
+        self.ard.set_shadow_max_age("time", 0.0)
+        self.ard.begin_tick()
+        self.ard.read_shadow(reg.DTME1)
+        self.clock.advance(0.005)
+        self.ard.read_shadow(reg.DTME4)
+        self.assertEqual(len(self.fake.log), 1)
+        self.ard.begin_tick()
+        self.ard.read_shadow(reg.DTME1)
+        self.assertEqual(len(self.fake.log), 2)
+
+    def test_max_age_zero_reads_once_per_tick(self):
+        for _ in range(3):
+            self.clock.advance(0.010)
+            self.ard.begin_tick()
+            self.ard.read_shadow(reg.SC, max_age=0)
+            self.ard.read_shadow(reg.SC, max_age=0)
+        self.assertEqual(self.fake.count(reg=reg.SI), 3)
+
+    def test_invalidate(self):
+        self.ard.begin_tick()
+        self.ard.read_shadow(reg.BAT_M)
+        self.ard.invalidate_shadow()
+        self.ard.read_shadow(reg.BAT_M)
+        self.assertEqual(self.fake.count("read_byte_data", reg.BAT_M), 2)
+
+    def test_without_shadow_every_read_goes_to_the_bus(self):
+        ard, fake = make_arduino()
+        ard.begin_tick()
+        ard.read_shadow(reg.BAT_M)
+        ard.read_shadow(reg.BAT_M)
+        self.assertEqual(fake.count("read_byte_data", reg.BAT_M), 2)
+
+class TestWriteCoalescing(unittest.TestCase):
+    def setUp(self):
+        self.clock = fakehw.FakeClock()
+        patcher = mock.patch.object(arduino_wb, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ard, self.fake = make_arduino(refresh_interval=1.0)
+
+    def test_same_value_is_skipped(self):
+        self.assertTrue(self.ard.writereg_if_changed(reg.PWM10, 100))
+        self.assertFalse(self.ard.writereg_if_changed(reg.PWM10, 100))
+        self.assertTrue(self.ard.writereg_if_changed(reg.PWM10, 101))
+        self.assertEqual(self.fake.count("write_byte_data", reg.PWM10), 2)
+        self.assertEqual(self.ard.get_write_stats(), {"sent": 2, "skipped": 1})
+
+    def test_same_value_is_refreshed(self):
+        self.ard.writereg_if_changed(reg.PWM10, 100)
+        self.clock.advance(0.9)
+        self.assertFalse(self.ard.writereg_if_changed(reg.PWM10, 100))
+        self.clock.advance(0.2)
+        self.assertTrue(self.ard.writereg_if_changed(reg.PWM10, 100))
+        self.ard.set_refresh_interval(5.0)
+        self.clock.advance(2.0)
+        self.assertFalse(self.ard.writereg_if_changed(reg.PWM10, 100))
+
+    def test_failed_write_is_resent(self):
+        self.ard.writereg_if_changed(reg.PWM10, 100)
+        self.fake.fail = True
+        with self.assertRaises(IOError):
+            self.ard.writereg_if_changed(reg.PWM10, 50)
+        self.fake.fail = False
+        self.assertTrue(self.ard.writereg_if_changed(reg.PWM10, 100))
+
+    def test_all_channels_in_one_block(self):
+        self.assertTrue(self.ard.set_pwm("ALL", 1.0))
+        self.assertEqual(self.fake.log[-1], ("write_i2c_block_data", self.ard._addr, reg.PWM9,
+            [255 for _ in reg.pwm_chans]))
+        self.fake.clear_log()
+        self.ard.set_pwm("ALL", 1.0)
+        self.ard.set_pwm("PWM10", 1.0)
+        self.assertEqual(self.fake.log, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+# test_busmonitor.py -- checks the rates, histogram and alerts in busmonitor
+# EPIC Robotz, dlb, Apr 2021
+#
+# usage: python3 -m pytest tests   (or python3 -m unittest discover tests)
+
+import unittest
+from unittest import mock
+import fakehw
+import busmonitor
+
+class TestBusMonitor(unittest.TestCase):
+    def setUp(self):
+        self.clock = fakehw.FakeClock(start=1000.0)
+        patcher = mock.patch.object(busmonitor, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.alerts = 0
+        self.mon = busmonitor.BusMonitor(alert_cb=self.on_alert)
+
+    def on_alert(self):
+        self.alerts += 1
+
+    def run_secs(self, secs, per_sec, errs_per_sec=0):
+        ''' Reports per_sec transactions in each second, errs_per_sec of them failed.
+        Use a power of two for per_sec, so the clock steps add up exactly. '''
+        for _ in range(secs):
+            for i in range(per_sec):
+                if i < errs_per_sec: self.mon.on_fail("read", "arduino", 12)
+                else: self.mon.on_success("read", 0, 1, "arduino", 12, 0.0003)
+                self.clock.advance(1.0 / per_sec)
+
+    def test_rates_over_the_window(self):
+        self.run_secs(10, 64, errs_per_sec=8)
+        tps, err_rate = self.mon.get_rates()
+        self.assertAlmostEqual(tps, 64.0)
+        self.assertAlmostEqual(err_rate, 0.125)
+
+    def test_current_second_is_not_counted(self):
+        self.run_secs(3, 16)
+        self.clock.advance(0.5)
+        for _ in range(100): self.mon.on_success("read", 0, 1, "arduino", 12)
+        self.assertAlmostEqual(self.mon.get_rates()[0], 16.0)
+
+    def test_rates_at_startup(self):
+        self.assertEqual(self.mon.get_rates(), (0.0, 0.0))
+        self.run_secs(2, 32)
+        self.assertAlmostEqual(self.mon.get_rates()[0], 32.0)
+
+    def test_rates_fall_to_zero_when_idle(self):
+        self.run_secs(3, 16)
+        self.clock.advance(busmonitor.default_window)
+        self.assertEqual(self.mon.get_rates(), (0.0, 0.0))
+
+    def test_latency_histogram(self):
+        for latency in (0.0001, 0.0003, 0.0003, 0.1):
+            self.mon.on_success("read", 0, 1, "arduino", 12, latency)
+        counts = [n for _, n in self.mon.get_latency_histogram()]
+        self.assertEqual(counts[:2], [1, 2])
+        self.assertEqual(counts[-1], 1)
+        self.assertEqual(self.mon.get_latency_histogram()[-1][0], None)
+
+    def test_alert_after_errors_in_a_row(self):
+        for _ in range(10): self.mon.on_fail("write", "pca9685", 6)
+        self.assertFalse(self.mon.in_alert())
+        self.mon.on_success("write", 4, 0, "pca9685", 6)
+        for _ in range(10): self.mon.on_fail("write", "pca9685", 6)
+        self.assertFalse(self.mon.in_alert())
+        self.mon.on_fail("write", "pca9685", 6)
+        self.assertTrue(self.mon.in_alert())
+        self.assertEqual(self.alerts, 1)
+        self.assertEqual(self.mon.get_total_error_count(), 21)
+
+    def test_snapshot_counts(self):
+        self.mon.on_success("write", 4, 0, "pca9685", 6, 0.001)
+        self.mon.on_fail("write", "pca9685", 6)
+        snap = self.mon.get_snapshot()
+        dev = snap["devices"]["pca9685"]
+        self.assertEqual((dev["xfers"], dev["errs"], dev["out"], dev["in"]), (2, 1, 4, 0))
+
+if __name__ == "__main__":
+    unittest.main()
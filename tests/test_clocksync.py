@@ -0,0 +1,48 @@
+# test_clocksync.py -- checks the one way clock offset in clocksync
+# EPIC Robotz, dlb, Apr 2021
+#
+# usage: python3 -m pytest tests   (or python3 -m unittest discover tests)
+
+import unittest
+import fakehw
+import clocksync
+
+class TestOneWay(unittest.TestCase):
+    def setUp(self):
+        self.sync = clocksync.ClockSync(scale=1.0, window=4)
+        self.offset = -1234.5  # the remote clock is this far ahead of ours
+
+    def arrive(self, t_sent, delay):
+        ''' Adds a message sent at local time t_sent, that took delay secs in transit. '''
+        self.sync.add_one_way(t_sent - self.offset, t_sent + delay)
+
+    def test_not_valid_until_a_sample(self):
+        self.assertFalse(self.sync.is_valid())
+        self.arrive(10.0, 0.003)
+        self.assertTrue(self.sync.is_valid())
+
+    def test_offset_is_the_shortest_delay(self):
+        for t, delay in ((10.0, 0.004), (10.05, 0.001), (10.1, 0.030), (10.15, 0.002)):
+            self.arrive(t, delay)
+        self.assertAlmostEqual(self.sync.get_offset(), self.offset + 0.001)
+        # Ages measured from to_local() are the delay beyond the fastest message.
+        self.assertAlmostEqual(10.2 + 0.030 - self.sync.to_local(10.2 - self.offset), 0.029)
+        self.assertEqual(self.sync.get_drift_ppm(), 0.0)
+
+    def test_old_samples_leave_the_window(self):
+        self.arrive(10.0, 0.001)
+        for i in range(4): self.arrive(10.05 + i * 0.05, 0.005)
+        self.assertAlmostEqual(self.sync.get_offset(), self.offset + 0.005)
+
+    def test_remote_clock_reset(self):
+        self.arrive(10.0, 0.001)
+        self.offset = 0.0  # the remote restarted, so its clock went backwards
+        self.arrive(10.05, 0.006)
+        self.assertAlmostEqual(self.sync.get_offset(), 0.006)
+
+    def test_round_trip(self):
+        self.arrive(10.0, 0.002)
+        self.assertAlmostEqual(self.sync.to_remote(self.sync.to_local(5000.0)), 5000.0)
+
+if __name__ == "__main__":
+    unittest.main()
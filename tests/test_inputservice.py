@@ -0,0 +1,78 @@
+# test_inputservice.py -- checks edge and pulse counting in inputservice
+# EPIC Robotz, dlb, Apr 2021
+#
+# The fake arduino does not clear SC when SCC is written, so each tick
+# below sets both SI and SC, the way the arduino would have them.
+#
+# usage: python3 -m pytest tests   (or python3 -m unittest discover tests)
+
+import unittest
+from unittest import mock
+import fakehw
+import arduino_reg_map as reg
+import arduino_wb
+import inputservice
+
+class TestInputService(unittest.TestCase):
+    def setUp(self):
+        self.clock = fakehw.FakeClock()
+        patcher = mock.patch.object(arduino_wb, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ard = arduino_wb.Arduino_wb(use_shadow=True)
+        self.fake = self.ard._bus._bus
+        self.fake.regs[(self.ard._addr, reg.SIGV)] = reg.SIGV_BLOCK_WRITE
+        self.inputs = inputservice.InputService(self.ard)
+        self.tick(si=0x01, sc=0x00)  # the first update reads the starting values
+
+    def tick(self, si, sc):
+        self.fake.regs[(self.ard._addr, reg.SI)] = si
+        self.fake.regs[(self.ard._addr, reg.SC)] = sc
+        self.clock.advance(0.010)
+        self.ard.begin_tick()
+        return self.inputs.update()
+
+    def test_starting_values(self):
+        self.assertTrue(self.inputs.get_value(3))
+        self.assertEqual(self.inputs.get_digital("D4"), (True, False))
+        self.assertEqual(self.inputs.get_events(), [])
+
+    def test_edges(self):
+        self.assertTrue(self.tick(si=0x02, sc=0x03))
+        self.assertEqual([e[:2] for e in self.inputs.get_events()], [(3, "falling"), (4, "rising")])
+        self.assertFalse(self.inputs.get_value("D3"))
+        self.assertTrue(self.inputs.get_value("D4"))
+        self.assertEqual(self.inputs.get_edge_count(4), 1)
+        self.assertEqual(self.inputs.get_pulse_count(4), 0)
+
+    def test_short_pulse_gives_both_edges(self):
+        self.tick(si=0x01, sc=0x04)
+        self.assertEqual([e[:2] for e in self.inputs.get_events()], [(5, "rising"), (5, "falling")])
+        self.assertEqual(self.inputs.get_pulse_count("D5"), 1)
+        self.assertEqual(self.inputs.get_edge_count("D5"), 2)
+
+    def test_change_bits_are_cleared_in_one_write(self):
+        self.fake.clear_log()
+        self.tick(si=0x03, sc=0x02)
+        writes = [e for e in self.fake.log if e[0] == "write_byte_data"]
+        self.assertEqual(writes, [("write_byte_data", self.ard._addr, reg.SCC, ~0x02 & 0xFF)])
+
+    def test_change_bits_are_read_from_the_bus_every_tick(self):
+        self.fake.clear_log()
+        for _ in range(5): self.tick(si=0x01, sc=0x00)
+        self.assertEqual(self.fake.count("read_i2c_block_data", reg.SI), 5)
+        self.assertEqual(self.fake.count("write_byte_data"), 0)
+        self.assertEqual(self.inputs.get_counts(), {"updates": 6, "si_uses": 1})
+
+    def test_bus_error(self):
+        self.fake.fail = True
+        self.assertFalse(self.tick(si=0x00, sc=0x01))
+        self.fake.fail = False
+        self.assertEqual(self.inputs.get_events(), [])
+
+    def test_bad_pin(self):
+        with self.assertRaises(ValueError):
+            self.inputs.get_value(9)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+# test_looptimer.py -- checks the overrun policies and the wake event in looptimer
+# EPIC Robotz, dlb, Apr 2021
+#
+# The timer runs on a fake clock, which only moves when the timer sleeps, or
+# when a test pretends that the loop did some work.
+#
+# usage: python3 -m pytest tests   (or python3 -m unittest discover tests)
+
+import unittest
+from unittest import mock
+import fakehw
+import looptimer
+
+class FakeEvent():
+    ''' Looks enough like a threading.Event for LoopTimer, on the fake clock. '''
+    def __init__(self, clock):
+        self._clock = clock
+        self._flag = False
+
+    def set(self): self._flag = True
+    def clear(self): self._flag = False
+    def is_set(self): return self._flag
+
+    def wait(self, timeout):
+        if not self._flag: self._clock.advance(timeout)
+        return self._flag
+
+class TestLoopTimer(unittest.TestCase):
+    def setUp(self):
+        self.clock = fakehw.FakeClock(start=0.0)
+        patcher = mock.patch.object(looptimer, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fixed_rate(self):
+        lt = looptimer.LoopTimer(100.0)
+        for _ in range(5):
+            self.assertTrue(lt.wait())
+            self.clock.advance(0.004)  # work
+        self.assertAlmostEqual(self.clock.now, 0.044)
+        stats = lt.get_stats()
+        self.assertEqual((stats["ticks"], stats["overruns"], stats["skipped"]), (5, 0, 0))
+        self.assertAlmostEqual(lt.get_slack(), 0.006)
+
+    def test_skip_drops_missed_ticks(self):
+        lt = looptimer.LoopTimer(100.0, policy="skip")
+        lt.wait()
+        self.clock.advance(0.035)  # an overrun of two and a half periods
+        lt.wait()
+        lt.wait()
+        self.assertAlmostEqual(self.clock.now, 0.040)
+        stats = lt.get_stats()
+        self.assertEqual((stats["ticks"], stats["overruns"], stats["skipped"]), (3, 1, 2))
+
+    def test_catchup_runs_missed_ticks_back_to_back(self):
+        lt = looptimer.LoopTimer(100.0, policy="catchup")
+        lt.wait()
+        self.clock.advance(0.035)
+        for _ in range(3): lt.wait()
+        self.assertAlmostEqual(self.clock.now, 0.035)
+        lt.wait()
+        self.assertAlmostEqual(self.clock.now, 0.040)
+        stats = lt.get_stats()
+        self.assertEqual((stats["ticks"], stats["overruns"], stats["skipped"]), (5, 1, 0))
+
+    def test_catchup_restarts_when_too_far_behind(self):
+        lt = looptimer.LoopTimer(100.0, policy="catchup")
+        lt.wait()
+        self.clock.advance(0.2)
+        lt.wait()
+        lt.wait()
+        self.assertAlmostEqual(self.clock.now, 0.21)
+        self.assertGreater(lt.get_stats()["skipped"], looptimer.max_catchup)
+
+    def test_wake_event_returns_early_without_moving_the_schedule(self):
+        lt = looptimer.LoopTimer(100.0)
+        event = FakeEvent(self.clock)
+        lt.wait(event)
+        self.clock.advance(0.003)
+        event.set()
+        self.assertFalse(lt.wait(event))
+        self.assertFalse(event.is_set())
+        self.assertAlmostEqual(self.clock.now, 0.003)
+        self.assertTrue(lt.wait(event))
+        self.assertAlmostEqual(self.clock.now, 0.010)
+        self.assertEqual(lt.get_stats()["wakes"], 1)
+
+    def test_wake_event_is_cleared_by_a_due_tick(self):
+        lt = looptimer.LoopTimer(100.0)
+        event = FakeEvent(self.clock)
+        lt.wait(event)
+        self.clock.advance(0.012)
+        event.set()
+        self.assertTrue(lt.wait(event))
+        self.assertFalse(event.is_set())
+
+    def test_bad_policy(self):
+        with self.assertRaises(ValueError):
+            looptimer.LoopTimer(100.0, policy="sometimes")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+# test_mqttrobot.py -- checks the control frame formats and publish coalescing in mqttrobot
+# EPIC Robotz, dlb, Apr 2021
+#
+# The wire formats are written out here by hand, rather than with the
+# module's own constants, so that a change to the format is caught.
+#
+# The publish tests use a fake MQTT client, so no broker is needed.
+#
+# usage: python3 -m pytest tests   (or python3 -m unittest discover tests)
+
+import os
+import struct
+import sys
+import unittest
+from unittest import mock
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sharedlib"))
+import mqttrobot
+
+class TestControlFrames(unittest.TestCase):
+    def test_decode_v1_axes_frame(self):
+        data = struct.pack("<BB6h", 0x81, 1, 32767, -32767, 0, 16384, 0, -1)
+        okay, axes = mqttrobot.decode_axes(data)
+        self.assertTrue(okay)
+        self.assertEqual(axes[:3], (1.0, -1.0, 0.0))
+        self.assertAlmostEqual(axes[3], 0.5, places=4)
+
+    def test_decode_v1_buttons_and_pov_frames(self):
+        okay, btns = mqttrobot.decode_buttons(struct.pack("<BBH", 0x81, 2, 0x801))
+        self.assertTrue(okay)
+        self.assertEqual(btns, (True,) + (False,) * 10 + (True,))
+        self.assertEqual(mqttrobot.decode_pov(struct.pack("<BBbb", 0x81, 3, -1, 1)), (True, (-1, 1)))
+
+    def test_control_frame_round_trip(self):
+        f = mqttrobot.ControlFrame()
+        f.session, f.seq, f.t_sent = 1234, 56, 789.25
+        f.mode, f.aux = "TELEOP", "ReloadUser"
+        f.axes[1] = (0.0, 1.0, 0.0, 0.0, 0.0, 0.0)
+        f.buttons[0][3] = True
+        f.povs[1] = (1, -1)
+        data = f.encode()
+        self.assertEqual(data[0], 0x82)
+        okay, g = mqttrobot.decode_control_frame(data)
+        self.assertTrue(okay)
+        self.assertEqual((g.session, g.seq, g.t_sent, g.mode, g.aux), (1234, 56, 789.25, "TELEOP", "ReloadUser"))
+        self.assertEqual(g.axes[1][1], 1.0)
+        self.assertTrue(g.buttons[0][3])
+        self.assertEqual(g.povs[1], (1, -1))
+
+    def test_text_frames(self):
+        self.assertEqual(mqttrobot.decode_axes("0.5 0 0 0 0 -1"), (True, (0.5, 0.0, 0.0, 0.0, 0.0, -1.0)))
+        self.assertFalse(mqttrobot.decode_pov("1")[0])
+
+class FakeInfo():
+    def __init__(self, mid):
+        self.mid = mid
+
+class FakeClient():
+    ''' Looks enough like a paho client for MqttRobot, and remembers what was published. '''
+    def __init__(self, *args, **kwargs):
+        self.sent = []          # tuples of (topic, payload, qos, retain)
+        self.mid = 0
+        self.ack_at_once = False  # if True, on_publish is called before publish returns
+        self.on_connect = self.on_message = self.on_publish = None
+
+    def connect_async(self, *args): pass
+    def loop_start(self): pass
+    def loop_stop(self): pass
+    def is_connected(self): return True
+
+    def publish(self, topic, payload, qos=0, retain=False, **kwargs):
+        self.mid += 1
+        self.sent.append((topic, payload, qos, retain))
+        if self.ack_at_once: self.on_publish(self, None, self.mid)
+        return FakeInfo(self.mid)
+
+class TestPublish(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.object(mqttrobot.mqtt, "Client", FakeClient):
+            self.bot = mqttrobot.MqttRobot()
+        self.client = self.bot._client
+        self.bot.register_publish("wbot/status", mqttrobot.profile_telemetry)
+
+    def payloads(self):
+        return [p for _, p, _, _ in self.client.sent]
+
+    def ack(self, mid):
+        self.client.on_publish(self.client, None, mid)
+
+    def test_profile_is_used(self):
+        self.bot.publish("wbot/status", "a")
+        self.bot.publish("wbot/other", "b")
+        self.assertEqual(self.client.sent, [("wbot/status", b"a", 0, True), ("wbot/other", b"b", 1, True)])
+
+    def test_newest_data_waits_behind_the_message_in_flight(self):
+        for data in ("a", "b", "c"): self.assertTrue(self.bot.publish("wbot/status", data))
+        self.assertEqual(self.payloads(), [b"a"])
+        self.assertEqual(self.bot.get_counts()["coal"], 1)
+        self.ack(1)
+        self.assertEqual(self.payloads(), [b"a", b"c"])
+        self.ack(2)
+        self.assertEqual(self.payloads(), [b"a", b"c"])
+        self.bot.publish("wbot/status", "d")
+        self.assertEqual(self.payloads(), [b"a", b"c", b"d"])
+
+    def test_ack_before_publish_returns(self):
+        self.client.ack_at_once = True
+        self.bot.publish("wbot/status", "a")
+        self.bot.publish("wbot/status", "b")
+        self.assertEqual(self.payloads(), [b"a", b"b"])
+
+    def test_message_in_flight_is_given_up_on(self):
+        self.bot.publish("wbot/status", "a")
+        t = mqttrobot.time.monotonic() + mqttrobot.coalesce_timeout + 0.1
+        with mock.patch.object(mqttrobot.time, "monotonic", return_value=t):
+            self.bot.publish("wbot/status", "b")
+        self.assertEqual(self.payloads(), [b"a", b"b"])
+
+    def test_profile_for_one_message_drops_held_data(self):
+        self.bot.publish("wbot/status", "a")
+        self.bot.publish("wbot/status", "b")
+        self.bot.publish("wbot/status", "now", profile=mqttrobot.profile_command)
+        self.ack(1)
+        self.assertEqual(self.payloads(), [b"a", b"now"])
+        self.assertEqual(self.client.sent[-1][2:], (1, False))
+
+    def test_reconnect_forgets_messages_in_flight(self):
+        self.bot.publish("wbot/status", "a")
+        self.bot.publish("wbot/status", "b")
+        self.client.on_connect(self.client, None, {}, 0)
+        self.bot.publish("wbot/status", "c")
+        self.assertEqual(self.payloads(), [b"a", b"c"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+# test_pca9685.py -- checks output staging and grouped writes in pca9685
+# EPIC Robotz, dlb, Apr 2021
+#
+# usage: python3 -m pytest tests   (or python3 -m unittest discover tests)
+
+import unittest
+from unittest import mock
+import fakehw
+import pca9685
+
+def make_pca(**kwargs):
+    ''' Returns (pca, fake smbus), with the init writes already cleared from the log. '''
+    pca = pca9685.PCA9685(**kwargs)
+    fake = pca._bus._bus
+    fake.clear_log()
+    return pca, fake
+
+class TestStaging(unittest.TestCase):
+    def setUp(self):
+        self.clock = fakehw.FakeClock()
+        patcher = mock.patch.object(pca9685, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pca, self.fake = make_pca(staging=True)
+
+    def test_set_pwm_waits_for_flush(self):
+        self.pca.set_pwm(3, 1500)
+        self.assertEqual(self.fake.log, [])
+        self.assertTrue(self.pca.flush())
+        ticks = self.pca.usec_to_ticks(1500)
+        self.assertEqual(self.fake.log, [("write_i2c_block_data", pca9685.default_addr,
+            pca9685.r_led0_on_L + 12, [0, 0, ticks & 0xFF, ticks >> 8])])
+
+    def test_unchanged_channel_is_not_rewritten(self):
+        self.pca.set_pwm(3, 1500)
+        self.pca.flush()
+        self.pca.set_pwm(3, 1500)
+        self.pca.flush()
+        self.assertEqual(len(self.fake.log), 1)
+        self.assertEqual(self.pca.get_staging_stats(), {"written": 1, "avoided": 1})
+        self.pca.set_pwm(3, 1600)
+        self.pca.flush()
+        self.assertEqual(len(self.fake.log), 2)
+
+    def test_keepalive_rewrites_unchanged_channel(self):
+        self.pca.set_keepalive(3, 0.2)
+        self.pca.set_pwm(3, 1500)
+        self.pca.flush()
+        self.clock.advance(0.1)
+        self.pca.flush()
+        self.assertEqual(len(self.fake.log), 1)
+        self.clock.advance(0.15)
+        self.pca.flush()
+        self.assertEqual(len(self.fake.log), 2)
+
+    def test_failed_flush_is_retried(self):
+        self.pca.set_pwm(3, 1500)
+        self.fake.fail = True
+        self.assertFalse(self.pca.flush())
+        self.fake.fail = False
+        self.assertTrue(self.pca.flush())
+        self.assertEqual(len(self.fake.log), 2)
+
+    def test_killall_keeps_staged_values_in_step(self):
+        self.pca.set_pwm(3, 1500)
+        self.pca.flush()
+        self.fake.clear_log()
+        self.assertTrue(self.pca.killall())
+        self.assertEqual(self.fake.log, [("write_i2c_block_data", pca9685.default_addr,
+            pca9685.r_all_led_on_L, [0, 0, 0, 0])])
+        # Channel 3 is staged at zero, which is already on the chip, and
+        # channels that were never used are not picked up by flush().
+        self.pca.flush()
+        self.assertEqual(len(self.fake.log), 1)
+        self.assertEqual(list(self.pca._staged.keys()), [3])
+
+class TestGroupedWrites(unittest.TestCase):
+    def test_consecutive_channels_share_a_block(self):
+        pca, fake = make_pca()
+        self.assertTrue(pca.set_pwm_many({0: 1500, 1: 1500, 2: 1500, 5: 1500}))
+        self.assertEqual(fake.count(), 2)
+        self.assertEqual([e[2] for e in fake.log], [pca9685.r_led0_on_L, pca9685.r_led0_on_L + 20])
+        self.assertEqual(len(fake.log[0][3]), 12)
+
+    def test_blocks_are_limited_to_the_smbus_size(self):
+        pca, fake = make_pca()
+        pca.set_pwm_many({chan: 1500 for chan in range(12)})
+        self.assertEqual([len(e[3]) for e in fake.log], [4 * pca9685.max_block_chans, 16])
+
+    def test_staged_channels_are_grouped_on_flush(self):
+        pca, fake = make_pca(staging=True)
+        for chan in (6, 7, 8): pca.set_pwm(chan, 1500)
+        pca.flush()
+        self.assertEqual(fake.count("write_i2c_block_data"), 1)
+
+    def test_without_auto_increment_registers_are_written_one_at_a_time(self):
+        pca, fake = make_pca(auto_increment=False)
+        pca.set_pwm_many({0: 1500, 1: 1500})
+        self.assertEqual(fake.count("write_byte_data"), 8)
+        self.assertEqual(fake.count("write_i2c_block_data"), 0)
+
+if __name__ == "__main__":
+    unittest.main()
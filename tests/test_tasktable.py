@@ -0,0 +1,82 @@
+# test_tasktable.py -- checks task selection in tasktable
+# EPIC Robotz, dlb, Apr 2021
+#
+# usage: python3 -m pytest tests   (or python3 -m unittest discover tests)
+
+import contextlib
+import io
+import unittest
+import fakehw
+import tasktable
+
+class TestTaskTable(unittest.TestCase):
+    def setUp(self):
+        self.tasks = tasktable.TaskTable(100.0)
+        self.ran = []  # tuples of (tick, name)
+
+    def add(self, name, **kwargs):
+        return self.tasks.add_task(name, lambda: self.ran.append((self.tasks.get_tick(), name)), **kwargs)
+
+    def run_ticks(self, n):
+        for _ in range(n): self.tasks.run_tick()
+
+    def ticks_of(self, name):
+        return [tick for tick, n in self.ran if n == name]
+
+    def test_period_is_rounded_to_ticks(self):
+        self.assertEqual(self.tasks.secs_to_ticks(None), 1)
+        self.assertEqual(self.tasks.secs_to_ticks(0.001), 1)
+        self.assertEqual(self.tasks.secs_to_ticks(0.104), 10)
+
+    def test_period_and_phase(self):
+        self.add("fast")
+        self.add("slow", period=0.05, phase=2)
+        self.run_ticks(12)
+        self.assertEqual(len(self.ticks_of("fast")), 12)
+        # get_tick() has already counted the tick that is running.
+        self.assertEqual(self.ticks_of("slow"), [3, 8])
+
+    def test_slow_tasks_are_kept_apart(self):
+        a = self.add("a", period=0.04)
+        b = self.add("b", period=0.04)
+        c = self.add("c", period=0.08)
+        self.assertEqual(len({a.phase, b.phase, c.phase % 4}), 3)
+        self.run_ticks(40)
+        ticks = self.ticks_of("a") + self.ticks_of("b") + self.ticks_of("c")
+        self.assertEqual(len(ticks), len(set(ticks)))
+
+    def test_priority_order(self):
+        self.add("late", priority=20)
+        self.add("early", priority=1)
+        self.add("middle")
+        self.add("middle2")
+        self.run_ticks(1)
+        self.assertEqual([n for _, n in self.ran], ["early", "middle", "middle2", "late"])
+
+    def test_event_ticks(self):
+        self.add("control", on_event=True)
+        self.add("other")
+        self.tasks.run_tick(event=True)
+        self.assertEqual([n for _, n in self.ran], ["control"])
+        self.assertEqual(self.tasks.get_tick(), 0)
+
+    def test_failing_task_does_not_stop_the_others(self):
+        def fail(): raise RuntimeError("boom")
+        self.tasks.add_task("bad", fail, priority=1)
+        self.add("good")
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            self.run_ticks(3)
+        self.assertEqual(len(self.ticks_of("good")), 3)
+        stats = {s["name"]: s for s in self.tasks.get_stats()}
+        self.assertEqual(stats["bad"]["errors"], 3)
+        self.assertEqual(stats["good"]["errors"], 0)
+
+    def test_duplicate_and_remove(self):
+        self.add("a")
+        with self.assertRaises(ValueError):
+            self.add("a")
+        self.assertTrue(self.tasks.remove_task("a"))
+        self.assertFalse(self.tasks.remove_task("a"))
+
+if __name__ == "__main__":
+    unittest.main()
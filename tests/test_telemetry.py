@@ -0,0 +1,72 @@
+# test_telemetry.py -- checks how telemetry splits up and collects the arduino's registers
+# EPIC Robotz, dlb, Apr 2021
+#
+# usage: python3 -m pytest tests   (or python3 -m unittest discover tests)
+
+import unittest
+import fakehw
+import arduino_reg_map as reg
+import arduino_wb
+import telemetry
+
+class TestMakeChunks(unittest.TestCase):
+    def check(self, nregs, budget):
+        chunks = telemetry.make_chunks(nregs, budget)
+        covered = []
+        for first, n in chunks:
+            covered.extend(range(first, first + n))
+            for g0, g1 in telemetry.atomic_groups:
+                if first <= g0 <= g1 < nregs:
+                    inside = [first <= r < first + n for r in range(g0, g1 + 1)]
+                    self.assertTrue(all(inside) or not any(inside), "group split by %s" % ((first, n),))
+        self.assertEqual(covered, list(range(nregs)))
+        return chunks
+
+    def test_all_budgets(self):
+        for budget in range(1, 25):
+            self.check(reg.LAST_V2 + 1, budget)
+
+    def test_chunks_keep_to_the_budget_outside_groups(self):
+        self.assertEqual(self.check(21, 4), [(0, 2), (2, 4), (6, 4), (10, 4), (14, 4), (18, 3)])
+
+    def test_group_is_one_chunk_even_over_budget(self):
+        self.assertEqual(self.check(8, 1), [(0, 1), (1, 1), (2, 4), (6, 1), (7, 1)])
+
+class TestTelemetry(unittest.TestCase):
+    def setUp(self):
+        self.ard = arduino_wb.Arduino_wb()
+        self.fake = self.ard._bus._bus
+        self.fake.regs[(self.ard._addr, reg.SIGV)] = reg.SIGV_BLOCK_WRITE
+        self.fake.regs[(self.ard._addr, reg.BAT_M)] = 124
+        self.fake.regs[(self.ard._addr, reg.BAT_L)] = 51
+        self.tel = telemetry.Telemetry(self.ard)
+        self.nchunks = self.tel.get_counts()["chunks"]
+
+    def test_snapshot_after_all_chunks(self):
+        self.assertEqual(self.tel.get_snapshot(), (False, None, 0.0))
+        for _ in range(self.nchunks - 1): self.tel.step()
+        self.assertEqual(self.tel.get_frame_count(), 0)
+        self.tel.step()
+        okay, values, _ = self.tel.get_snapshot()
+        self.assertTrue(okay)
+        self.assertEqual(len(values), reg.LAST_V2 + 1)
+        self.assertEqual(self.tel.get_battery_voltages(), (12.4, 5.1))
+
+    def test_one_block_read_per_step(self):
+        self.ard.supports_block_read()
+        self.fake.clear_log()
+        for _ in range(self.nchunks): self.tel.step()
+        self.assertEqual(self.fake.count(), self.nchunks)
+
+    def test_failed_read_spoils_only_its_snapshot(self):
+        self.fake.fail = True
+        self.tel.step()
+        self.fake.fail = False
+        for _ in range(self.nchunks - 1): self.tel.step()
+        self.assertFalse(self.tel.get_snapshot()[0])
+        for _ in range(self.nchunks): self.tel.step()
+        self.assertTrue(self.tel.get_snapshot()[0])
+        self.assertEqual(self.tel.get_counts()["errors"], 1)
+
+if __name__ == "__main__":
+    unittest.main()